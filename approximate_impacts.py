@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "shapes"))
+
+from tauid.impacts import (approximate_impacts, find_pois, large_impacts,
+                           merge_impacts, rate_parameters, read_fit_result)
+
+import logging
+logger = logging.getLogger()
+
+
+def setup_logging(level=logging.INFO):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description=
+        "Approximate nuisance impacts from the post-fit covariance matrix of a FitDiagnostics fit, written in the JSON format of combineTool.py -M Impacts for plotImpacts.py."
+    )
+    parser.add_argument(
+        "--input",
+        required=True,
+        type=str,
+        help="Output of FitDiagnostics, e.g. fitDiagnostics2017.root.")
+    parser.add_argument(
+        "--fit",
+        default="fit_s",
+        type=str,
+        help="Fit result in the input file.")
+    parser.add_argument(
+        "--pois",
+        default=None,
+        nargs="+",
+        type=str,
+        help="POIs. By default the floating parameters of the fit without prefit constraint, except for the rate parameters of --datacard.")
+    parser.add_argument(
+        "--datacard",
+        default="combined.txt.cmb",
+        type=str,
+        help="Datacard of the fit, used to find the rate parameters if --pois is not given.")
+    parser.add_argument(
+        "--output",
+        required=True,
+        type=str,
+        help="JSON file with the impacts, e.g. 2017_impacts.json.")
+    parser.add_argument(
+        "--threshold",
+        default=None,
+        type=float,
+        help="Write the parameters with an approximate impact above this fraction of the POI error to --named-output.")
+    parser.add_argument(
+        "--named-output",
+        default=None,
+        type=str,
+        help="Text file with the comma separated parameters above the threshold, to be used with combineTool.py -M Impacts --named.")
+    parser.add_argument(
+        "--full",
+        default=None,
+        type=str,
+        help="Impacts of combineTool.py -M Impacts for some of the parameters, which replace the approximate ones.")
+    return parser.parse_args()
+
+
+def main(args):
+    result = read_fit_result(args.input, args.fit)
+    pois = args.pois
+    if pois is None:
+        rates = set()
+        if os.path.exists(args.datacard):
+            rates = rate_parameters(args.datacard)
+        else:
+            logger.warning(
+                "Datacard %s does not exist, all unconstrained parameters are taken as POIs.",
+                args.datacard)
+        pois = find_pois(result, rates)
+        if not pois:
+            logger.critical("Fit %s in %s has no POI.", args.fit, args.input)
+            raise Exception
+        logger.info("POIs: %s", ", ".join(pois))
+    impacts = approximate_impacts(result, pois)
+    logger.info("Approximated the impacts of %d parameters.",
+                len(impacts["params"]))
+
+    if args.threshold is not None:
+        names = large_impacts(impacts, args.threshold)
+        logger.info("%d parameters have an impact above %.3g of the POI error.",
+                    len(names), args.threshold)
+        if args.named_output is not None:
+            with open(args.named_output, "w") as named_file:
+                named_file.write(",".join(names) + "\n")
+
+    if args.full is not None:
+        with open(args.full) as full_file:
+            full = json.load(full_file)
+        impacts = merge_impacts(impacts, full)
+        logger.info("Took the impacts of %d parameters from %s.",
+                    len(full["params"]), args.full)
+
+    with open(args.output, "w") as output_file:
+        json.dump(impacts, output_file, indent=2, sort_keys=True)
+    logger.info("Wrote the impacts to %s.", args.output)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging()
+    main(args)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import subprocess
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "shapes"))
+
+from tauid.fitcache import (BATCH_OPTIONS, FitCache, fit_key, fit_options,
+                            split_command)
+
+import logging
+logger = logging.getLogger()
+
+
+def setup_logging(level=logging.INFO):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description=
+        "Run a combineTool.py fit and restore its outputs from the fit cache if the workspace and the fit options did not change, e.g. cached_fit.py --outputs 'fitDiagnostics*.root' -- combineTool.py -M FitDiagnostics ..."
+    )
+    parser.add_argument(
+        "--cache-directory",
+        default=os.environ.get("FIT_CACHE_DIRECTORY", "fit_cache"),
+        type=str,
+        help="Directory of the fit cache, $FIT_CACHE_DIRECTORY by default.")
+    parser.add_argument(
+        "--cache-size",
+        default=float(os.environ.get("FIT_CACHE_SIZE", 10.0)),
+        type=float,
+        help="Maximum size of the fit cache in GB, $FIT_CACHE_SIZE or 10 by default. The least recently used fits are removed above it.")
+    parser.add_argument(
+        "--workspace-scripts",
+        default=[
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)),
+                "produce_workspace.sh")
+        ],
+        nargs="+",
+        type=str,
+        help="Scripts building the workspaces from their datacards, whose content is part of the cache key. produce_workspace.sh by default.")
+    parser.add_argument(
+        "--outputs",
+        required=True,
+        nargs="+",
+        type=str,
+        help="Patterns of the output files of the fit of every workspace.")
+    parser.add_argument(
+        "command", nargs=argparse.REMAINDER, help="combineTool.py command.")
+    args = parser.parse_args()
+    if args.command and args.command[0] == "--":
+        args.command = args.command[1:]
+    return args
+
+
+def main(args):
+    workspaces, arguments = split_command(args.command)
+    if not workspaces or any(option in arguments for option in BATCH_OPTIONS):
+        sys.exit(subprocess.call(args.command))
+    if "--there" in arguments:
+        directories = [
+            os.path.dirname(workspace) or "." for workspace in workspaces
+        ]
+    elif len(workspaces) == 1:
+        directories = ["."]
+    else:
+        logger.warning(
+            "Fits of several workspaces without --there write to the same directory and are not cached."
+        )
+        sys.exit(subprocess.call(args.command))
+
+    cache = FitCache(args.cache_directory, args.cache_size * 1e9)
+    options = fit_options(arguments)
+    keys = [
+        fit_key(workspace, options, args.outputs, args.workspace_scripts)
+        for workspace in workspaces
+    ]
+    missing = []
+    for workspace, directory, key in zip(workspaces, directories, keys):
+        if cache.restore(key, directory):
+            logger.info("Restored the fit of %s from the fit cache.",
+                        workspace)
+        else:
+            missing.append(workspace)
+    if not missing:
+        return
+
+    logger.info("Fit %d of %d workspaces.", len(missing), len(workspaces))
+    # The workspaces replace the ones of the original command at the position
+    # of the first -d.
+    position = [
+        i for i, argument in enumerate(args.command)
+        if argument in ("-d", "--datacard")
+    ][0]
+    command = args.command[:position] + ["-d"] + missing + [
+        argument for argument in split_command(args.command[position:])[1]
+    ]
+    code = subprocess.call(command)
+    if code != 0:
+        sys.exit(code)
+    for workspace, directory, key in zip(workspaces, directories, keys):
+        if workspace in missing:
+            cache.store(key, directory, args.outputs,
+                        " ".join(args.command))
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging()
+    main(args)
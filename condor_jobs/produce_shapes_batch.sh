@@ -2,11 +2,39 @@
 
 PWD=$1
 ERA=$2
-WP=$3
-CHANNELS=${@:4}
+WPS=${3//,/ }
+SHARD=$4
+CHANNELS=${@:5}
 
 cd $PWD
 BINNING=TauIDSF_measurement/shapes/binning.yaml
+# Optional: backend of the production, the shards need tdf or numpy
+BACKEND=${BACKEND:-tdf}
+# Optional: RESUME=1 continues from the checkpoint of an earlier job with
+# the same tag, e.g. a pre-empted one. A fresh submission starts from scratch.
+RESUME=${RESUME:-0}
+
+TAG=${ERA}_${WPS}
+if [ $(echo $WPS | wc -w) -gt 1 ]
+then
+    TAG=${ERA}
+fi
+
+# Shard k/N fills its part of the inputs, merge produces the shapes from all
+# shards and all produces the shapes in a single job.
+SHARD_ARGUMENTS=""
+if [ "$SHARD" == "merge" ]
+then
+    SHARD_ARGUMENTS="--merge-shards"
+elif [ "$SHARD" != "all" ]
+then
+    SHARD_ARGUMENTS="--shard $SHARD"
+fi
+RESUME_ARGUMENTS=""
+if [ "$RESUME" == 1 ]
+then
+    RESUME_ARGUMENTS="--resume"
+fi
 
 
 source utils/setup_python.sh
@@ -20,9 +48,12 @@ python TauIDSF_measurement/shapes/produce_shapes_${ERA}.py \
     --binning $BINNING \
     --channels $CHANNELS \
     --era $ERA \
-    --tag ${ERA}_${WP} \
-    --working-point $WP \
-    --num-threads 8
+    --tag $TAG \
+    --working-point $WPS \
+    --backend $BACKEND \
+    --num-threads 8 \
+    $RESUME_ARGUMENTS \
+    $SHARD_ARGUMENTS
 
 # Normalize fake-factor shapes to nominal
 # python fake-factor-application/normalize_shifts.py ${ERA}_shapes.root
@@ -7,23 +7,42 @@ mkdir -p error log out
 # jobs will be submitted directly from this repository, so the logfiles created by the job will be updated.
 ERA=$1
 WPs=${@:2}
+# Number of shards per channel, see TauIDSF_measurement/shapes/tauid/shards.py
+NUM_SHARDS=${NUM_SHARDS:-1}
+# BACKEND and RESUME are passed to the jobs through the environment, see
+# produce_shapes_batch.sh
 # CHANNELS=${@:3}
 PWD=`pwd`
 # write arguments.txt
 WORKDIR="${PWD}/../.."
 
+if [ $NUM_SHARDS -gt 1 ]
+then
+    SHARDS=$(seq -f "%g/$NUM_SHARDS" 0 $(($NUM_SHARDS - 1)))
+else
+    SHARDS="all"
+fi
+
 for CHANNEL in "mt" "mm" 
 do  
-    if [ $CHANNEL == "mm" ]; then
-        echo "$WORKDIR $ERA mm $CHANNEL"
-    else
-        for WP in $WPs
-        do
-            echo "$WORKDIR $ERA $WP $CHANNEL"
-        done
-    fi
+    for SHARD in $SHARDS
+    do
+        if [ $CHANNEL == "mm" ]; then
+            echo "$WORKDIR $ERA mm $SHARD $CHANNEL"
+        else
+            # All working points are produced by the same job, passed as a comma
+            # separated list.
+            echo "$WORKDIR $ERA $(echo $WPs | tr ' ' ',') $SHARD $CHANNEL"
+        fi
+    done
 done > arguments.txt
 
+if [ $NUM_SHARDS -gt 1 ]
+then
+    echo "Merge the shards after all jobs are done with"
+    echo "    ./produce_shapes_batch.sh $WORKDIR $ERA <working points> merge <channel>"
+fi
+
 ## source LCG Stack and submit the job
 
 if uname -a | grep -E 'el7' -q
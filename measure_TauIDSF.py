@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import sys
+
+HERE = os.path.relpath(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(HERE, "shapes"))
+
+from tauid.pipeline import Pipeline, Stage
+
+import logging
+logger = logging.getLogger()
+
+CATEGORIZATIONS = ["pt_binned", "dm_binned", "inclusive"]
+
+
+def setup_logging(level=logging.INFO):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description=
+        "Run the Tau ID SF measurement as a graph of stages. Independent stages run in parallel and stages whose inputs did not change are skipped. Has to be run from the top-level directory of the analysis repository."
+    )
+    parser.add_argument(
+        "--eras",
+        required=True,
+        nargs="+",
+        type=str,
+        help="Eras to be measured.")
+    parser.add_argument(
+        "--working-points",
+        required=True,
+        nargs="+",
+        type=str,
+        help="Tau ID working points to be measured.")
+    parser.add_argument(
+        "--categorizations",
+        default=CATEGORIZATIONS,
+        nargs="+",
+        choices=CATEGORIZATIONS,
+        type=str,
+        help="Categorizations of the measurement.")
+    parser.add_argument(
+        "--skip-impacts",
+        action="store_true",
+        help="Do not compute the nuisance impacts.")
+    parser.add_argument(
+        "--quick-impacts",
+        action="store_true",
+        help="Approximate the nuisance impacts from the post-fit covariance matrix instead of fitting every nuisance.")
+    parser.add_argument(
+        "--impact-threshold",
+        default=None,
+        type=float,
+        help="Fit only the nuisances with an approximate impact above this fraction of the POI error and approximate all others.")
+    parser.add_argument(
+        "--num-workers",
+        default=4,
+        type=int,
+        help="Number of stages running at the same time.")
+    parser.add_argument(
+        "--state-directory",
+        default="tauid_pipeline",
+        type=str,
+        help="Directory with the hashes of the finished stages and the logs of all stages.")
+    parser.add_argument(
+        "--force",
+        default=[],
+        nargs="+",
+        type=str,
+        help="Rerun the stages matching these patterns and all stages depending on them, e.g. 'shapes/*' after new ntuples.")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only list the stages which would run.")
+    return parser.parse_args()
+
+
+def script(name):
+    return os.path.join(HERE, name)
+
+
+def measurement_stages(era,
+                       working_points,
+                       categorizations,
+                       impacts=True,
+                       quick_impacts=False,
+                       impact_threshold=None):
+    """Stages of the measurement of one era."""
+    # The approximate impacts are computed from the result of robustHesse
+    approximate = quick_impacts or impact_threshold is not None
+    impact_environment = ""
+    if quick_impacts:
+        impact_environment = "QUICK_IMPACTS=1 "
+    elif impact_threshold is not None:
+        impact_environment = "IMPACT_THRESHOLD={} ".format(impact_threshold)
+    stages = [
+        Stage(("shapes", era),
+              "{} {} \"{}\" mt mm".format(
+                  script("produce_shapes.sh"), era, " ".join(working_points)),
+              inputs=[
+                  script("produce_shapes.sh"),
+                  script("shapes/produce_shapes_{}.py".format(era)),
+                  script("shapes/binning.yaml"),
+                  script("shapes/tauid/*.py")
+              ],
+              outputs=[
+                  "{}_{}_shapes.root".format(era, working_point)
+                  for working_point in working_points
+              ])
+    ]
+    for working_point in working_points:
+        # The synced shapes and the datacards are written from the fixed
+        # path ${ERA}_shapes.root, so only one working point of the era can
+        # be converted at a time.
+        commands = [
+            "ln -sf {0}_{1}_shapes.root {0}_shapes.root".format(
+                era, working_point),
+            "bash shapes/convert_to_synced_shapes.sh {}".format(era)
+        ]
+        outputs = []
+        for categories in categorizations:
+            for embedding in (0, 1):
+                commands.append("{} {} {} 0 {} {} mt".format(
+                    script("produce_datacard.sh"), era, categories,
+                    embedding, working_point))
+                outputs.append("output/{}_tauid_{}_{}_{}".format(
+                    era, working_point, categories,
+                    "EMB" if embedding else "MC"))
+        stages.append(
+            Stage(("datacards", era, working_point),
+                  " && ".join(commands) + "; CODE=$?; rm -f {}_shapes.root; "
+                  "exit $CODE".format(era),
+                  inputs=[
+                      script("produce_datacard.sh"),
+                      "shapes/convert_to_synced_shapes.sh",
+                      "{}_{}_shapes.root".format(era, working_point)
+                  ],
+                  outputs=outputs,
+                  dependencies=[("shapes", era)],
+                  locks=["{}_shapes.root".format(era)]))
+
+        for categories in categorizations:
+            for embedding in (0, 1):
+                key = (era, working_point, categories,
+                       "EMB" if embedding else "MC")
+                directory = "output/{}_tauid_{}_{}_{}".format(
+                    era, working_point, categories, key[-1])
+                environment = "WORKING_POINT={} ".format(working_point)
+                stages.append(
+                    Stage(("workspace", ) + key,
+                          environment + "{} {} {} {}".format(
+                              script("produce_workspace.sh"), era,
+                              categories, embedding),
+                          inputs=[script("produce_workspace.sh")],
+                          outputs=[
+                              directory + "/htt_mt*/combined.txt.cmb.root"
+                          ],
+                          dependencies=[("datacards", era, working_point)]))
+                stages.append(
+                    Stage(("fit", ) + key,
+                          environment + "{} {} {} {} {}".format(
+                              script("signal_strength.sh"), era, categories,
+                              categories, embedding),
+                          inputs=[script("signal_strength.sh")],
+                          outputs=[
+                              directory +
+                              "/htt_mt*/higgsCombine{}.MultiDimFit.mH125.root".
+                              format(era)
+                          ],
+                          dependencies=[("workspace", ) + key]))
+                stages.append(
+                    Stage(("robustHesse", ) + key,
+                          environment + "{} {} {} robustHesse {}".format(
+                              script("signal_strength.sh"), era, categories,
+                              embedding),
+                          inputs=[script("signal_strength.sh")],
+                          outputs=[
+                              directory +
+                              "/htt_mt*/fitDiagnostics{}.root".format(era)
+                          ],
+                          dependencies=[("workspace", ) + key]))
+                if impacts:
+                    stages.append(
+                        Stage(("impacts", ) + key,
+                              environment + impact_environment +
+                              "{} {} {} {}".format(
+                                  script("nuisance_impacts.sh"), era,
+                                  categories, embedding),
+                              inputs=[script("nuisance_impacts.sh")] +
+                              ([
+                                  script("approximate_impacts.py"),
+                                  script("shapes/tauid/impacts.py")
+                              ] if approximate else []),
+                              outputs=[
+                                  directory +
+                                  "/htt_mt*/{}_impacts.json".format(era)
+                              ],
+                              dependencies=[("workspace", ) + key] +
+                              ([("robustHesse", ) + key]
+                               if approximate else [])))
+                stages.append(
+                    Stage(("postfit", ) + key,
+                          environment + "{} {} {} {}".format(
+                              script("prefit_postfit_shapes.sh"), era,
+                              categories, embedding),
+                          inputs=[script("prefit_postfit_shapes.sh")],
+                          outputs=[
+                              directory +
+                              "/htt_mt*/{}_datacard_shapes_postfit_sb.root".
+                              format(era)
+                          ],
+                          dependencies=[("robustHesse", ) + key]))
+                # The plots are collected in ${ERA}_plots in the working
+                # directory before they are moved to the datacard directory.
+                stages.append(
+                    Stage(("plots", ) + key,
+                          environment + "{} {} {} 0 {} {}".format(
+                              script("plot_shapes.sh"), era, categories,
+                              embedding, "mt" if embedding else "mt mm"),
+                          inputs=[
+                              script("plot_shapes.sh"),
+                              script("plot_shapes.py")
+                          ],
+                          outputs=[directory + "/htt_mt*/{}_plots".format(era)],
+                          dependencies=[("postfit", ) + key],
+                          locks=["{}_plots".format(era)]))
+    return stages
+
+
+def main(args):
+    for directory in ["shapes", "datacards", "combine", "plotting", "utils"]:
+        if not os.path.isdir(directory):
+            logger.critical(
+                "Directory %s not found, you are not in the top-level directory of the analysis repository?",
+                directory)
+            raise Exception
+    stages = []
+    for era in args.eras:
+        stages += measurement_stages(era, args.working_points,
+                                     args.categorizations,
+                                     not args.skip_impacts,
+                                     args.quick_impacts,
+                                     args.impact_threshold)
+    pipeline = Pipeline(stages, args.state_directory)
+    if args.force:
+        pipeline.force(args.force)
+    pipeline.run(args.num_workers, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging()
+    main(args)
@@ -3,6 +3,15 @@
 ERA=$1
 CATEGORIES=$2
 EMBEDDING=$3
+# Optional: working point of the impacts, tight by default
+WORKING_POINT=${WORKING_POINT:-tight}
+# Optional: approximate impacts from the post-fit covariance matrix of
+# fitDiagnostics${ERA}.root written by signal_strength.sh robustHesse, see
+# approximate_impacts.py. QUICK_IMPACTS=1 only computes the approximation,
+# IMPACT_THRESHOLD runs the full fits only for the nuisances with an
+# approximate impact above this fraction of the POI error.
+QUICK_IMPACTS=${QUICK_IMPACTS:-0}
+IMPACT_THRESHOLD=${IMPACT_THRESHOLD:-}
 
 SUBMIT=false
 
@@ -14,7 +23,32 @@ fi
 
 source utils/setup_cmssw.sh
 # INPUT=${PWD}/output/${ERA}_tauid_*_${CATEGORIES}*
-INPUT=${PWD}/output/${ERA}_tauid_tight_${CATEGORIES}_${SUFFIX}
+INPUT=${PWD}/output/${ERA}_tauid_${WORKING_POINT}_${CATEGORIES}_${SUFFIX}
+
+# Fits of unchanged workspaces with unchanged options are restored from the
+# fit cache, see cached_fit.py
+CACHED_FIT="python $(dirname $(readlink -f $0))/cached_fit.py --cache-directory ${FIT_CACHE_DIRECTORY:-${PWD}/fit_cache}"
+APPROXIMATE_IMPACTS="python $(dirname $(readlink -f $0))/approximate_impacts.py --input fitDiagnostics${ERA}.root"
+
+if [ "$QUICK_IMPACTS" == 1 ]
+then
+    for DIR in ${INPUT}/htt_mt*
+    do
+        pushd $DIR
+        $APPROXIMATE_IMPACTS --output ${ERA}_impacts.json
+        plotImpacts.py -i ${ERA}_impacts.json -o ${ERA}_impacts
+        popd
+    done
+    exit 0
+fi
+
+# Comma separated nuisances with an approximate impact above the threshold,
+# empty if there is none
+function named_nuisances {
+    $APPROXIMATE_IMPACTS --output ${ERA}_impacts_approximate.json \
+        --threshold $IMPACT_THRESHOLD --named-output ${ERA}_impacts_named.txt
+    cat ${ERA}_impacts_named.txt
+}
 
 if [ $EMBEDDING == 1 ]
 then
@@ -33,7 +67,21 @@ then
     for DIR in ${INPUT}/htt_mt*
     do
         pushd $DIR
-        combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
+        NAMED=""
+        if [ -n "$IMPACT_THRESHOLD" ]
+        then
+            NAMED=$(named_nuisances)
+            if [ -z "$NAMED" ]
+            then
+                echo "[INFO] No nuisance has an approximate impact above the threshold."
+                cp ${ERA}_impacts_approximate.json ${ERA}_impacts.json
+                plotImpacts.py -i ${ERA}_impacts.json -o ${ERA}_impacts
+                popd
+                continue
+            fi
+        fi
+        $CACHED_FIT --outputs "higgsCombine_initialFit_Test.MultiDimFit.mH125.root" -- \
+            combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
             --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
             --doInitialFit --robustFit 1 --setParameterRanges CMS_htt_doublemutrg_Run${ERA}=$RANGE \
             --parallel 25 -v1
@@ -42,19 +90,27 @@ then
             echo "Trying to submit"
             combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
                 --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
-                --doFits --robustFit 1 --setParameterRanges CMS_htt_doublemutrg_Run${ERA}=$RANGE \
+                --doFits --robustFit 1 ${NAMED:+--named $NAMED} --setParameterRanges CMS_htt_doublemutrg_Run${ERA}=$RANGE \
                 -v1 --job-mode condor --dry-run
             chmod u+x condor_combine_task.sh
             echo "getenv = true\n+RemoteJob = True\n+RequestWalltime = 1800\naccounting_group = cms.higgs\nuniverse = docker\ndocker_image = mschnepf/docker_cc7\n" >> condor_combine_task.sub
         else
-            combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
+            $CACHED_FIT --outputs "higgsCombine_paramFit_Test_*.MultiDimFit.mH125.root" -- \
+                combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
                 --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
-                --doFits --robustFit 1 --setParameterRanges CMS_htt_doublemutrg_Run${ERA}=$RANGE \
+                --doFits --robustFit 1 ${NAMED:+--named $NAMED} --setParameterRanges CMS_htt_doublemutrg_Run${ERA}=$RANGE \
                 # --setCrossingTolerance 9.99999999975e-05 \
                 # --setRobustFitTolerance 0.10000000001 \
                 --parallel 25 -v1 | tee nuisance_impacts_fits.log
         fi
-        combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root --output ${ERA}_impacts.json
+        $CACHED_FIT --outputs "${ERA}_impacts.json" -- \
+            combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root --output ${ERA}_impacts.json \
+            ${NAMED:+--named $NAMED}
+        if [ -n "$NAMED" ]
+        then
+            # Approximate impacts of the nuisances without full fits
+            $APPROXIMATE_IMPACTS --full ${ERA}_impacts.json --output ${ERA}_impacts.json
+        fi
         plotImpacts.py -i ${ERA}_impacts.json -o ${ERA}_impacts
         popd
     done
@@ -74,7 +130,21 @@ else
     for DIR in ${INPUT}/htt_mt*
     do
         pushd $DIR
-        combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
+        NAMED=""
+        if [ -n "$IMPACT_THRESHOLD" ]
+        then
+            NAMED=$(named_nuisances)
+            if [ -z "$NAMED" ]
+            then
+                echo "[INFO] No nuisance has an approximate impact above the threshold."
+                cp ${ERA}_impacts_approximate.json ${ERA}_impacts.json
+                plotImpacts.py -i ${ERA}_impacts.json -o ${ERA}_impacts
+                popd
+                continue
+            fi
+        fi
+        $CACHED_FIT --outputs "higgsCombine_initialFit_Test.MultiDimFit.mH125.root" -- \
+            combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
             --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
             --doInitialFit --robustFit 1 --setParameterRanges CMS_htt_zjXsec=$RANGE \
             --parallel 25 -v1
@@ -83,19 +153,27 @@ else
             echo "Trying to submit"
             combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
                 --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
-                --doFits --robustFit 1 --setParameterRanges CMS_htt_zjXsec=$RANGE \
+                --doFits --robustFit 1 ${NAMED:+--named $NAMED} --setParameterRanges CMS_htt_zjXsec=$RANGE \
                 -v1 --job-mode condor --dry-run
             chmod u+x condor_combine_task.sh
             echo "getenv = true\n+RemoteJob = True\n+RequestWalltime = 1800\naccounting_group = cms.higgs\nuniverse = docker\ndocker_image = mschnepf/docker_cc7\n" >> condor_combine_task.sub
         else
-            combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
+            $CACHED_FIT --outputs "higgsCombine_paramFit_Test_*.MultiDimFit.mH125.root" -- \
+                combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root \
                 --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
-                --doFits --robustFit 1 --setParameterRanges CMS_htt_zjXsec=$RANGE \
+                --doFits --robustFit 1 ${NAMED:+--named $NAMED} --setParameterRanges CMS_htt_zjXsec=$RANGE \
                 # --setCrossingTolerance 9.99999999975e-05 \
                 # --setRobustFitTolerance 0.10000000001 \
                 --parallel 25 -v1 | tee nuisance_impacts_fits.log
         fi
-        combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root --output ${ERA}_impacts.json
+        $CACHED_FIT --outputs "${ERA}_impacts.json" -- \
+            combineTool.py -M Impacts -m 125 -d combined.txt.cmb.root --output ${ERA}_impacts.json \
+            ${NAMED:+--named $NAMED}
+        if [ -n "$NAMED" ]
+        then
+            # Approximate impacts of the nuisances without full fits
+            $APPROXIMATE_IMPACTS --full ${ERA}_impacts.json --output ${ERA}_impacts.json
+        fi
         plotImpacts.py -i ${ERA}_impacts.json -o ${ERA}_impacts
         popd
     done
@@ -9,6 +9,8 @@ CATEGORIES=$2
 JETFAKES=$3
 EMBEDDING=$4
 CHANNELS=${@:5}
+# Optional: only the datacards of the working point given by $WORKING_POINT
+WORKING_POINT=${WORKING_POINT:-*}
 
 SUFFIX="MC"
 
@@ -25,7 +27,7 @@ then
     JETFAKES_ARG="--fake-factor"
 fi
 
-INPUT=${PWD}/output/${ERA}_tauid_*_${CATEGORIES}*${SUFFIX}
+INPUT=${PWD}/output/${ERA}_tauid_${WORKING_POINT}_${CATEGORIES}*${SUFFIX}
 for DIR in ${INPUT}/htt_mt*
 do
     mkdir -p ${ERA}_plots
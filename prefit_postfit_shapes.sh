@@ -2,10 +2,22 @@
 
 ERA=$1
 CATEGORIES=$2
+# Optional: only the datacards with (1) or without (0) embedding
+EMBEDDING=$3
+# Optional: only the datacards of the working point given by $WORKING_POINT
+WORKING_POINT=${WORKING_POINT:-*}
 
 source utils/setup_cmssw.sh
 
-INPUT=${PWD}/output/${ERA}_tauid_*_${CATEGORIES}*
+SUFFIX=""
+if [ "$EMBEDDING" == 1 ]
+then
+    SUFFIX="_EMB"
+elif [ "$EMBEDDING" == 0 ]
+then
+    SUFFIX="_MC"
+fi
+INPUT=${PWD}/output/${ERA}_tauid_${WORKING_POINT}_${CATEGORIES}*${SUFFIX}
 for DATACARD in $INPUT/htt_mt*/combined.txt.cmb
 do
     DIR=$(dirname $DATACARD)
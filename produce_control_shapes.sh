@@ -9,20 +9,21 @@ source utils/setup_cvmfs_sft.sh
 source utils/setup_python.sh
 source utils/setup_samples.sh $ERA
 
-for VAR in $VARIABLES
-do
-    nice -n 13 python TauIDSF_measurement/shapes/produce_shapes_${ERA}.py \
-        --directory $ARTUS_OUTPUTS \
-        --fake-factor-friend-directory $ARTUS_FRIENDS_FAKE_FACTOR \
-        --datasets $KAPPA_DATABASE \
-        --binning $BINNING \
-        --gof-channel $CHANNEL \
-        --gof-variable $VAR \
-        --era $ERA \
-        --tag ${ERA}_control_${VAR} \
-        --num-threads 20 \
-        --skip-systematic-variations true
-done
+# All variables are filled in the same event loops and written to
+# ${ERA}_control_shapes.root. Pass "all" to produce every control variable
+# of the binning configuration.
+nice -n 13 python TauIDSF_measurement/shapes/produce_shapes_${ERA}.py \
+    --directory $ARTUS_OUTPUTS \
+    --fake-factor-friend-directory $ARTUS_FRIENDS_FAKE_FACTOR \
+    --datasets $KAPPA_DATABASE \
+    --binning $BINNING \
+    --gof-channel $CHANNEL \
+    --gof-variables $VARIABLES \
+    --era $ERA \
+    --tag ${ERA}_control \
+    --backend tdf \
+    --num-threads 20 \
+    --skip-systematic-variations true
 
 # Normalize fake-factor shapes to nominal
 # python fake-factor-application/normalize_shifts.py ${ERA}_shapes.root
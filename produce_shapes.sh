@@ -2,8 +2,25 @@
 
 BINNING=TauIDSF_measurement/shapes/binning.yaml
 ERA=$1
-WP=$2
+WPS=$2
 CHANNELS=${@:3}
+# Optional: backend of the production, see produce_shapes_${ERA}.py --help
+BACKEND=${BACKEND:-tdf}
+# Optional: number of processes, the classic backend runs in a single one
+if [ "$BACKEND" == "classic" ]
+then
+    NUM_PROCESSES=${NUM_PROCESSES:-1}
+else
+    NUM_PROCESSES=${NUM_PROCESSES:-8}
+fi
+
+# Several working points are produced in one pass and written to
+# ${ERA}_${WP}_shapes.root each.
+TAG=${ERA}_${WPS}
+if [ $(echo $WPS | wc -w) -gt 1 ]
+then
+    TAG=${ERA}
+fi
 
 
 source utils/setup_cvmfs_sft.sh
@@ -18,9 +35,11 @@ nice -n 15 python TauIDSF_measurement/shapes/produce_shapes_${ERA}.py \
     --binning $BINNING \
     --channels $CHANNELS \
     --era $ERA \
-    --tag ${ERA}_test \
-    --working-point $WP \
+    --tag $TAG \
+    --working-point $WPS \
+    --backend $BACKEND \
     --num-threads 1 \
+    --num-processes $NUM_PROCESSES \
     --skip-systematic-variations true
 
 # Normalize fake-factor shapes to nominal
@@ -5,11 +5,23 @@ source utils/setup_python.sh
 
 ERA=$1
 CATEGORIES=$2
+# Optional: only the datacards with (1) or without (0) embedding
+EMBEDDING=$3
+# Optional: only the datacards of the working point given by $WORKING_POINT
+WORKING_POINT=${WORKING_POINT:-*}
 
 NUM_THREADS=10
 
 # Collect input directories for eras and define output path for workspace
-INPUT=output/${ERA}_tauid_*_${CATEGORIES}*
+SUFFIX=""
+if [ "$EMBEDDING" == 1 ]
+then
+    SUFFIX="_EMB"
+elif [ "$EMBEDDING" == 0 ]
+then
+    SUFFIX="_MC"
+fi
+INPUT=output/${ERA}_tauid_${WORKING_POINT}_${CATEGORIES}*${SUFFIX}
 echo "[INFO] Add datacards to workspace from path "${INPUT}"."
 
 # Clean previous workspace
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from tauid.fit import (CATEGORIZATIONS, BatchedModel, Model, fit, fit_batch,
+                       read_shapes)
+
+import argparse
+import json
+
+import logging
+logger = logging.getLogger()
+
+
+def setup_logging(level=logging.INFO):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description=
+        "Quick preview of the Tau ID SFs from a binned likelihood fit of the produced shapes, without datacards and combine."
+    )
+    parser.add_argument(
+        "--input",
+        required=True,
+        type=str,
+        help="Shapes file, e.g. 2017_tight_shapes.root.")
+    parser.add_argument("--era", required=True, type=str, help="Era.")
+    parser.add_argument(
+        "--categorization",
+        default="pt_binned",
+        choices=sorted(CATEGORIZATIONS.keys()),
+        type=str,
+        help="Categorization of the measurement.")
+    parser.add_argument(
+        "--embedding",
+        action="store_true",
+        help="Measure on the embedded samples instead of ZTT.")
+    parser.add_argument(
+        "--set-parameter-ranges",
+        default=None,
+        type=str,
+        help="Ranges of parameters as for combine, e.g. CMS_htt_zjXsec=0.97,1.02:r_Pt20to25=0,2.")
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Fit the categories one after the other instead of all at once.")
+    parser.add_argument(
+        "--output",
+        default=None,
+        type=str,
+        help="JSON file with the fitted parameters.")
+    return parser.parse_args()
+
+
+def parameter_ranges(argument):
+    ranges = {}
+    if argument:
+        for entry in argument.split(":"):
+            name, values = entry.split("=")
+            low, high = values.split(",")
+            ranges[name] = (float(low), float(high))
+    return ranges
+
+
+def main(args):
+    categories = CATEGORIZATIONS[args.categorization]
+    shapes = read_shapes(args.input, args.era, categories, args.embedding)
+    ranges = parameter_ranges(args.set_parameter_ranges)
+    # Every category is fitted on its own together with the control region,
+    # as the htt_mt_* datacards of combine.
+    if args.sequential:
+        fits = [
+            fit(Model(
+                shapes, args.era, [category], args.embedding, ranges=ranges))
+            for category in categories
+        ]
+    else:
+        fits = fit_batch(
+            BatchedModel(
+                shapes, args.era, categories, args.embedding, ranges=ranges))
+    results = dict(zip(categories, fits))
+    for category, result in zip(categories, fits):
+        logger.info("%-10s SF = %.3f +- %.3f%s", category,
+                    result.value("r_" + category),
+                    result.error("r_" + category),
+                    "" if result.converged else " (not converged)")
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(
+                dict((category, {
+                    "converged": result.converged,
+                    "nll": result.nll,
+                    "parameters": dict(
+                        (name, [value, error])
+                        for name, value, error in zip(
+                            result.names, result.values, result.errors))
+                }) for category, result in results.items()),
+                output_file,
+                indent=2,
+                sort_keys=True)
+        logger.info("Wrote the fit results to %s.", args.output)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging()
+    main(args)
@@ -6,7 +6,7 @@ ROOT.PyConfig.IgnoreCommandLineOptions = True  # disable ROOT internal argument
 ROOT.gErrorIgnoreLevel = ROOT.kError
 
 from shape_producer.cutstring import Cut, Cuts, Weight
-from shape_producer.systematics import Systematics, Systematic
+from shape_producer.systematics import Systematic
 from shape_producer.categories import Category
 from shape_producer.binning import ConstantBinning, VariableBinning
 from shape_producer.variable import Variable
@@ -14,6 +14,8 @@ from shape_producer.systematic_variations import Nominal, DifferentPipeline, Squ
 from shape_producer.process import Process
 from shape_producer.estimation_methods import AddHistogramEstimationMethod
 from shape_producer.channel import MTTauID2018, MMTauID2018
+from tauid.systematics import Systematics, produce
+from tauid.arguments import add_production_arguments, production_options
 
 from itertools import product
 
@@ -70,9 +72,14 @@ def parse_arguments():
         type=str,
         help="Channel for goodness of fit shapes.")
     parser.add_argument(
+        "--gof-variables",
         "--gof-variable",
+        default=[],
+        nargs="+",
         type=str,
-        help="Variable for goodness of fit shapes.")
+        help=
+        "Variables for goodness of fit shapes, or all to produce every control variable of the binning configuration in one run."
+    )
     parser.add_argument(
         "--num-threads",
         default=32,
@@ -81,9 +88,9 @@ def parse_arguments():
     parser.add_argument(
         "--backend",
         default="classic",
-        choices=["classic", "tdf"],
+        choices=["classic", "tdf", "numpy"],
         type=str,
-        help="Backend. Use classic or tdf.")
+        help="Backend. Use classic, tdf (one RDataFrame event loop per input tree) or numpy (columnar arrays, one process per input tree).")
     parser.add_argument(
         "--tag", default="ERA_CHANNEL", type=str, help="Tag of output files.")
     parser.add_argument(
@@ -94,18 +101,27 @@ def parse_arguments():
     parser.add_argument(
         "-w",
         "--working-point",
+        nargs="+",
         type=str,
-        default="tight",
-        help="Tau ID working point to be measured.")
+        default=["tight"],
+        help=
+        "Tau ID working points to be measured. Several working points are produced in the same pass over the ntuples and written to {tag}_{working point}_shapes.root."
+    )
+    add_production_arguments(parser)
     return parser.parse_args()
 
 
-def main(args):
+def setup_systematics(args, working_point):
     # Container for all distributions to be drawn
     logger.info("Set up shape variations.")
+    if len(args.working_point) > 1:
+        output_file = "{}_{}_shapes.root".format(args.tag, working_point)
+    else:
+        output_file = "{}_shapes.root".format(args.tag)
     systematics = Systematics(
-        "{}_shapes.root".format(args.tag),
+        output_file,
         num_threads=args.num_threads,
+        backend=args.backend,
         skip_systematic_variations=args.skip_systematic_variations)
 
     # Era selection
@@ -142,7 +158,7 @@ def main(args):
                }
     wp_dict = wp_dict_deeptau
 
-    logger.info("Produce shapes for the %s working point of the MVA Tau ID", args.working_point)
+    logger.info("Produce shapes for the %s working point of the MVA Tau ID", working_point)
     # Channels and processes
     # yapf: disable
     directory = args.directory
@@ -152,7 +168,7 @@ def main(args):
     tt_friend_directory = []#args.tt_friend_directory
     ff_friend_directory = []#args.fake_factor_friend_directory
     mt = MTTauID2018()
-    mt.cuts.add(Cut(wp_dict[args.working_point]+">0.5", "tau_iso"))
+    mt.cuts.add(Cut(wp_dict[working_point]+">0.5", "tau_iso"))
     # if args.gof_channel == "mt":
     #     mt.cuts.remove("m_t")
     #     mt.cuts.remove("dZeta")
@@ -206,20 +222,24 @@ def main(args):
     mt_categories = []
     # Goodness of fit shapes
     if args.gof_channel == "mt":
-        score = Variable(
-                args.gof_variable,
-                VariableBinning(binning["control"]["mt"][args.gof_variable]["bins"]),
-                expression=binning["control"]["mt"][args.gof_variable]["expression"])
-        if "cut" in binning["control"]["mt"][args.gof_variable].keys():
-            cuts=Cuts(Cut(binning["control"]["mt"][args.gof_variable]["cut"], "binning"))
-        else:
-            cuts=Cuts()
-        mt_categories.append(
-            Category(
-                args.gof_variable,
-                mt,
-                cuts,
-                variable=score))
+        gof_variables = args.gof_variables
+        if gof_variables == ["all"]:
+            gof_variables = sorted(binning["control"]["mt"].keys())
+        for gof_variable in gof_variables:
+            score = Variable(
+                    gof_variable,
+                    VariableBinning(binning["control"]["mt"][gof_variable]["bins"]),
+                    expression=binning["control"]["mt"][gof_variable]["expression"])
+            if "cut" in binning["control"]["mt"][gof_variable].keys():
+                cuts=Cuts(Cut(binning["control"]["mt"][gof_variable]["cut"], "binning"))
+            else:
+                cuts=Cuts()
+            mt_categories.append(
+                Category(
+                    gof_variable,
+                    mt,
+                    cuts,
+                    variable=score))
     elif "mt" in args.channels:
         for cat in binning["categories"]["mt"]:
             category = Category(
@@ -633,9 +653,18 @@ def main(args):
     #             process=mt_processes["FAKES"],
     #             channel=mt,
     #             era=era)
+    return systematics
+
+
+def main(args):
+    systematics = [
+        setup_systematics(args, working_point)
+        for working_point in args.working_point
+    ]
+
     # Produce histograms
     logger.info("Start producing shapes.")
-    systematics.produce()
+    produce(systematics, **production_options(args))
     logger.info("Done producing shapes.")
 
 
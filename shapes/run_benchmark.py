@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import yaml
+
+import logging
+logger = logging.getLogger()
+
+
+def setup_logging(level=logging.INFO):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description=
+        "Benchmark the shape production backends on synthetic Artus-like ntuples."
+    )
+    parser.add_argument(
+        "command",
+        choices=["generate", "run", "measure"],
+        type=str,
+        help="Write the synthetic ntuples, run the benchmark of all backends and thread counts or measure a single one.")
+    parser.add_argument(
+        "--directory",
+        required=True,
+        type=str,
+        help="Directory of the synthetic ntuples.")
+    parser.add_argument(
+        "--binning",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "binning.yaml"),
+        type=str,
+        help="Binning configuration.")
+    parser.add_argument(
+        "--num-events",
+        default=100000,
+        type=int,
+        help="Number of events per tree and file written by generate.")
+    parser.add_argument(
+        "--num-files",
+        default=2,
+        type=int,
+        help="Number of files per sample written by generate.")
+    parser.add_argument(
+        "--skip-shifts",
+        action="store_true",
+        help="Only use the nominal pipelines and weights.")
+    parser.add_argument(
+        "--working-points",
+        default=["Tight"],
+        nargs="+",
+        type=str,
+        help="DeepTau working points of the mt channel, e.g. Tight.")
+    parser.add_argument(
+        "--backends",
+        default=["tdf", "numpy"],
+        nargs="+",
+        choices=["tdf", "numpy"],
+        type=str,
+        help="Backends to benchmark.")
+    parser.add_argument(
+        "--num-threads",
+        default=[1, 2, 4],
+        nargs="+",
+        type=int,
+        help="Numbers of threads to benchmark.")
+    parser.add_argument(
+        "--num-processes",
+        default=1,
+        type=int,
+        help="Number of processes running the event loops.")
+    parser.add_argument(
+        "--repetitions",
+        default=2,
+        type=int,
+        help="Number of repetitions of every measurement, the fastest one is reported.")
+    parser.add_argument(
+        "--output",
+        default="benchmark.json",
+        type=str,
+        help="JSON file with the measurements.")
+    parser.add_argument(
+        "--table",
+        default="benchmark.txt",
+        type=str,
+        help="Text file with the throughput table.")
+    parser.add_argument(
+        "--reference",
+        default=None,
+        type=str,
+        help="JSON file of a previous benchmark to check for regressions.")
+    parser.add_argument(
+        "--tolerance",
+        default=0.2,
+        type=float,
+        help="Allowed relative loss of throughput with respect to the reference.")
+    parser.add_argument(
+        "--backend",
+        default="tdf",
+        choices=["tdf", "numpy"],
+        type=str,
+        help="Backend measured by measure.")
+    parser.add_argument(
+        "--result",
+        default="measurement.json",
+        type=str,
+        help="JSON file written by measure.")
+    return parser.parse_args()
+
+
+def configuration(args):
+    from tauid.synthetic import benchmark_specs
+    with open(args.binning) as binning_file:
+        binning = yaml.safe_load(binning_file)
+    return benchmark_specs(
+        args.directory,
+        binning,
+        working_points=args.working_points,
+        shifts=not args.skip_shifts)
+
+
+def measure(args):
+    """Fill the configuration with one backend and number of threads.
+
+    Runs in its own process, so that the implicit multithreading of ROOT
+    and the peak memory of one measurement do not leak into the next one.
+    """
+    from tauid.partition import PartitioningBackend
+    from tauid.scheduler import count_events
+    from tauid.specs import group_by_input
+    from tauid.streaming import peak_memory
+    specs = configuration(args)
+    num_threads = args.num_threads[0]
+    if args.backend == "tdf":
+        from tauid.rdataframe import RDataFrameBackend
+        backend = RDataFrameBackend(
+            num_threads=num_threads, num_processes=args.num_processes)
+    else:
+        from tauid.columnar import ColumnarBackend
+        backend = ColumnarBackend(
+            num_workers=max(num_threads, args.num_processes))
+    backend = PartitioningBackend(backend)
+    groups = group_by_input(specs)
+    num_events = sum(count_events(key[0], key[1]) for key, _ in groups)
+
+    walls = []
+    for _ in range(args.repetitions):
+        start = time.time()
+        results = backend.run(specs)
+        walls.append(time.time() - start)
+    own, children = peak_memory()
+    np.savez_compressed(
+        args.result + ".npz",
+        **dict(("sumw_{}".format(i), np.asarray(sumw))
+               for i, (sumw, _) in enumerate(results)))
+    with open(args.result, "w") as result_file:
+        json.dump({
+            "backend": args.backend,
+            "num_threads": num_threads,
+            "num_processes": args.num_processes,
+            "num_histograms": len(specs),
+            "num_event_loops": len(groups),
+            "events_read": num_events,
+            "walls": walls,
+            "wall": min(walls),
+            "events_per_second": num_events / min(walls),
+            "histograms_per_second": len(specs) / min(walls),
+            "peak_memory": max(own, children),
+        }, result_file)
+
+
+def table(measurements):
+    lines = [
+        "{:8} {:>8} {:>10} {:>10} {:>14} {:>14} {:>12}".format(
+            "backend", "threads", "processes", "wall [s]", "events/s",
+            "histograms/s", "memory [GB]")
+    ]
+    for entry in measurements:
+        lines.append(
+            "{:8} {:>8d} {:>10d} {:>10.2f} {:>14.0f} {:>14.1f} {:>12.2f}".
+            format(entry["backend"], entry["num_threads"],
+                   entry["num_processes"], entry["wall"],
+                   entry["events_per_second"],
+                   entry["histograms_per_second"], entry["peak_memory"]))
+    return "\n".join(lines)
+
+
+def consistent(first, second):
+    """Whether two measurements filled the same histograms."""
+    with np.load(first) as reference, np.load(second) as results:
+        return all(
+            np.allclose(reference[key], results[key], rtol=1e-6, atol=1e-9)
+            for key in reference.files)
+
+
+def regressions(measurements, reference_path, tolerance):
+    """Measurements slower than the same measurement of the reference."""
+    with open(reference_path) as reference_file:
+        reference = json.load(reference_file)["measurements"]
+    slower = []
+    for entry in measurements:
+        for previous in reference:
+            same = all(entry[key] == previous[key]
+                       for key in ("backend", "num_threads", "num_processes",
+                                   "num_histograms", "events_read"))
+            if same and entry["events_per_second"] < (
+                    1.0 - tolerance) * previous["events_per_second"]:
+                logger.warning(
+                    "Backend %s with %d threads is slower than the reference: %.0f instead of %.0f events/s.",
+                    entry["backend"], entry["num_threads"],
+                    entry["events_per_second"],
+                    previous["events_per_second"])
+                slower.append(entry)
+    return slower
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="tauid_benchmark_")
+    base = [
+        sys.executable,
+        os.path.abspath(__file__), "measure", "--directory", args.directory,
+        "--binning", args.binning, "--num-processes",
+        str(args.num_processes), "--repetitions",
+        str(args.repetitions), "--working-points"
+    ] + args.working_points
+    if args.skip_shifts:
+        base.append("--skip-shifts")
+    measurements = []
+    results = []
+    for backend in args.backends:
+        for num_threads in args.num_threads:
+            result = os.path.join(workdir, "{}_{}.json".format(
+                backend, num_threads))
+            command = base + [
+                "--backend", backend, "--num-threads",
+                str(num_threads), "--result", result
+            ]
+            logger.info("Measure backend %s with %d threads.", backend,
+                        num_threads)
+            if subprocess.call(command) != 0:
+                logger.critical("Measurement of backend %s with %d threads failed.",
+                                backend, num_threads)
+                raise Exception
+            with open(result) as result_file:
+                measurements.append(json.load(result_file))
+            results.append(result + ".npz")
+
+    mismatches = [
+        entry for entry, result in zip(measurements[1:], results[1:])
+        if not consistent(results[0], result)
+    ]
+    shutil.rmtree(workdir)
+    for entry in mismatches:
+        logger.error("Backend %s with %d threads filled different histograms than backend %s with %d threads.",
+                     entry["backend"], entry["num_threads"],
+                     measurements[0]["backend"],
+                     measurements[0]["num_threads"])
+
+    output = table(measurements)
+    logger.info("Throughput on %d events in %d event loops filling %d histograms:\n%s",
+                measurements[0]["events_read"],
+                measurements[0]["num_event_loops"],
+                measurements[0]["num_histograms"], output)
+    with open(args.table, "w") as table_file:
+        table_file.write(output + "\n")
+    with open(args.output, "w") as output_file:
+        json.dump({"measurements": measurements}, output_file, indent=2)
+    logger.info("Wrote the benchmark to %s and %s.", args.output, args.table)
+
+    slower = []
+    if args.reference is not None:
+        slower = regressions(measurements, args.reference, args.tolerance)
+    if mismatches or slower:
+        logger.critical("Benchmark failed with %d inconsistent and %d slower measurements.",
+                        len(mismatches), len(slower))
+        raise Exception
+
+
+def main(args):
+    if args.command == "generate":
+        from tauid.synthetic import generate
+        generate(
+            args.directory,
+            args.num_events,
+            num_files=args.num_files,
+            shifts=not args.skip_shifts)
+    elif args.command == "measure":
+        measure(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging()
+    main(args)
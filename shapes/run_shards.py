@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import multiprocessing
+import subprocess
+import sys
+
+import logging
+logger = logging.getLogger()
+
+
+def setup_logging(level=logging.INFO):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description=
+        "Run a sharded shape production on the local machine and merge the shards. All unknown arguments are passed to the production script and have to include --backend tdf or numpy."
+    )
+    parser.add_argument(
+        "script",
+        type=str,
+        help="Production script, e.g. produce_shapes_2017.py.")
+    parser.add_argument(
+        "--num-shards", required=True, type=int, help="Number of shards.")
+    parser.add_argument(
+        "--num-workers",
+        default=1,
+        type=int,
+        help="Number of shards produced in parallel.")
+    return parser.parse_known_args()
+
+
+def run(command):
+    logger.info("Run %s", " ".join(command))
+    return subprocess.call(command)
+
+
+def backend(production_arguments):
+    """Backend given in the arguments of the production script."""
+    name = "classic"
+    for position, argument in enumerate(production_arguments):
+        if argument == "--backend" and position + 1 < len(
+                production_arguments):
+            name = production_arguments[position + 1]
+        elif argument.startswith("--backend="):
+            name = argument[len("--backend="):]
+    return name
+
+
+def main(args, production_arguments):
+    if backend(production_arguments) == "classic":
+        logger.critical(
+            "Sharded productions need the tdf or numpy backend, e.g. --backend tdf."
+        )
+        raise Exception
+    base = [sys.executable, args.script] + production_arguments
+    commands = [
+        base + ["--shard", "{}/{}".format(index, args.num_shards)]
+        for index in range(args.num_shards)
+    ]
+    pool = multiprocessing.Pool(args.num_workers)
+    codes = pool.map(run, commands, chunksize=1)
+    pool.close()
+    pool.join()
+    failed = [index for index, code in enumerate(codes) if code != 0]
+    if failed:
+        logger.critical("Shards %s failed.", failed)
+        raise Exception
+    if run(base + ["--merge-shards"]) != 0:
+        logger.critical("Merging the shards failed.")
+        raise Exception
+
+
+if __name__ == "__main__":
+    args, production_arguments = parse_arguments()
+    setup_logging()
+    main(args, production_arguments)
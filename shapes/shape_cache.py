@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from tauid.cache import ShapeCache
+
+import argparse
+
+import logging
+logger = logging.getLogger()
+
+
+def setup_logging(level=logging.INFO):
+    logger.setLevel(level)
+    formatter = logging.Formatter("%(name)s - %(levelname)s - %(message)s")
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Inspect or prune the persistent shape cache.")
+    parser.add_argument(
+        "command",
+        choices=["info", "prune", "clear"],
+        type=str,
+        help="Show the size of the cache, remove the least recently used entries above --max-size or remove all entries.")
+    parser.add_argument(
+        "--cache-directory",
+        required=True,
+        type=str,
+        help="Directory of the shape cache.")
+    parser.add_argument(
+        "--max-size",
+        default=50.0,
+        type=float,
+        help="Maximum size of the cache in GB used by prune.")
+    return parser.parse_args()
+
+
+def main(args):
+    cache = ShapeCache(args.cache_directory)
+    if args.command == "prune":
+        cache.prune(args.max_size * 1e9)
+    elif args.command == "clear":
+        cache.clear()
+    entries = cache.entries()
+    logger.info("Cache %s holds %d histograms with %.3f GB.",
+                args.cache_directory, len(entries),
+                sum(entry[1] for entry in entries) / 1e9)
+    if entries:
+        logger.info("Least recently used entry: %s",
+                    min(entries, key=lambda entry: entry[2])[0])
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    setup_logging()
+    main(args)
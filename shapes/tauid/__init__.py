@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Helpers for the Tau ID shape production on top of shape_producer."""
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Command line options of the production shared by all era scripts."""
+
+import yaml
+
+from .grid import grid_edges
+from .shards import parse_shard
+
+
+def add_production_arguments(parser):
+    parser.add_argument(
+        "--cache-directory",
+        default=None,
+        type=str,
+        help=
+        "Directory of a persistent shape cache. Only histograms missing in the cache are filled."
+    )
+    parser.add_argument(
+        "--cache-size",
+        default=50.0,
+        type=float,
+        help="Maximum size of the shape cache in GB.")
+    parser.add_argument(
+        "--skim-directory",
+        default=None,
+        type=str,
+        help=
+        "Directory of compact skims of the ntuples. Missing skims are created and all histograms are filled from the skims."
+    )
+    parser.add_argument(
+        "--max-memory",
+        default=None,
+        type=float,
+        help=
+        "Approximate maximum memory in GB. The input trees are filled in batches staying below it."
+    )
+    parser.add_argument(
+        "--num-processes",
+        default=1,
+        type=int,
+        help=
+        "Number of processes running the event loops in parallel, largest input trees first."
+    )
+    parser.add_argument(
+        "--shard",
+        default=None,
+        type=parse_shard,
+        help=
+        "Only fill shard k/N of the inputs, with 0 <= k < N, and write it to the shard directory."
+    )
+    parser.add_argument(
+        "--merge-shards",
+        action="store_true",
+        help=
+        "Produce the shapes from the shards in the shard directory instead of the ntuples."
+    )
+    parser.add_argument(
+        "--shard-directory",
+        default=None,
+        type=str,
+        help="Directory of the shard files. Defaults to {tag}_shards.")
+    parser.add_argument(
+        "--shard-chunk-size",
+        default=10,
+        type=int,
+        help="Number of files of an input tree filled together in a shard.")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=
+        "Record the filled inputs in a checkpoint and resume an interrupted production, taking the inputs filled so far from its checkpoint."
+    )
+    parser.add_argument(
+        "--checkpoint-directory",
+        default=None,
+        type=str,
+        help=
+        "Record the filled inputs in this checkpoint directory while the production runs. Defaults to {tag}_checkpoint with --resume."
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help=
+        "Record the resources used by every event loop and systematic in {tag}_produce_shapes_profile.json."
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help=
+        "Only log the production plan and a cost estimate from {tag}_produce_shapes_profile.json of a previous production, without reading any events."
+    )
+
+
+def fine_grids(binning_file):
+    """Fine master grids of the binning configuration by expression."""
+    with open(binning_file) as configuration:
+        binning = yaml.safe_load(configuration)
+    return dict((expression, grid_edges(grid)) for expression, grid in
+                binning.get("fine_binning", {}).items())
+
+
+def production_options(args):
+    """Keyword arguments of tauid.systematics.produce."""
+    return {
+        "grids": fine_grids(args.binning),
+        "cache_directory": args.cache_directory,
+        "cache_size": args.cache_size,
+        "skim_directory": args.skim_directory,
+        "max_memory": args.max_memory,
+        "num_processes": args.num_processes,
+        "shard": args.shard,
+        "merge_shards": args.merge_shards,
+        "shard_directory": args.shard_directory or "{}_shards".format(
+            args.tag),
+        "shard_chunk_size": args.shard_chunk_size,
+        "checkpoint_directory": args.checkpoint_directory or
+        ("{}_checkpoint".format(args.tag) if args.resume else None),
+        "resume": args.resume,
+        "profile_file": "{}_produce_shapes_profile.json".format(args.tag)
+        if args.profile or args.plan else None,
+        "plan": args.plan,
+    }
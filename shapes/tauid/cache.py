@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Persistent content-addressed cache of filled histograms.
+
+Every filled spec is stored on disk under a key built from its input files
+and their modification times, the tree, the selection, the weights, the
+variable and the binning. A production only fills the specs which are not
+in the cache, e.g. after editing one systematic or one category, and
+assembles the output from the cache otherwise. The cache is kept below a
+maximum size by evicting the least recently used entries. Entries are
+compressed, so mostly empty master histograms on fine grids stay small.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .grid import align, master_spec, rebin
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ShapeCache(object):
+    def __init__(self, directory, max_size=None):
+        """Cache in the given directory with an optional size cap in bytes."""
+        self._directory = directory
+        self._max_size = max_size
+        self._file_stamps = {}
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _file_stamp(self, path):
+        """Modification time and size of an input file.
+
+        Remote files, e.g. accessed via XRootD, are identified by their path
+        only.
+        """
+        if path not in self._file_stamps:
+            if os.path.exists(path):
+                status = os.stat(path)
+                self._file_stamps[path] = [path, status.st_mtime,
+                                           status.st_size]
+            else:
+                self._file_stamps[path] = [path]
+        return self._file_stamps[path]
+
+    def key(self, spec):
+        tree_path, files, friend_files = spec.input_key
+        _, cuts, weights, expression, edges, _ = spec.fingerprint
+        content = [
+            tree_path, [self._file_stamp(path) for path in files],
+            [[self._file_stamp(path) for path in friend]
+             for friend in friend_files],
+            sorted(cuts),
+            list(weights), expression,
+            list(edges) if edges is not None else None
+        ]
+        return hashlib.sha1(
+            json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key[:2], key + ".npz")
+
+    def get(self, spec):
+        """Cached tuple of sumw and sumw2 of the spec or None."""
+        path = self._path(self.key(spec))
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as entry:
+            sumw, sumw2 = entry["sumw"], entry["sumw2"]
+        # Mark the entry as recently used
+        os.utime(path, None)
+        if spec.is_count:
+            return float(sumw), float(sumw2)
+        return sumw, sumw2
+
+    def put(self, spec, result):
+        path = self._path(self.key(spec))
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        sumw, sumw2 = result
+        # Write to a temporary file first so that concurrent productions
+        # never read a partially written entry.
+        temporary = "{}.{}.tmp.npz".format(path[:-4], os.getpid())
+        np.savez_compressed(temporary, sumw=sumw, sumw2=sumw2)
+        os.rename(temporary, path)
+
+    def entries(self):
+        """List of (path, size, last use) of all entries."""
+        entries = []
+        for root, _, files in os.walk(self._directory):
+            for name in files:
+                if not name.endswith(".npz") or ".tmp." in name:
+                    continue
+                path = os.path.join(root, name)
+                status = os.stat(path)
+                entries.append((path, status.st_size, status.st_mtime))
+        return entries
+
+    def prune(self, max_size=None):
+        """Remove the least recently used entries above the maximum size.
+
+        Returns the number of removed entries.
+        """
+        if max_size is None:
+            max_size = self._max_size
+        if max_size is None:
+            return 0
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for path, entry_size, _ in entries:
+            if size <= max_size:
+                break
+            os.remove(path)
+            size -= entry_size
+            removed += 1
+        if removed:
+            logger.info("Removed %d least recently used entries from %s.",
+                        removed, self._directory)
+        return removed
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
+
+
+def fill_with_cache(specs, backend, cache, grids=None):
+    """Fill the specs, taking everything available from the cache.
+
+    With a dictionary of expression to fine grid edges, histograms lining up
+    with the grid of their variable are cached as master histograms on the
+    grid and rebinned, so all binnings of a variable share the same entry.
+    """
+    grids = grids or {}
+    masters = []
+    positions = {}
+    mapping = []
+    for spec in specs:
+        master = master_spec(spec, grids) or spec
+        if master.fingerprint not in positions:
+            positions[master.fingerprint] = len(masters)
+            masters.append(master)
+        mapping.append(positions[master.fingerprint])
+    if len(masters) < len(specs):
+        logger.info("Fill %d root objects from %d master histograms.",
+                    len(specs), len(masters))
+
+    filled = [cache.get(master) for master in masters]
+    missing = [index for index, result in enumerate(filled) if result is None]
+    logger.info("Found %d of %d histograms in the cache %s.",
+                len(masters) - len(missing), len(masters), cache.directory)
+    if missing:
+        for index, result in zip(
+                missing, backend.run([masters[index] for index in missing])):
+            cache.put(masters[index], result)
+            filled[index] = result
+    cache.prune()
+
+    results = []
+    for spec, index in zip(specs, mapping):
+        master = masters[index]
+        if spec.is_count or master.edges == spec.edges:
+            results.append(filled[index])
+        else:
+            edges = align(spec.edges, master.edges)
+            results.append(tuple(
+                rebin(array, master.edges, edges) for array in filled[index]))
+    return results
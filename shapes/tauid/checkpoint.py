@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of the filled inputs of a running production.
+
+While a checkpoint is active, the scheduler records the filled objects of
+every finished event loop in the checkpoint directory, see
+tauid.scheduler. A production restarted with resume skips all event loops
+whose objects are recorded and only runs the remaining ones. The checkpoint
+carries a hash of the configuration, i.e. of all specs and output files, so
+that a resume never mixes inputs of two different setups. The checkpoint is
+removed after a successful production.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+_active = None
+
+
+def start(checkpoint):
+    """Record the jobs of the scheduler in the checkpoint."""
+    global _active
+    _active = checkpoint
+
+
+def stop():
+    global _active
+    _active = None
+
+
+def active():
+    """Checkpoint currently recording or None."""
+    return _active
+
+
+def configuration_hash(specs, output_files):
+    """Hash of everything defining the filled inputs of a production."""
+    content = [sorted(spec.digest for spec in specs), sorted(output_files)]
+    return hashlib.sha1(
+        json.dumps(content).encode("utf-8")).hexdigest()
+
+
+class Checkpoint(object):
+    def __init__(self, directory, configuration, resume=False):
+        """Checkpoint in the given directory for the configuration hash.
+
+        Without resume, an existing checkpoint is discarded.
+        """
+        self._directory = directory
+        self._results = {}
+        manifest = os.path.join(directory, "checkpoint.json")
+        if resume and os.path.exists(manifest):
+            with open(manifest) as manifest_file:
+                recorded = json.load(manifest_file)["configuration"]
+            if recorded != configuration:
+                logger.critical(
+                    "Checkpoint %s belongs to another configuration.",
+                    directory)
+                raise Exception
+            self._load()
+            logger.info("Resume with %d inputs from checkpoint %s.",
+                        len(self._results), directory)
+        else:
+            if resume:
+                logger.warning(
+                    "No checkpoint found in %s, start from scratch.",
+                    directory)
+            self.remove()
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(manifest, "w") as manifest_file:
+                json.dump({"configuration": configuration}, manifest_file)
+        self._num_parts = len(self._parts())
+
+    def _parts(self):
+        return sorted(glob.glob(os.path.join(self._directory, "part_*.npz")))
+
+    def _load(self):
+        for path in self._parts():
+            with np.load(path) as part:
+                for i, digest in enumerate(part["digests"]):
+                    self._results[str(digest)] = (part["sumw_{}".format(i)],
+                                                  part["sumw2_{}".format(i)])
+
+    def get(self, spec):
+        """Recorded tuple of sumw and sumw2 of the spec or None."""
+        if spec.digest not in self._results:
+            return None
+        sumw, sumw2 = self._results[spec.digest]
+        if spec.is_count:
+            return float(sumw), float(sumw2)
+        return sumw, sumw2
+
+    def record(self, specs, results):
+        arrays = {}
+        for i, (sumw, sumw2) in enumerate(results):
+            arrays["sumw_{}".format(i)] = np.asarray(sumw)
+            arrays["sumw2_{}".format(i)] = np.asarray(sumw2)
+        path = os.path.join(self._directory,
+                            "part_{:06d}.npz".format(self._num_parts))
+        temporary = os.path.join(
+            self._directory, "unfinished_{}".format(os.path.basename(path)))
+        np.savez_compressed(
+            temporary,
+            digests=np.array([spec.digest for spec in specs]),
+            **arrays)
+        os.rename(temporary, path)
+        self._num_parts += 1
+
+    def remove(self):
+        """Remove the files of the checkpoint.
+
+        The directory itself is only removed if nothing else is in it.
+        """
+        if not os.path.exists(self._directory):
+            return
+        paths = [os.path.join(self._directory, "checkpoint.json")]
+        paths += self._parts()
+        paths += glob.glob(os.path.join(self._directory, "unfinished_*"))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if not os.listdir(self._directory):
+            os.rmdir(self._directory)
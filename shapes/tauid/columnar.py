@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Columnar NumPy backend.
+
+Only the branches referenced by the cuts, weights and variables of the specs
+are read from the trees as NumPy arrays. Selections are evaluated as boolean
+masks and histograms are filled with weighted bincounts. Every input tree is
+processed as an independent task, so the backend scales over cores with a
+pool of processes, see tauid.scheduler.
+"""
+
+import numpy as np
+
+from .expression import compile_expression
+from .scheduler import count_events, report, schedule
+from .specs import group_by_input, shared_cut_order
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def referenced_branches(specs):
+    """Set of all branches read by the cuts, weights and variables."""
+    branches = set()
+    for spec in specs:
+        expressions = [cut for _, cut in spec.cuts]
+        expressions += [weight for _, weight in spec.weights]
+        if not spec.is_count:
+            expressions.append(spec.expression)
+        if spec.is_partition:
+            expressions.append(spec.category_expression)
+        for expression in expressions:
+            branches |= compile_expression(expression).branches
+    return branches
+
+
+def fill_histogram(values, weights, edges):
+    """Weighted histogram with the bin layout of ROOT.
+
+    Returns sumw and sumw2 with len(edges) + 1 entries, where the first and
+    the last entry are the underflow and overflow bins. As for TH1, the
+    upper edge of every bin is exclusive.
+    """
+    indices = np.searchsorted(edges, values, side="right")
+    sumw = np.bincount(indices, weights=weights, minlength=len(edges) + 1)
+    sumw2 = np.bincount(
+        indices, weights=weights * weights, minlength=len(edges) + 1)
+    return sumw, sumw2
+
+
+def count_entries(values, edges, categories=None, num_categories=None):
+    """Number of events in the range of the edges.
+
+    With the category indices of a partition, returns the number of events
+    in range per category, events outside of all categories are dropped.
+    """
+    in_range = (values >= edges[0]) & (values < edges[-1])
+    if categories is None:
+        return int(np.count_nonzero(in_range))
+    categories = categories[in_range].astype(np.int64)
+    categories = categories[(categories >= 0) & (categories < num_categories)]
+    return [int(n) for n in np.bincount(categories, minlength=num_categories)]
+
+
+def fill_categories(categories, values, weights, edges, num_categories):
+    """Weighted histograms of the values per category index.
+
+    Returns sumw and sumw2 with one row in the layout of fill_histogram per
+    category. Events with an index outside of the categories are dropped.
+    """
+    categories = categories.astype(np.int64)
+    selected = (categories >= 0) & (categories < num_categories)
+    indices = categories[selected] * (len(edges) + 1) + np.searchsorted(
+        edges, values[selected], side="right")
+    weights = weights[selected]
+    shape = (num_categories, len(edges) + 1)
+    sumw = np.bincount(
+        indices, weights=weights, minlength=shape[0] * shape[1])
+    sumw2 = np.bincount(
+        indices, weights=weights * weights, minlength=shape[0] * shape[1])
+    return sumw.reshape(shape), sumw2.reshape(shape)
+
+
+class SelectionCache(object):
+    """Masks and selected values of the ordered cut tuples of one input tree.
+
+    Masks are cached by their prefix of cuts, so the selection shared by
+    all categories of a process is evaluated only once. Expressions are
+    evaluated once per tree and selected once per cut tuple, so a variation
+    which only changes a weight factor, like ReplaceWeight, AddWeight or
+    SquareAndRemoveWeight, only costs the evaluation of its new factor and
+    a product of arrays on top of the nominal histogram.
+    """
+
+    def __init__(self, columns, num_events):
+        self._columns = columns
+        self._num_events = num_events
+        self._masks = {(): np.ones(num_events, dtype=np.bool_)}
+        self._values = {}
+        self._selected = {}
+
+    def mask(self, cuts):
+        if cuts not in self._masks:
+            self._masks[cuts] = self.mask(cuts[:-1]) & compile_expression(
+                cuts[-1]).mask(self._columns, self._num_events)
+        return self._masks[cuts]
+
+    def values(self, cuts, expression):
+        """Values of the expression for the events passing the cuts."""
+        if expression not in self._values:
+            self._values[expression] = compile_expression(expression).values(
+                self._columns, self._num_events)
+        if (cuts, expression) not in self._selected:
+            self._selected[(cuts, expression)] = self._values[expression][
+                self.mask(cuts)]
+        return self._selected[(cuts, expression)]
+
+    def weights(self, cuts, weights):
+        """Product of the weight factors for the events passing the cuts."""
+        product = np.ones(np.count_nonzero(self.mask(cuts)))
+        for _, weight in weights:
+            product = product * self.values(cuts, weight)
+        return product
+
+
+def fill_group(specs, columns, num_events):
+    """Fill the specs of one input tree from a dictionary of branch arrays.
+
+    Returns per spec a tuple of sumw and sumw2, which are arrays with
+    under- and overflow for histograms, one row per category for partitions,
+    and floats for counts.
+    """
+    selections = SelectionCache(columns, num_events)
+    results = []
+    entries = []
+    for spec, cuts in zip(specs, shared_cut_order(specs)):
+        weights = selections.weights(cuts, spec.weights)
+        if spec.is_count:
+            results.append((float(np.sum(weights)),
+                            float(np.sum(weights * weights))))
+            entries.append(len(weights))
+        elif spec.is_partition:
+            categories = selections.values(cuts, spec.category_expression)
+            values = selections.values(cuts, spec.expression)
+            results.append(
+                fill_categories(categories, values, weights, spec.edges,
+                                spec.num_categories))
+            entries.append(
+                count_entries(values, spec.edges, categories,
+                              spec.num_categories))
+        else:
+            values = selections.values(cuts, spec.expression)
+            results.append(fill_histogram(values, weights, spec.edges))
+            entries.append(count_entries(values, spec.edges))
+    report("events_read", num_events)
+    report("events_selected", entries)
+    return results
+
+
+def read_columns(tree_path, files, friend_files, branches):
+    """Read the given branches of a chain of trees as NumPy arrays."""
+    import ROOT
+    chain = ROOT.TChain(tree_path)
+    for path in files:
+        chain.Add(path)
+    friends = []
+    for friend in friend_files:
+        friend_chain = ROOT.TChain(tree_path)
+        for path in friend:
+            friend_chain.Add(path)
+        chain.AddFriend(friend_chain)
+        friends.append(friend_chain)
+    num_events = chain.GetEntries()
+    if num_events == 0:
+        return dict((name, np.zeros(0)) for name in branches), num_events
+    if not branches:
+        return {}, num_events
+    columns = ROOT.RDataFrame(chain).AsNumpy(sorted(branches))
+    return dict((str(name), np.asarray(array))
+                for name, array in columns.items()), num_events
+
+
+def process_group(task):
+    """Read one input tree and fill all its specs."""
+    (tree_path, files, friend_files), specs = task
+    columns, num_events = read_columns(tree_path, files, friend_files,
+                                       referenced_branches(specs))
+    return fill_group(specs, columns, num_events)
+
+
+class ColumnarBackend(object):
+    """Fill all specs from NumPy arrays with one process per input tree."""
+
+    def __init__(self, num_workers=1):
+        self._num_workers = num_workers
+
+    def run(self, specs):
+        """Fill the specs and return the results in the same order.
+
+        Every result is a tuple of sumw and sumw2, which are arrays
+        including under- and overflow for histograms and floats for counts.
+        """
+        groups = group_by_input(specs)
+        tasks = [(key, [specs[index] for index in indices])
+                 for key, indices in groups]
+        logger.info("Process %d input trees with %d workers.", len(tasks),
+                    self._num_workers)
+        costs = [count_events(key[0], key[1]) for key, _ in tasks]
+        group_results = schedule(process_group, tasks, costs,
+                                 self._num_workers)
+
+        results = [None] * len(specs)
+        for (_, indices), filled in zip(groups, group_results):
+            for index, result in zip(indices, filled):
+                results[index] = result
+        return results
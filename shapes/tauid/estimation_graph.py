@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""Graph of the estimations and the root objects they need.
+
+Every systematic declares its inputs through the root objects created by its
+estimation method. Plain estimations need a single histogram, composite
+estimations need several: QCDEstimation_SStoOS_MTETEM needs the same-sign
+data and background histograms and AddHistogramEstimationMethod needs the
+histograms of the added processes. Inputs with the same fingerprint are
+merged into one node of the graph, so an input shared by several composites,
+e.g. the same-sign ZL histogram of QCD and QCDEMB, is filled once. The
+composites are formed from the filled inputs afterwards, with array
+operations for plain estimations, QCDEstimation_SStoOS_MTETEM and
+AddHistogramEstimationMethod and by the estimation methods themselves for
+all others.
+
+A composite estimation method keeps the systematics of its inputs as
+attributes, which every call of create_root_objects replaces. One method
+serves all categories and variations of its process, and the graph creates
+the root objects of all systematics before any estimation. The graph
+therefore records the attributes of the composite methods right after the
+root objects of a systematic are created and restores them before the
+systematic is estimated, for the array operations as well as for the
+estimation methods. The first shape of every composite estimation method is
+also formed by the method itself and compared. If the shapes differ, the
+method does all its estimations itself.
+"""
+
+from shape_producer.estimation_methods import (
+    EstimationMethod, AddHistogramEstimationMethod)
+
+import numpy as np
+
+from .histogram import ArrayHistogram
+from .roothist import from_th1, to_th1
+from .specs import spec_from_root_object
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _function(method):
+    return getattr(method, "__func__", method)
+
+
+def _is_composite(method):
+    return isinstance(method, AddHistogramEstimationMethod) or hasattr(
+        method, "_qcd_systematics")
+
+
+def _composite_methods(systematic):
+    """Composite estimation methods of the systematic and of its inputs."""
+    method = systematic.process.estimation_method
+    if not _is_composite(method):
+        return []
+    methods = [method]
+    for inputs in (getattr(method, "_add_systematics", []),
+                   getattr(method, "_qcd_systematics", [])):
+        for input_systematic in inputs:
+            methods += _composite_methods(input_systematic)
+    return methods
+
+
+def _state(method):
+    """Copy of the attributes of an estimation method."""
+    return dict((key, list(value) if isinstance(value, list) else value)
+                for key, value in vars(method).items())
+
+
+def _array_estimation(systematic, histograms):
+    """Shape of the systematic formed from the filled array histograms.
+
+    histograms maps the ids of the root objects to their ArrayHistogram.
+    Returns None if the estimation method has to do the estimation itself.
+    """
+    method = systematic.process.estimation_method
+    if isinstance(method, AddHistogramEstimationMethod):
+        shapes = [
+            _array_estimation(s, histograms)
+            for s in getattr(method, "_add_systematics", [])
+        ]
+        weights = getattr(method, "_add_weights", [])
+        if not shapes or None in shapes or len(weights) != len(shapes):
+            return None
+        shape = shapes[0].scale(weights[0])
+        for other, weight in zip(shapes[1:], weights[1:]):
+            shape = shape + other.scale(weight)
+        return shape
+    if hasattr(method, "_qcd_systematics") and hasattr(
+            method, "_extrapolation_factor"):
+        shapes = [
+            _array_estimation(s, histograms) for s in method._qcd_systematics
+        ]
+        if not shapes or None in shapes:
+            return None
+        # Same-sign data minus backgrounds, without negative yields
+        shape = shapes[0]
+        for other in shapes[1:]:
+            shape = shape - other
+        return shape.clip().scale(method._extrapolation_factor)
+    if _function(type(method).do_estimation) is not _function(
+            EstimationMethod.do_estimation):
+        return None
+    if len(systematic.root_objects) != 1:
+        return None
+    return histograms.get(id(systematic.root_objects[0]))
+
+
+class EstimationGraph(object):
+    def __init__(self, systematics):
+        self._systematics = list(systematics)
+        self._verified = {}
+        self._unresolved = set()
+        self._specs = []
+        self._inputs = []
+        self._states = []
+        self._consumers = []
+        positions = {}
+        names = set()
+        for index, systematic in enumerate(self._systematics):
+            systematic.create_root_objects()
+            self._states.append([(method, _state(method))
+                                 for method in _composite_methods(systematic)])
+            inputs = []
+            for root_object in systematic.root_objects:
+                spec = spec_from_root_object(root_object)
+                fingerprint = spec.fingerprint
+                if fingerprint not in positions:
+                    # Root objects of other working points have the same
+                    # names, the specs are told apart by their names in the
+                    # profile.
+                    if spec.name in names:
+                        spec.name = "{}@{}".format(spec.name,
+                                                   len(self._specs))
+                    names.add(spec.name)
+                    positions[fingerprint] = len(self._specs)
+                    self._specs.append(spec)
+                    self._consumers.append([])
+                node = positions[fingerprint]
+                if index not in self._consumers[node][-1:]:
+                    self._consumers[node].append(index)
+                inputs.append((root_object, node))
+            self._inputs.append(inputs)
+
+    @property
+    def specs(self):
+        """Specs of the unique inputs, one per node, with unique names."""
+        return self._specs
+
+    @property
+    def systematics(self):
+        return self._systematics
+
+    @property
+    def num_root_objects(self):
+        return sum(len(inputs) for inputs in self._inputs)
+
+    def inputs(self, index):
+        """Root objects and their nodes needed by the systematic."""
+        return self._inputs[index]
+
+    def consumers(self, node):
+        """Indices of the systematics needing the node."""
+        return self._consumers[node]
+
+    def nodes(self, index):
+        """Set of the nodes needed by the systematic."""
+        return set(node for _, node in self._inputs[index])
+
+    def restore(self, index):
+        """Set the composite estimation methods to the systematic's inputs."""
+        for method, state in self._states[index]:
+            method.__dict__.update(state)
+
+    def assign(self, index, results):
+        """Hand the filled inputs to the root objects of the systematic.
+
+        results maps the nodes to the tuples of sumw and sumw2 returned by
+        the backends. Every root object gets its own TH1 under its own name,
+        counts get the sum of weights. The composite estimation methods get
+        back the inputs of the systematic.
+        """
+        self.restore(index)
+        for root_object, node in self._inputs[index]:
+            spec = self._specs[node]
+            sumw, sumw2 = results[node]
+            if spec.is_count:
+                root_object._result = sumw
+            else:
+                root_object._result = to_th1(root_object.name, spec.edges,
+                                             sumw, sumw2)
+
+    def estimate(self, index, results):
+        """Shape of the systematic as ArrayHistogram or None.
+
+        Returns None if the shape can not be formed with array operations.
+        In this case, the inputs have to be assigned and the estimation
+        method has to do the estimation.
+        """
+        self.restore(index)
+        systematic = self._systematics[index]
+        method = systematic.process.estimation_method
+        name = type(method).__name__
+        if not _is_composite(method):
+            return _array_estimation(systematic, self._histograms(
+                index, results))
+        if self._verified.get(name) is False:
+            return None
+        shape = _array_estimation(systematic, self._histograms(
+            index, results))
+        if shape is None:
+            if name not in self._unresolved:
+                self._unresolved.add(name)
+                logger.warning(
+                    "Inputs of %s of %s are unknown, the estimation method forms the shape.",
+                    systematic.name, name)
+            return None
+        if name not in self._verified:
+            self._verified[name] = self._matches(index, results, shape)
+            if not self._verified[name]:
+                logger.warning(
+                    "Array shape of %s differs from the one of %s, the estimation method forms all its shapes.",
+                    systematic.name, name)
+                return None
+            logger.debug("Array shape of %s matches the one of %s.",
+                         systematic.name, name)
+        return shape
+
+    def _histograms(self, index, results):
+        histograms = {}
+        for root_object, node in self._inputs[index]:
+            spec = self._specs[node]
+            if not spec.is_count:
+                histograms[id(root_object)] = ArrayHistogram(
+                    spec.edges, *results[node])
+        return histograms
+
+    def _matches(self, index, results, shape):
+        """Compare the array shape to the one of the estimation method."""
+        systematic = self._systematics[index]
+        self.assign(index, results)
+        systematic.do_estimation()
+        sumw, sumw2 = from_th1(systematic.shape.result)
+        self.release(index)
+        return len(sumw) == len(shape.sumw) and np.allclose(
+            sumw, shape.sumw, rtol=1e-6, atol=1e-9) and np.allclose(
+                sumw2, shape.sumw2, rtol=1e-6, atol=1e-9)
+
+    def release(self, index):
+        """Drop the filled root objects and the shape of the systematic."""
+        for root_object, _ in self._inputs[index]:
+            root_object._result = None
+        self._systematics[index]._shape = None
+
+    def log_summary(self):
+        logger.info("%d root objects of %d systematics need %d unique inputs.",
+                    self.num_root_objects, len(self._systematics),
+                    len(self._specs))
+        composites = {}
+        for index, inputs in enumerate(self._inputs):
+            if len(inputs) < 2:
+                continue
+            name = self._systematics[index].process.name
+            num_inputs, num_shared = composites.get(name, (0, 0))
+            num_shared += sum(1 for _, node in inputs
+                              if len(self._consumers[node]) > 1)
+            composites[name] = (num_inputs + len(inputs), num_shared)
+        for name in sorted(composites):
+            logger.info("Composite %s uses %d inputs, %d of them shared.",
+                        name, *composites[name])
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""Vectorised evaluation of cut, weight and variable expressions.
+
+The expressions used in the era scripts and binning.yaml are a small subset
+of the TTreeFormula syntax: branches, numbers, arithmetic, comparisons,
+logical operators, the ternary operator and a few mathematical functions.
+They are parsed here into a tree of NumPy operations, which evaluates a cut
+as a boolean mask and a weight or variable as a float array. As for
+TTree::Draw, all arithmetic is done in double precision.
+"""
+
+import re
+
+import numpy as np
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)[fF]?
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*(?:::[A-Za-z_][A-Za-z0-9_]*)*)
+      | (?P<operator>\|\||&&|==|!=|<=|>=|[-+*/%<>!?:(),])
+    )""", re.VERBOSE)
+
+_FUNCTIONS = {
+    "abs": (1, np.abs),
+    "fabs": (1, np.abs),
+    "TMath::Abs": (1, np.abs),
+    "sqrt": (1, np.sqrt),
+    "TMath::Sqrt": (1, np.sqrt),
+    "exp": (1, np.exp),
+    "TMath::Exp": (1, np.exp),
+    "log": (1, np.log),
+    "TMath::Log": (1, np.log),
+    "cos": (1, np.cos),
+    "TMath::Cos": (1, np.cos),
+    "sin": (1, np.sin),
+    "TMath::Sin": (1, np.sin),
+    "tanh": (1, np.tanh),
+    "TMath::TanH": (1, np.tanh),
+    "max": (2, np.maximum),
+    "std::max": (2, np.maximum),
+    "TMath::Max": (2, np.maximum),
+    "min": (2, np.minimum),
+    "std::min": (2, np.minimum),
+    "TMath::Min": (2, np.minimum),
+    "pow": (2, np.power),
+    "TMath::Power": (2, np.power),
+    "atan2": (2, np.arctan2),
+    "TMath::ATan2": (2, np.arctan2),
+}
+
+_CONSTANTS = {
+    "true": 1.0,
+    "false": 0.0,
+    "TMath::Pi": np.pi,
+}
+
+
+def _as_float(value):
+    return np.asarray(value, dtype=np.float64)
+
+
+def _as_bool(value):
+    value = np.asarray(value)
+    if value.dtype == np.bool_:
+        return value
+    return value != 0
+
+
+_BINARY = {
+    "||": lambda a, b: np.logical_or(_as_bool(a), _as_bool(b)),
+    "&&": lambda a, b: np.logical_and(_as_bool(a), _as_bool(b)),
+    "==": lambda a, b: _as_float(a) == _as_float(b),
+    "!=": lambda a, b: _as_float(a) != _as_float(b),
+    "<": lambda a, b: _as_float(a) < _as_float(b),
+    "<=": lambda a, b: _as_float(a) <= _as_float(b),
+    ">": lambda a, b: _as_float(a) > _as_float(b),
+    ">=": lambda a, b: _as_float(a) >= _as_float(b),
+    "+": lambda a, b: _as_float(a) + _as_float(b),
+    "-": lambda a, b: _as_float(a) - _as_float(b),
+    "*": lambda a, b: _as_float(a) * _as_float(b),
+    "/": lambda a, b: _as_float(a) / _as_float(b),
+    "%": lambda a, b: np.fmod(
+        _as_float(a).astype(np.int64), _as_float(b).astype(np.int64)),
+}
+
+# Binary operators from lowest to highest precedence
+_PRECEDENCE = [
+    ("||", ),
+    ("&&", ),
+    ("==", "!="),
+    ("<", "<=", ">", ">="),
+    ("+", "-"),
+    ("*", "/", "%"),
+]
+
+
+class ExpressionError(Exception):
+    pass
+
+
+class Node(object):
+    def evaluate(self, columns):
+        raise NotImplementedError
+
+
+class Constant(Node):
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, columns):
+        return self.value
+
+
+class Branch(Node):
+    def __init__(self, name):
+        self.name = name
+
+    def evaluate(self, columns):
+        return columns[self.name]
+
+
+class Call(Node):
+    def __init__(self, function, arguments):
+        self.function = function
+        self.arguments = arguments
+
+    def evaluate(self, columns):
+        return self.function(
+            * [_as_float(arg.evaluate(columns)) for arg in self.arguments])
+
+
+class Unary(Node):
+    def __init__(self, operator, operand):
+        self.operator = operator
+        self.operand = operand
+
+    def evaluate(self, columns):
+        value = self.operand.evaluate(columns)
+        if self.operator == "!":
+            return np.logical_not(_as_bool(value))
+        if self.operator == "-":
+            return -_as_float(value)
+        return _as_float(value)
+
+
+class Binary(Node):
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def evaluate(self, columns):
+        return _BINARY[self.operator](
+            self.left.evaluate(columns), self.right.evaluate(columns))
+
+
+class Ternary(Node):
+    def __init__(self, condition, if_true, if_false):
+        self.condition = condition
+        self.if_true = if_true
+        self.if_false = if_false
+
+    def evaluate(self, columns):
+        return np.where(
+            _as_bool(self.condition.evaluate(columns)),
+            _as_float(self.if_true.evaluate(columns)),
+            _as_float(self.if_false.evaluate(columns)))
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None or match.end() == position:
+            raise ExpressionError("Cannot parse '{}' at position {}.".format(
+                expression, position))
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+class _Parser(object):
+    def __init__(self, expression):
+        self._expression = expression
+        self._tokens = _tokenize(expression)
+        self._position = 0
+        self.branches = set()
+
+    def _peek(self):
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self._position += 1
+        return token
+
+    def _expect(self, value):
+        kind, token = self._next()
+        if token != value:
+            raise ExpressionError("Expected '{}' instead of '{}' in '{}'.".format(
+                value, token, self._expression))
+
+    def parse(self):
+        node = self._ternary()
+        if self._peek()[0] is not None:
+            raise ExpressionError("Unexpected '{}' in '{}'.".format(
+                self._peek()[1], self._expression))
+        return node
+
+    def _ternary(self):
+        condition = self._binary(0)
+        if self._peek() == ("operator", "?"):
+            self._next()
+            if_true = self._ternary()
+            self._expect(":")
+            if_false = self._ternary()
+            return Ternary(condition, if_true, if_false)
+        return condition
+
+    def _binary(self, level):
+        if level == len(_PRECEDENCE):
+            return self._unary()
+        node = self._binary(level + 1)
+        while self._peek()[0] == "operator" and self._peek()[1] in _PRECEDENCE[level]:
+            operator = self._next()[1]
+            node = Binary(operator, node, self._binary(level + 1))
+        return node
+
+    def _unary(self):
+        if self._peek()[0] == "operator" and self._peek()[1] in ("!", "-", "+"):
+            operator = self._next()[1]
+            return Unary(operator, self._unary())
+        return self._primary()
+
+    def _primary(self):
+        kind, token = self._next()
+        if kind == "number":
+            return Constant(float(token.rstrip("fF")))
+        if kind == "name":
+            if self._peek() == ("operator", "("):
+                return self._call(token)
+            if token in _CONSTANTS:
+                return Constant(_CONSTANTS[token])
+            self.branches.add(token)
+            return Branch(token)
+        if token == "(":
+            node = self._ternary()
+            self._expect(")")
+            return node
+        raise ExpressionError("Unexpected '{}' in '{}'.".format(
+            token, self._expression))
+
+    def _call(self, name):
+        if name not in _FUNCTIONS:
+            raise ExpressionError("Function {} in '{}' is not supported.".format(
+                name, self._expression))
+        num_arguments, function = _FUNCTIONS[name]
+        self._expect("(")
+        arguments = [self._ternary()]
+        while self._peek() == ("operator", ","):
+            self._next()
+            arguments.append(self._ternary())
+        self._expect(")")
+        if len(arguments) != num_arguments:
+            raise ExpressionError("Function {} takes {} arguments in '{}'.".format(
+                name, num_arguments, self._expression))
+        return Call(function, arguments)
+
+
+class Expression(object):
+    """Compiled expression with the set of branches it reads."""
+
+    def __init__(self, expression):
+        parser = _Parser(expression)
+        self.expression = expression
+        self._node = parser.parse()
+        self.branches = frozenset(parser.branches)
+
+    def evaluate(self, columns, num_events):
+        """Evaluate on a dictionary of branch arrays of length num_events."""
+        return np.broadcast_to(self._node.evaluate(columns), (num_events, ))
+
+    def mask(self, columns, num_events):
+        return _as_bool(self.evaluate(columns, num_events))
+
+    def values(self, columns, num_events):
+        return _as_float(self.evaluate(columns, num_events))
+
+
+_cache = {}
+
+
+def compile_expression(expression):
+    """Compile an expression, reusing already compiled ones."""
+    if expression not in _cache:
+        _cache[expression] = Expression(expression)
+    return _cache[expression]
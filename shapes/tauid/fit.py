@@ -0,0 +1,728 @@
+# -*- coding: utf-8 -*-
+"""Binned maximum likelihood fit of the Tau ID SF on the produced shapes.
+
+The model follows the datacards of the measurement: the signal (ZTT, or EMB
+with embedding) of every category is scaled by its SF, the DY cross section
+is a free rate parameter constrained by the Z->mumu control region, the
+normalisation uncertainties of the uncertainty model in the Readme are lnN
+nuisances and the statistical uncertainties of the templates are included
+with one Gaussian nuisance per bin as in Barlow-Beeston-lite. Shape
+uncertainties and the automatic rebinning of the datacards are not
+included, so the result is a quick preview and not a replacement of the
+fit with combine.
+
+With embedding, the control region is not fitted. The rate parameter of
+the embedded samples, i.e. the double muon trigger efficiency, then scales
+the same template as the SF and can not be told apart from it, so it is
+fixed to one instead of being a free parameter within a narrow range.
+
+The likelihood, its gradient and its Hessian are computed analytically on
+arrays of all bins and templates, and the likelihood is minimised with
+Newton steps. The errors are the Hesse errors at the minimum.
+"""
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.special import xlogy
+
+import logging
+logger = logging.getLogger(__name__)
+
+CATEGORIZATIONS = {
+    "pt_binned": [
+        "Pt20to25", "Pt25to30", "Pt30to35", "Pt35to40", "Pt40to50",
+        "Pt50to70", "PtGt70"
+    ],
+    "dm_binned": ["DM0", "DM1", "DM10", "DM11"],
+    "inclusive": ["Inclusive"],
+}
+
+CONTROL_CATEGORY = "control"
+
+# Processes of the datacards with (False) and without (True) embedding
+PROCESSES = {
+    ("mt", False): [
+        "ZTT", "ZL", "ZJ", "TTT", "TTL", "TTJ", "VVT", "VVL", "VVJ", "W", "QCD"
+    ],
+    ("mt", True):
+    ["EMB", "ZL", "ZJ", "TTL", "TTJ", "VVL", "VVJ", "W", "QCDEMB"],
+    ("mm", False): ["ZLL", "TT", "VV", "W", "QCD"],
+}
+
+SIGNAL = {False: "ZTT", True: "EMB"}
+
+DY_PROCESSES = ("ZTT", "ZL", "ZJ", "ZLL")
+QCD_PROCESSES = ("QCD", "QCDEMB")
+
+# lnN uncertainties as (name, channels, processes, kappa), see the
+# uncertainty model in the Readme. Uncertainties uncorrelated with the
+# Z->mumu region only act on the mt channel or have a separate nuisance per
+# channel.
+LNN_UNCERTAINTIES = [
+    ("CMS_eff_m", ("mt", "mm"),
+     ("ZTT", "ZL", "ZJ", "ZLL", "TTT", "TTL", "TTJ", "TT", "VVT", "VVL",
+      "VVJ", "VV", "W", "EMB", "MMEMB"), 1.02),
+    ("lumi_13TeV", ("mt", "mm"),
+     ("ZTT", "ZL", "ZJ", "ZLL", "TTT", "TTL", "TTJ", "TT", "VVT", "VVL",
+      "VVJ", "VV", "W"), 1.025),
+    ("CMS_htt_dyXsec", ("mt", "mm"), DY_PROCESSES, 1.02),
+    ("CMS_htt_qcd_norm", ("mt", "mm"), QCD_PROCESSES, 1.30),
+    ("CMS_htt_vvXsec", ("mt", "mm"), ("VVT", "VVL", "VVJ", "VV"), 1.06),
+    ("CMS_htt_tjXsec", ("mt", "mm"), ("TTT", "TTL", "TTJ", "TT"), 1.055),
+    ("CMS_htt_wnorm_mt", ("mt", ), ("W", ), 1.05),
+    ("CMS_htt_wnorm_mm", ("mm", ), ("W", ), 1.05),
+    ("CMS_htt_jetToTauFake", ("mt", ), ("ZJ", "TTJ", "VVJ", "W"), 1.10),
+    ("CMS_htt_mFakeTau", ("mt", ), ("ZL", "TTL", "VVL"), 1.50),
+    ("CMS_scale_t", ("mt", ), ("ZTT", "TTT", "VVT", "EMB"), 1.03),
+    ("CMS_scale_fakeTau_j", ("mt", ), ("ZJ", "TTJ", "VVJ", "W"), 1.10),
+    ("CMS_scale_fakeTau_m", ("mt", ), ("ZL", "TTL", "VVL"), 1.03),
+]
+
+POI_RANGE = (0.0, 10.0)
+RATE_RANGE = (0.0, 10.0)
+
+
+def lnn_uncertainties(era):
+    """lnN uncertainties of the era."""
+    uncertainties = []
+    for name, channels, processes, kappa in LNN_UNCERTAINTIES:
+        # The mu->tau fake rate uncertainty is 100% in 2018
+        if name == "CMS_htt_mFakeTau" and era == "2018":
+            kappa = 2.0
+        uncertainties.append((name, channels, processes, kappa))
+    return uncertainties
+
+
+def read_shapes(path, era, categories, embedding=False):
+    """Nominal templates and data of the categories from a shapes file.
+
+    Returns a dict of (channel, category, process) to a tuple of sumw and
+    sumw2 without under- and overflow. The Z->mumu control region is read
+    in addition to the mt categories without embedding.
+    """
+    import ROOT
+    from .roothist import from_th1
+    wanted = set(("mt", "mt_" + category) for category in categories)
+    if not embedding:
+        wanted.add(("mm", "mm_" + CONTROL_CATEGORY))
+    shapes = {}
+    shape_file = ROOT.TFile(path, "READ")
+    if shape_file.IsZombie():
+        logger.critical("Shapes file %s can not be opened.", path)
+        raise Exception
+    for key in shape_file.GetListOfKeys():
+        parts = key.GetName().split("#")
+        if len(parts) < 4 or parts[-1] != "Nominal":
+            continue
+        channel, category, process = parts[:3]
+        if (channel, category) not in wanted:
+            continue
+        sumw, sumw2 = from_th1(key.ReadObj())
+        shapes[(channel, category[len(channel) + 1:],
+                process)] = (sumw[1:-1], sumw2[1:-1])
+    shape_file.Close()
+    return shapes
+
+
+class Model(object):
+    """Binned likelihood of the mt categories and the control region.
+
+    The parameters are the SF of every mt category, the rate parameter of
+    DY (without embedding only), the lnN nuisances and one nuisance per bin
+    for the template statistics.
+    """
+
+    def __init__(self,
+                 shapes,
+                 era,
+                 categories,
+                 embedding=False,
+                 ranges=None):
+        regions = [("mt", category) for category in categories]
+        if not embedding:
+            regions.append(("mm", CONTROL_CATEGORY))
+        signal = SIGNAL[embedding]
+        rates = [] if embedding else ["CMS_htt_zjXsec"]
+        uncertainties = lnn_uncertainties(era)
+
+        # Templates as rows of yields over the bins of all regions
+        templates = []
+        data = []
+        offsets = {}
+        num_bins = 0
+        for channel, category in regions:
+            key = (channel, category, "data_obs")
+            if key not in shapes:
+                logger.critical("Data of %s_%s is missing.", channel,
+                                category)
+                raise Exception
+            offsets[(channel, category)] = num_bins
+            data.append(shapes[key][0])
+            num_bins += len(shapes[key][0])
+        for channel, category in regions:
+            for process in PROCESSES[(channel, embedding)]:
+                key = (channel, category, process)
+                if key not in shapes:
+                    logger.warning("Template %s of %s_%s is missing.",
+                                   process, channel, category)
+                    continue
+                templates.append((channel, category, process))
+
+        self.pois = ["r_{}".format(category) for category in categories]
+        self.rates = rates
+        self.nuisances = [name for name, _, _, _ in uncertainties]
+        self.templates = templates
+        self.data = np.concatenate(data)
+        self.yields = np.zeros((len(templates), num_bins))
+        self.errors = np.zeros((len(templates), num_bins))
+        linear = np.zeros((len(templates), len(self.pois) + len(rates)))
+        self.log_kappas = np.zeros((len(templates), len(self.nuisances)))
+        for t, (channel, category, process) in enumerate(templates):
+            sumw, sumw2 = shapes[(channel, category, process)]
+            begin = offsets[(channel, category)]
+            # Negative bins of the templates, e.g. of the QCD estimation,
+            # are set to zero as in the datacards
+            self.yields[t, begin:begin + len(sumw)] = np.maximum(sumw, 0.0)
+            self.errors[t, begin:begin + len(sumw)] = sumw2
+            if channel == "mt" and process == signal:
+                linear[t, categories.index(category)] = 1.0
+            if rates and process in DY_PROCESSES:
+                linear[t, len(self.pois)] = 1.0
+            for j, (_, channels, processes,
+                    kappa) in enumerate(uncertainties):
+                if channel in channels and process in processes:
+                    self.log_kappas[t, j] = np.log(kappa)
+        self.linear = linear
+
+        # Bins without any expected events do not enter the likelihood
+        expected = self.yields.sum(axis=0)
+        used = expected > 0.0
+        self.data = self.data[used]
+        self.yields = self.yields[:, used]
+        self.errors = np.sqrt(self.errors[:, used].sum(axis=0))
+        self.bins = int(used.sum())
+
+        self.names = self.pois + self.rates + self.nuisances + [
+            "prop_bin{}".format(i) for i in range(self.bins)
+        ]
+        ranges = ranges or {}
+        bounds = [ranges.get(name, POI_RANGE) for name in self.pois]
+        bounds += [ranges.get(name, RATE_RANGE) for name in rates]
+        bounds += [ranges.get(name, (-5.0, 5.0)) for name in self.nuisances]
+        # The statistical nuisances must not remove more than the
+        # expected events of a bin
+        bounds += [(max(-5.0, -0.999 * total / error)
+                    if error > 0 else -5.0, 5.0)
+                   for total, error in zip(self.yields.sum(axis=0),
+                                           self.errors)]
+        self.bounds = bounds
+
+    @property
+    def num_linear(self):
+        return len(self.pois) + len(self.rates)
+
+    @property
+    def initial(self):
+        return np.concatenate([
+            np.ones(self.num_linear),
+            np.zeros(len(self.nuisances) + self.bins)
+        ])
+
+    def _split(self, x):
+        linear = x[:self.num_linear]
+        nuisances = x[self.num_linear:self.num_linear + len(self.nuisances)]
+        statistics = x[self.num_linear + len(self.nuisances):]
+        return linear, nuisances, statistics
+
+    def _scaled(self, x):
+        """Scale of every template, its yields and the expected events."""
+        linear, nuisances, statistics = self._split(x)
+        scale = np.prod(np.where(self.linear > 0, linear, 1.0),
+                        axis=1) * np.exp(self.log_kappas.dot(nuisances))
+        scaled = self.yields * scale[:, np.newaxis]
+        expected = scaled.sum(axis=0) + self.errors * statistics
+        return scale, scaled, np.maximum(expected, 1e-12)
+
+    def _products(self, x, excluded):
+        """Product of the linear factors of every template without some."""
+        linear, nuisances, _ = self._split(x)
+        factors = np.where(self.linear > 0, linear, 1.0)
+        factors[:, list(excluded)] = 1.0
+        return np.prod(factors, axis=1) * np.exp(
+            self.log_kappas.dot(nuisances))
+
+    def _derivatives(self, x):
+        """First and second derivatives of the template scales.
+
+        Returns a matrix of templates times linear parameters and nuisances
+        and an array of templates times two of them.
+        """
+        scale, _, _ = self._scaled(x)
+        num_linear = self.num_linear
+        linear = np.column_stack([
+            self.linear[:, k] * self._products(x, [k])
+            for k in range(num_linear)
+        ])
+        first = np.hstack(
+            [linear, scale[:, np.newaxis] * self.log_kappas])
+        second = np.zeros(first.shape + (first.shape[1], ))
+        for k in range(num_linear):
+            for l in range(k + 1, num_linear):
+                second[:, k, l] = second[:, l, k] = (
+                    self.linear[:, k] * self.linear[:, l] *
+                    self._products(x, [k, l]))
+        second[:, :num_linear, num_linear:] = (
+            linear[:, :, np.newaxis] * self.log_kappas[:, np.newaxis, :])
+        second[:, num_linear:, :num_linear] = np.transpose(
+            second[:, :num_linear, num_linear:], (0, 2, 1))
+        second[:, num_linear:, num_linear:] = (
+            scale[:, np.newaxis, np.newaxis] *
+            self.log_kappas[:, :, np.newaxis] *
+            self.log_kappas[:, np.newaxis, :])
+        return first, second
+
+    def nll(self, x):
+        """Negative log likelihood relative to the saturated model."""
+        _, _, expected = self._scaled(x)
+        _, nuisances, statistics = self._split(x)
+        poisson = np.sum(expected - self.data -
+                         xlogy(self.data, expected / np.maximum(
+                             self.data, 1e-12)))
+        return poisson + 0.5 * (nuisances.dot(nuisances) +
+                                statistics.dot(statistics))
+
+    def gradient(self, x):
+        _, _, expected = self._scaled(x)
+        _, nuisances, statistics = self._split(x)
+        first, _ = self._derivatives(x)
+        weights = 1.0 - self.data / expected
+        jacobian = self.yields.T.dot(first)
+        gradient = np.concatenate(
+            [weights.dot(jacobian), weights * self.errors + statistics])
+        gradient[self.num_linear:self.num_linear + len(nuisances)] += nuisances
+        return gradient
+
+    def nll_and_gradient(self, x):
+        return self.nll(x), self.gradient(x)
+
+    def hessian(self, x):
+        _, _, expected = self._scaled(x)
+        first, second = self._derivatives(x)
+        weights = 1.0 - self.data / expected
+        curvature = self.data / expected**2
+        jacobian = self.yields.T.dot(first)
+
+        num_shape = first.shape[1]
+        hessian = np.zeros((num_shape + self.bins, num_shape + self.bins))
+        shape = jacobian.T.dot(jacobian * curvature[:, np.newaxis])
+        shape += np.tensordot(self.yields.dot(weights), second, axes=1)
+        shape[self.num_linear:, self.num_linear:] += np.eye(
+            len(self.nuisances))
+        hessian[:num_shape, :num_shape] = shape
+        mixed = jacobian.T * (curvature * self.errors)[np.newaxis, :]
+        hessian[:num_shape, num_shape:] = mixed
+        hessian[num_shape:, :num_shape] = mixed.T
+        hessian[num_shape:, num_shape:] = np.diag(
+            curvature * self.errors**2 + 1.0)
+        return hessian
+
+
+class FitResult(object):
+    def __init__(self, names, values, covariance, free, nll, converged):
+        self.names = names
+        self.values = values
+        self.covariance = covariance
+        self.free = free
+        self.nll = nll
+        self.converged = converged
+
+    @property
+    def errors(self):
+        """Hesse errors, NaN if the Hessian is not positive definite."""
+        variances = np.diag(self.covariance)
+        errors = np.full(len(variances), np.nan)
+        valid = variances >= 0.0
+        errors[valid] = np.sqrt(variances[valid])
+        return errors
+
+    def value(self, name):
+        return self.values[self.names.index(name)]
+
+    def error(self, name):
+        return self.errors[self.names.index(name)]
+
+
+def covariance(hessian, free):
+    """Inverse of the Hessian of the free parameters.
+
+    Parameters at their bounds are treated as fixed and get no error. If
+    the Hessian of the free parameters is not positive definite, e.g. for
+    parameters which can not be told apart, the result is not a valid
+    covariance matrix and a warning is logged.
+    """
+    result = np.zeros(hessian.shape)
+    indices = np.flatnonzero(free)
+    block = hessian[np.ix_(indices, indices)]
+    if len(indices) > 0:
+        eigenvalues = np.linalg.eigvalsh(block)
+        if eigenvalues[0] <= 1e-9 * max(abs(eigenvalues[-1]), 1e-300):
+            logger.warning(
+                "Hessian is not positive definite (smallest eigenvalue %.3g), the errors are not valid.",
+                eigenvalues[0])
+    result[np.ix_(indices, indices)] = np.linalg.pinv(block)
+    return result
+
+
+def at_bounds(values, bounds, tolerance=1e-6):
+    return np.array([(low is not None and value - low < tolerance) or
+                     (high is not None and high - value < tolerance)
+                     for value, (low, high) in zip(values, bounds)])
+
+
+def _solve(hessian, gradient):
+    """Newton step, damped until the Hessian is positive definite."""
+    damping = 0.0
+    scale = np.max(np.abs(np.diag(hessian))) if hessian.size else 1.0
+    while True:
+        try:
+            factor = cho_factor(hessian + damping * np.eye(len(hessian)))
+            return -cho_solve(factor, gradient)
+        except np.linalg.LinAlgError:
+            damping = max(10.0 * damping, 1e-9 * scale)
+
+
+def newton(function, gradient, hessian, start, bounds, tolerance=1e-8,
+           max_iterations=100):
+    """Minimise with Newton steps projected onto the bounds.
+
+    Parameters at a bound with the gradient pointing outwards are kept
+    fixed in a step. Returns the minimum and whether it converged.
+    """
+    low = np.array([-np.inf if b[0] is None else b[0] for b in bounds])
+    high = np.array([np.inf if b[1] is None else b[1] for b in bounds])
+    x = np.clip(np.array(start, dtype=np.float64), low, high)
+    value = function(x)
+    for _ in range(max_iterations):
+        g = gradient(x)
+        free = ~(((x <= low) & (g > 0)) | ((x >= high) & (g < 0)))
+        if not free.any() or np.max(np.abs(g[free])) < tolerance:
+            return x, True
+        step = np.zeros(len(x))
+        step[free] = _solve(hessian(x)[np.ix_(free, free)], g[free])
+        length = 1.0
+        while length > 1e-10:
+            candidate = np.clip(x + length * step, low, high)
+            candidate_value = function(candidate)
+            if candidate_value <= value + 1e-4 * length * g.dot(step):
+                break
+            length *= 0.5
+        else:
+            logger.warning("Line search failed.")
+            return x, False
+        if value - candidate_value < 1e-12 * max(1.0, abs(value)):
+            return candidate, True
+        x, value = candidate, candidate_value
+    logger.warning("Fit did not converge in %d iterations.", max_iterations)
+    return x, False
+
+
+def fit(model, initial=None):
+    """Minimise the negative log likelihood and compute the Hesse errors."""
+    start = model.initial if initial is None else initial
+    values, converged = newton(model.nll, model.gradient, model.hessian,
+                               start, model.bounds)
+    free = ~at_bounds(values, model.bounds)
+    return FitResult(model.names, values,
+                     covariance(model.hessian(values), free), free,
+                     model.nll(values), converged)
+
+
+class BatchedModel(object):
+    """Independent likelihoods of every mt category with the control region.
+
+    Each category has its own SF, rate parameter (without embedding),
+    nuisances and statistical
+    nuisances, as the separate htt_mt_* datacards of combine, but the fits
+    of all categories are computed together on arrays with a leading batch
+    axis. The categories are padded to the same number of bins with empty
+    bins, which do not change the likelihood. The templates and data of the
+    control region are prepared once and shared by all categories.
+    """
+
+    def __init__(self,
+                 shapes,
+                 era,
+                 categories,
+                 embedding=False,
+                 ranges=None):
+        models = [
+            Model(shapes, era, [category], embedding, ranges=ranges)
+            for category in categories
+        ]
+        processes = [("mt", process)
+                     for process in PROCESSES[("mt", embedding)]]
+        if not embedding:
+            processes += [("mm", process)
+                          for process in PROCESSES[("mm", False)]]
+        num_mt_bins = max(
+            len(shapes[("mt", category, "data_obs")][0])
+            for category in categories)
+
+        def region_arrays(channel, category, num_bins):
+            data = np.zeros(num_bins)
+            sumw = shapes[(channel, category, "data_obs")][0]
+            data[:len(sumw)] = sumw
+            yields = np.zeros((len(processes), num_bins))
+            sumw2 = np.zeros((len(processes), num_bins))
+            for t, (template_channel, process) in enumerate(processes):
+                key = (channel, category, process)
+                if template_channel != channel or key not in shapes:
+                    continue
+                yields[t, :len(shapes[key][0])] = np.maximum(
+                    shapes[key][0], 0.0)
+                sumw2[t, :len(shapes[key][1])] = shapes[key][1]
+            return data, yields, sumw2
+
+        arrays = [
+            region_arrays("mt", category, num_mt_bins)
+            for category in categories
+        ]
+        data = np.array([array[0] for array in arrays])
+        yields = np.array([array[1] for array in arrays])
+        sumw2 = np.array([array[2] for array in arrays])
+        if not embedding:
+            control = region_arrays("mm", CONTROL_CATEGORY,
+                                    len(shapes[("mm", CONTROL_CATEGORY,
+                                                "data_obs")][0]))
+            num = len(categories)
+            data = np.hstack([data, np.tile(control[0], (num, 1))])
+            yields = np.concatenate(
+                [yields, np.broadcast_to(control[1], (num, ) +
+                                         control[1].shape)],
+                axis=2)
+            sumw2 = np.concatenate(
+                [sumw2, np.broadcast_to(control[2], (num, ) +
+                                        control[2].shape)],
+                axis=2)
+        # Bins without expected events are empty, as in Model
+        used = yields.sum(axis=1) > 0.0
+        self.data = np.where(used, data, 0.0)
+        self.yields = yields * used[:, np.newaxis, :]
+        self.errors = np.sqrt((sumw2 * used[:, np.newaxis, :]).sum(axis=1))
+
+        signal = SIGNAL[embedding]
+        rates = models[0].rates
+        uncertainties = lnn_uncertainties(era)
+        self.linear = np.array(
+            [[1.0 if channel == "mt" and process == signal else 0.0] +
+             [1.0 if process in DY_PROCESSES else 0.0 for _ in rates]
+             for channel, process in processes])
+        self.log_kappas = np.array(
+            [[
+                np.log(kappa)
+                if channel in channels and process in names else 0.0
+                for _, channels, names, kappa in uncertainties
+            ] for channel, process in processes])
+        self.categories = list(categories)
+        self.nuisances = models[0].nuisances
+        self.num_linear = 1 + len(rates)
+        self.bins = self.data.shape[1]
+        self.names = [["r_{}".format(category)] + rates + self.nuisances +
+                      ["prop_bin{}".format(i) for i in range(self.bins)]
+                      for category in categories]
+
+        bounds = np.array(
+            [
+                model.bounds[:self.num_linear + len(self.nuisances)]
+                for model in models
+            ],
+            dtype=np.float64)
+        totals = self.yields.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            statistics = np.where(self.errors > 0,
+                                  np.maximum(-5.0,
+                                             -0.999 * totals / self.errors),
+                                  -5.0)
+        self.low = np.hstack([bounds[:, :, 0], statistics])
+        self.high = np.hstack(
+            [bounds[:, :, 1],
+             np.full(statistics.shape, 5.0)])
+
+    @property
+    def initial(self):
+        start = np.zeros(self.low.shape)
+        start[:, :self.num_linear] = 1.0
+        return start
+
+    def _split(self, x):
+        num_shape = self.num_linear + len(self.nuisances)
+        return x[:, :self.num_linear], x[:, self.num_linear:
+                                          num_shape], x[:, num_shape:]
+
+    def _products(self, x, excluded):
+        linear, nuisances, _ = self._split(x)
+        factors = np.where(self.linear[np.newaxis, :, :] > 0,
+                           linear[:, np.newaxis, :], 1.0)
+        factors[:, :, list(excluded)] = 1.0
+        return np.prod(factors, axis=2) * np.exp(
+            nuisances.dot(self.log_kappas.T))
+
+    def _expected(self, x):
+        _, _, statistics = self._split(x)
+        scale = self._products(x, [])
+        expected = np.einsum("nt,ntb->nb", scale,
+                             self.yields) + self.errors * statistics
+        return scale, np.maximum(expected, 1e-12)
+
+    def _derivatives(self, x):
+        """Batched first and second derivatives of the template scales."""
+        scale, _ = self._expected(x)
+        num_linear = self.num_linear
+        linear = np.stack([
+            self.linear[np.newaxis, :, k] * self._products(x, [k])
+            for k in range(num_linear)
+        ],
+                          axis=2)
+        first = np.concatenate(
+            [linear, scale[:, :, np.newaxis] * self.log_kappas], axis=2)
+        second = np.zeros(first.shape + (first.shape[2], ))
+        for k in range(num_linear):
+            for l in range(k + 1, num_linear):
+                second[:, :, k, l] = second[:, :, l, k] = (
+                    self.linear[:, k] * self.linear[:, l] *
+                    self._products(x, [k, l]))
+        second[:, :, :num_linear, num_linear:] = (
+            linear[:, :, :, np.newaxis] *
+            self.log_kappas[np.newaxis, :, np.newaxis, :])
+        second[:, :, num_linear:, :num_linear] = np.transpose(
+            second[:, :, :num_linear, num_linear:], (0, 1, 3, 2))
+        second[:, :, num_linear:, num_linear:] = (
+            scale[:, :, np.newaxis, np.newaxis] *
+            (self.log_kappas[:, :, np.newaxis] *
+             self.log_kappas[:, np.newaxis, :])[np.newaxis])
+        return first, second
+
+    def nll(self, x):
+        """Negative log likelihood of every category."""
+        _, expected = self._expected(x)
+        _, nuisances, statistics = self._split(x)
+        poisson = np.sum(
+            expected - self.data -
+            xlogy(self.data, expected / np.maximum(self.data, 1e-12)),
+            axis=1)
+        return poisson + 0.5 * (np.sum(nuisances**2, axis=1) +
+                                np.sum(statistics**2, axis=1))
+
+    def gradient(self, x):
+        _, expected = self._expected(x)
+        _, nuisances, statistics = self._split(x)
+        first, _ = self._derivatives(x)
+        weights = 1.0 - self.data / expected
+        jacobian = np.einsum("ntb,ntk->nbk", self.yields, first)
+        shape = np.einsum("nb,nbk->nk", weights, jacobian)
+        shape[:, self.num_linear:] += nuisances
+        return np.hstack([shape, weights * self.errors + statistics])
+
+    def hessian(self, x):
+        """Hessians of all categories as an array of blocks."""
+        _, expected = self._expected(x)
+        first, second = self._derivatives(x)
+        weights = 1.0 - self.data / expected
+        curvature = self.data / expected**2
+        jacobian = np.einsum("ntb,ntk->nbk", self.yields, first)
+
+        num = len(self.categories)
+        num_shape = first.shape[2]
+        hessian = np.zeros((num, num_shape + self.bins,
+                            num_shape + self.bins))
+        shape = np.einsum("nbk,nb,nbl->nkl", jacobian, curvature, jacobian)
+        shape += np.einsum("nt,ntkl->nkl",
+                           np.einsum("ntb,nb->nt", self.yields, weights),
+                           second)
+        nuisances = np.arange(self.num_linear, num_shape)
+        shape[:, nuisances, nuisances] += 1.0
+        hessian[:, :num_shape, :num_shape] = shape
+        mixed = np.transpose(jacobian, (0, 2, 1)) * (
+            curvature * self.errors)[:, np.newaxis, :]
+        hessian[:, :num_shape, num_shape:] = mixed
+        hessian[:, num_shape:, :num_shape] = np.transpose(mixed, (0, 2, 1))
+        diagonal = np.arange(num_shape, num_shape + self.bins)
+        hessian[:, diagonal, diagonal] = curvature * self.errors**2 + 1.0
+        return hessian
+
+
+def _solve_batch(hessians, gradients, free):
+    """Newton steps of all categories from their Hessian blocks.
+
+    Fixed parameters are decoupled, and directions of negative or
+    vanishing curvature are damped.
+    """
+    mask = free[:, :, np.newaxis] & free[:, np.newaxis, :]
+    identity = np.eye(hessians.shape[1])[np.newaxis]
+    hessians = np.where(mask, hessians, identity)
+    values, vectors = np.linalg.eigh(hessians)
+    values = np.maximum(
+        np.abs(values), 1e-9 * np.max(np.abs(values), axis=1,
+                                      keepdims=True))
+    projected = np.einsum("nkl,nk->nl", vectors,
+                          np.where(free, gradients, 0.0))
+    return -np.einsum("nkl,nl->nk", vectors, projected / values)
+
+
+def fit_batch(model, tolerance=1e-8, max_iterations=100):
+    """Fit all categories of a BatchedModel with batched Newton steps.
+
+    Returns a FitResult per category.
+    """
+    low, high = model.low, model.high
+    x = np.clip(model.initial, low, high)
+    value = model.nll(x)
+    active = np.ones(len(x), dtype=bool)
+    converged = np.zeros(len(x), dtype=bool)
+    for _ in range(max_iterations):
+        g = model.gradient(x)
+        free = ~(((x <= low) & (g > 0)) | ((x >= high) & (g < 0)))
+        small = np.max(np.where(free, np.abs(g), 0.0), axis=1) < tolerance
+        converged |= active & small
+        active &= ~small
+        if not active.any():
+            break
+        step = _solve_batch(model.hessian(x), g, free)
+        step[~active] = 0.0
+        length = np.ones(len(x))
+        searching = active.copy()
+        candidate, candidate_value = x, value
+        while searching.any():
+            trial = np.clip(x + length[:, np.newaxis] * step, low, high)
+            trial_value = model.nll(trial)
+            accepted = searching & (trial_value <= value + 1e-4 * length *
+                                    np.sum(g * step, axis=1))
+            candidate = np.where(accepted[:, np.newaxis], trial, candidate)
+            candidate_value = np.where(accepted, trial_value,
+                                       candidate_value)
+            searching &= ~accepted
+            length = np.where(searching, 0.5 * length, length)
+            failed = searching & (length < 1e-10)
+            if failed.any():
+                logger.warning("Line search failed for %d categories.",
+                               failed.sum())
+                searching &= ~failed
+                active &= ~failed
+        finished = active & (value - candidate_value <
+                             1e-12 * np.maximum(1.0, np.abs(value)))
+        converged |= finished
+        active &= ~finished
+        x, value = candidate, candidate_value
+    if active.any():
+        logger.warning("Fit of %d categories did not converge in %d iterations.",
+                       active.sum(), max_iterations)
+
+    hessians = model.hessian(x)
+    results = []
+    for n in range(len(x)):
+        bounds = list(zip(low[n], high[n]))
+        free = ~at_bounds(x[n], bounds)
+        results.append(
+            FitResult(model.names[n], x[n], covariance(hessians[n], free),
+                      free, value[n], bool(converged[n])))
+    return results
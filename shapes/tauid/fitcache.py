@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""Cache of the outputs of combine fits.
+
+The outputs of a fit, e.g. higgsCombine*.root, fitDiagnostics*.root or the
+impacts JSON, are determined by the workspace, the options of the fit and
+the version of combine. They are stored under a hash of the inputs of the
+workspace, the options and the CMSSW release. A fit with the same hash
+restores the stored outputs instead of running again. Options which do not
+change the result, like the number of parallel jobs or the verbosity, are
+not part of the hash.
+
+The workspace itself changes with every text2workspace run, since ROOT
+writes a new UUID and timestamps into every file. The hash therefore uses
+the text of the datacard the workspace is built from, combined.txt.cmb for
+combined.txt.cmb.root, and the shape files it references. How the workspace
+is built from them, e.g. the physics model and the POIs given to
+text2workspace, is taken from the scripts building the workspaces, whose
+content is part of the hash as well. The cache is kept below a maximum size
+by removing the least recently used fits.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Options of combineTool.py not changing the fit result, with their number
+# of values
+IGNORED_OPTIONS = {
+    "--parallel": 1,
+    "-v": 1,
+    "--verbose": 1,
+    "--there": 0,
+}
+
+# Options sending the fits to a batch system, whose outputs are not there
+# when combineTool.py returns
+BATCH_OPTIONS = ("--job-mode", "--dry-run")
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as input_file:
+        for block in iter(lambda: input_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def datacard_shape_files(datacard):
+    """Shape files referenced by the shapes lines of a datacard."""
+    directory = os.path.dirname(datacard)
+    paths = []
+    with open(datacard) as datacard_file:
+        for line in datacard_file:
+            parts = line.split()
+            if len(parts) >= 4 and parts[0] == "shapes":
+                path = os.path.join(directory, parts[3])
+                if path not in paths:
+                    paths.append(path)
+    return paths
+
+
+def workspace_digest(workspace):
+    """Hash of the datacard and shape files the workspace is built from.
+
+    Falls back to the content of the workspace if its datacard is not next
+    to it.
+    """
+    datacard = workspace[:-len(".root")] if workspace.endswith(
+        ".root") else None
+    if datacard is None or not os.path.exists(datacard):
+        logger.warning(
+            "Datacard of %s not found, the fit cache uses the workspace itself.",
+            workspace)
+        return file_digest(workspace)
+    content = [file_digest(datacard)]
+    for path in datacard_shape_files(datacard):
+        if not os.path.exists(path):
+            logger.warning("Shape file %s of %s does not exist.", path,
+                           datacard)
+            content.append([os.path.basename(path), None])
+            continue
+        content.append([os.path.basename(path), file_digest(path)])
+    return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+def split_command(command):
+    """Split a combineTool.py command into workspaces and other arguments.
+
+    The workspaces are the values of -d or --datacard, all other arguments
+    are kept in their order.
+    """
+    workspaces = []
+    arguments = []
+    position = 0
+    while position < len(command):
+        argument = command[position]
+        position += 1
+        if argument in ("-d", "--datacard"):
+            while position < len(command) and not command[position].startswith(
+                    "-"):
+                workspaces.append(command[position])
+                position += 1
+        else:
+            arguments.append(argument)
+    return workspaces, arguments
+
+
+def fit_options(arguments):
+    """Arguments changing the result of the fit."""
+    options = []
+    position = 0
+    while position < len(arguments):
+        argument = arguments[position]
+        if argument in IGNORED_OPTIONS:
+            position += 1 + IGNORED_OPTIONS[argument]
+        else:
+            options.append(argument)
+            position += 1
+    return options
+
+
+def recipe_digests(recipes):
+    """Names and hashes of the scripts building the workspaces."""
+    digests = []
+    for path in recipes:
+        if not os.path.exists(path):
+            logger.warning("Workspace script %s does not exist.", path)
+            digests.append([os.path.basename(path), None])
+            continue
+        digests.append([os.path.basename(path), file_digest(path)])
+    return digests
+
+
+def fit_key(workspace, options, outputs, recipes=()):
+    """Hash of the workspace inputs, the fit options and the outputs.
+
+    recipes are the scripts building the workspace from its datacard.
+    """
+    content = [
+        workspace_digest(workspace), options,
+        sorted(outputs),
+        os.environ.get("CMSSW_VERSION"),
+        recipe_digests(recipes)
+    ]
+    return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()
+
+
+class FitCache(object):
+    def __init__(self, directory, max_size=None):
+        """Cache in the given directory with an optional size cap in bytes."""
+        self._directory = directory
+        self._max_size = max_size
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _entry(self, key):
+        return os.path.join(self._directory, key[:2], key)
+
+    def restore(self, key, directory):
+        """Copy the stored outputs to the directory.
+
+        Returns False if there are no outputs stored for the key.
+        """
+        entry = self._entry(key)
+        manifest = os.path.join(entry, "manifest.json")
+        if not os.path.exists(manifest):
+            return False
+        with open(manifest) as manifest_file:
+            files = json.load(manifest_file)["files"]
+        for name in files:
+            shutil.copy2(os.path.join(entry, name), os.path.join(
+                directory, name))
+        os.utime(manifest, None)
+        return True
+
+    def store(self, key, directory, outputs, description):
+        """Store the outputs matching the patterns in the directory.
+
+        Returns False if any of the patterns does not match a file.
+        """
+        files = []
+        for pattern in outputs:
+            matches = glob.glob(os.path.join(directory, pattern))
+            if not matches:
+                logger.warning("Fit output %s does not exist in %s.",
+                               pattern, directory)
+                return False
+            files += [os.path.basename(path) for path in sorted(matches)]
+        entry = self._entry(key)
+        if not os.path.exists(os.path.dirname(entry)):
+            os.makedirs(os.path.dirname(entry))
+        temporary = tempfile.mkdtemp(
+            prefix="unfinished_", dir=os.path.dirname(entry))
+        for name in files:
+            shutil.copy2(os.path.join(directory, name),
+                         os.path.join(temporary, name))
+        with open(os.path.join(temporary, "manifest.json"),
+                  "w") as manifest_file:
+            json.dump({"files": files, "description": description},
+                      manifest_file, indent=2)
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.rename(temporary, entry)
+        self.prune()
+        return True
+
+    def entries(self):
+        """List of (path, size, last use) of all stored fits."""
+        entries = []
+        for manifest in glob.glob(
+                os.path.join(self._directory, "*", "*", "manifest.json")):
+            entry = os.path.dirname(manifest)
+            if os.path.basename(entry).startswith("unfinished_"):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(entry, name))
+                for name in os.listdir(entry))
+            entries.append((entry, size, os.path.getmtime(manifest)))
+        return entries
+
+    def prune(self, max_size=None):
+        """Remove the least recently used fits above the maximum size.
+
+        Returns the number of removed fits.
+        """
+        if max_size is None:
+            max_size = self._max_size
+        if max_size is None:
+            return 0
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        removed = 0
+        for path, entry_size, _ in entries:
+            if size <= max_size:
+                break
+            shutil.rmtree(path)
+            size -= entry_size
+            removed += 1
+        if removed:
+            logger.info("Removed %d least recently used fits from %s.",
+                        removed, self._directory)
+        return removed
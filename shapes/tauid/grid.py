@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""Fine master grids of the variables and rebinning on demand.
+
+The binnings of binning.yaml are coarser versions of a few fine grids, e.g.
+category_binnning and category_binnning_enlarged are both subsets of a grid
+of 1 GeV in m_vis. Together with the shape cache, histograms of a variable
+with a fine grid are filled and stored once on the grid, and every binning
+lining up with the grid is produced by merging bins of the stored master
+histogram without reading the ntuples again.
+"""
+
+import numpy as np
+
+from .specs import HistogramSpec
+
+
+def rebin(sumw, fine_edges, edges):
+    """Merge the bins of fine_edges into the coarser edges.
+
+    The edges have to be a subset of the fine edges. Both layouts include
+    the underflow and the overflow bin, so fine bins outside of the coarse
+    range are merged into these. sumw can hold one histogram per row.
+    """
+    fine_edges = np.asarray(fine_edges)
+    indices = np.concatenate(([0],
+                              np.searchsorted(
+                                  edges, fine_edges[:-1], side="right"),
+                              [len(edges)]))
+    matrix = np.zeros((len(fine_edges) + 1, len(edges) + 1))
+    matrix[np.arange(len(fine_edges) + 1), indices] = 1.0
+    return np.dot(sumw, matrix)
+
+
+def grid_edges(grid):
+    """Bin edges of a grid given as list of edges or as nbins, low, high."""
+    if isinstance(grid, dict):
+        return list(np.linspace(grid["low"], grid["high"], grid["nbins"] + 1))
+    return [float(edge) for edge in grid]
+
+
+def align(edges, grid):
+    """Edges snapped onto the grid or None if they do not line up with it."""
+    grid = np.asarray(grid)
+    positions = np.searchsorted(grid, edges)
+    aligned = []
+    for edge, position in zip(edges, positions):
+        candidates = [
+            grid[index] for index in (position - 1, position)
+            if 0 <= index < len(grid)
+        ]
+        matches = [
+            candidate for candidate in candidates
+            if abs(candidate - edge) <= 1e-9 * max(1.0, abs(edge))
+        ]
+        if not matches:
+            return None
+        aligned.append(float(matches[0]))
+    return aligned
+
+
+def master_spec(spec, grids):
+    """Spec filling the fine grid of the variable of the spec.
+
+    grids is a dictionary of expression to grid edges. Returns None for
+    counts, for variables without grid and for binnings not lining up with
+    the grid.
+    """
+    if spec.is_count or spec.is_partition or spec.expression not in grids:
+        return None
+    if align(spec.edges, grids[spec.expression]) is None:
+        return None
+    return HistogramSpec(
+        name=spec.name,
+        files=spec.files,
+        folder=spec.folder,
+        friend_files=spec.friend_files,
+        cuts=spec.cuts,
+        weights=spec.weights,
+        expression=spec.expression,
+        edges=grids[spec.expression])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Compact histograms made of NumPy arrays.
+
+The filled inputs are kept as ArrayHistogram instead of TH1 objects, so the
+shapes of the composite estimations, e.g. the same-sign to opposite-sign
+QCD extrapolation and the sums of AddHistogramEstimationMethod, are formed
+by vectorised array operations without creating any ROOT object. A TH1 is
+only created when a shape is written to the output file.
+"""
+
+import numpy as np
+
+from .roothist import to_th1
+
+
+class ArrayHistogram(object):
+    """Bin contents and squared errors including under- and overflow.
+
+    Histograms are immutable, all operations return new histograms.
+    """
+
+    def __init__(self, edges, sumw, sumw2):
+        self._edges = tuple(edges)
+        self._sumw = np.array(sumw, dtype=np.float64)
+        self._sumw2 = np.array(sumw2, dtype=np.float64)
+        self._sumw.flags.writeable = False
+        self._sumw2.flags.writeable = False
+
+    @property
+    def edges(self):
+        return self._edges
+
+    @property
+    def sumw(self):
+        return self._sumw
+
+    @property
+    def sumw2(self):
+        return self._sumw2
+
+    def _check(self, other):
+        if self._edges != other.edges:
+            raise ValueError("Histograms with different bin edges.")
+
+    def __add__(self, other):
+        self._check(other)
+        return ArrayHistogram(self._edges, self._sumw + other.sumw,
+                              self._sumw2 + other.sumw2)
+
+    def __sub__(self, other):
+        self._check(other)
+        return ArrayHistogram(self._edges, self._sumw - other.sumw,
+                              self._sumw2 + other.sumw2)
+
+    def scale(self, factor):
+        return ArrayHistogram(self._edges, self._sumw * factor,
+                              self._sumw2 * factor * factor)
+
+    def clip(self):
+        """Set negative bin contents to zero, keeping their errors.
+
+        Under- and overflow are kept as they are, like in the QCD estimation
+        of shape_producer.
+        """
+        sumw = self._sumw.copy()
+        sumw[1:-1] = np.maximum(sumw[1:-1], 0.0)
+        return ArrayHistogram(self._edges, sumw, self._sumw2)
+
+    def integral(self):
+        """Sum of the weights without under- and overflow."""
+        return float(np.sum(self._sumw[1:-1]))
+
+    def to_th1(self, name):
+        return to_th1(name, self._edges, self._sumw, self._sumw2)
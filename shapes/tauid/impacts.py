@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""Approximate nuisance impacts from the post-fit covariance matrix.
+
+The impact of a nuisance on a POI is the shift of the POI if the nuisance
+is fixed to its post-fit value plus or minus its post-fit error and all
+other parameters are fitted again. combineTool.py -M Impacts computes it
+with one fit per nuisance. If the likelihood is close to a Gaussian around
+the minimum, the shift is given by the covariance matrix of the fit:
+moving the nuisance by d moves the POI by cov(POI, nuisance) / var(nuisance)
+* d. The impacts of all nuisances are therefore known from the Hesse
+matrix of a single fit, e.g. fit_s of fitDiagnostics*.root. They are
+written in the JSON format of combineTool.py, so plotImpacts.py can be used
+as usual, and the nuisances with large approximate impacts can be selected
+for full fits.
+"""
+
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class FitResult(object):
+    def __init__(self, names, values, errors_low, errors_high, covariance,
+                 prefit):
+        """Post-fit parameters with their covariance matrix.
+
+        The errors are the positive errors down and up of every parameter
+        and prefit maps the names of the constrained nuisances to their
+        prefit value and error.
+        """
+        self.names = list(names)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.errors_low = np.asarray(errors_low, dtype=np.float64)
+        self.errors_high = np.asarray(errors_high, dtype=np.float64)
+        self.covariance = np.asarray(covariance, dtype=np.float64)
+        self.prefit = dict(prefit)
+
+    def index(self, name):
+        if name not in self.names:
+            logger.critical("Parameter %s is not part of the fit result.",
+                            name)
+            raise Exception
+        return self.names.index(name)
+
+
+def read_fit_result(path, name="fit_s"):
+    """Fit result and prefit nuisances of a fitDiagnostics file."""
+    import ROOT
+    input_file = ROOT.TFile(path, "READ")
+    if input_file.IsZombie():
+        logger.critical("File %s can not be opened.", path)
+        raise Exception
+    result = input_file.Get(name)
+    if not result:
+        logger.critical("Fit result %s is missing in %s.", name, path)
+        raise Exception
+    if result.covQual() != 3:
+        logger.warning(
+            "Covariance matrix of %s in %s is not accurate (quality %d).",
+            name, path, result.covQual())
+    parameters = result.floatParsFinal()
+    matrix = result.covarianceMatrix()
+    names = []
+    values = []
+    errors_low = []
+    errors_high = []
+    for i in range(parameters.getSize()):
+        parameter = parameters.at(i)
+        names.append(parameter.GetName())
+        values.append(parameter.getVal())
+        if parameter.hasAsymError():
+            errors_low.append(abs(parameter.getErrorLo()))
+            errors_high.append(abs(parameter.getErrorHi()))
+        else:
+            errors_low.append(parameter.getError())
+            errors_high.append(parameter.getError())
+    covariance = np.array([[matrix(i, j) for j in range(len(names))]
+                           for i in range(len(names))])
+    prefit = {}
+    nuisances = input_file.Get("nuisances_prefit")
+    if nuisances:
+        iterator = nuisances.createIterator()
+        parameter = iterator.Next()
+        while parameter:
+            prefit[parameter.GetName()] = (parameter.getVal(),
+                                           parameter.getError())
+            parameter = iterator.Next()
+    else:
+        logger.warning("Prefit nuisances are missing in %s.", path)
+    input_file.Close()
+    return FitResult(names, values, errors_low, errors_high, covariance,
+                     prefit)
+
+
+def rate_parameters(datacard):
+    """Names of the rate parameters declared in a datacard."""
+    names = set()
+    with open(datacard) as datacard_file:
+        for line in datacard_file:
+            parts = line.split()
+            if len(parts) > 1 and parts[1] == "rateParam":
+                names.add(parts[0])
+    return names
+
+
+def find_pois(result, rates):
+    """Floating parameters of the fit without constraint and not a rate.
+
+    The constrained nuisances are the ones with a prefit value, the rate
+    parameters are the unconstrained parameters which are not POIs.
+    """
+    return [
+        name for name in result.names
+        if name not in result.prefit and name not in rates
+    ]
+
+
+def approximate_impacts(result, pois):
+    """Impacts of all parameters except the POIs on the POIs.
+
+    Returns a dict in the format of combineTool.py -M Impacts.
+    """
+    indices = [result.index(poi) for poi in pois]
+    values = result.values
+    low = values - result.errors_low
+    high = values + result.errors_high
+    variances = np.diag(result.covariance)
+
+    impacts = {
+        "POIs": [{
+            "name": poi,
+            "fit": [low[i], values[i], high[i]]
+        } for poi, i in zip(pois, indices)],
+        "params": [],
+        "method": "default"
+    }
+    for j, name in enumerate(result.names):
+        if name in pois:
+            continue
+        if name in result.prefit:
+            value, error = result.prefit[name]
+            prefit = [value - error, value, value + error]
+            kind = "Gaussian"
+        else:
+            # Rate parameters and other parameters without constraint
+            prefit = [values[j]] * 3
+            kind = "Unconstrained"
+        entry = {
+            "name": name,
+            "fit": [low[j], values[j], high[j]],
+            "prefit": prefit,
+            "groups": [],
+            "type": kind
+        }
+        for poi, i in zip(pois, indices):
+            slope = result.covariance[i, j] / variances[j] if variances[
+                j] > 0 else 0.0
+            shifted = [
+                values[i] - slope * result.errors_low[j], values[i],
+                values[i] + slope * result.errors_high[j]
+            ]
+            entry[poi] = shifted
+            entry["impact_" + poi] = max(
+                abs(shifted[2] - shifted[1]), abs(shifted[1] - shifted[0]))
+        impacts["params"].append(entry)
+    return impacts
+
+
+def large_impacts(impacts, threshold):
+    """Names of the parameters with an impact on any POI above threshold.
+
+    The threshold is relative to the error of the POI.
+    """
+    errors = dict(
+        (poi["name"], 0.5 * (poi["fit"][2] - poi["fit"][0]))
+        for poi in impacts["POIs"])
+    names = []
+    for entry in impacts["params"]:
+        if any(entry["impact_" + poi] > threshold * errors[poi]
+               for poi in errors):
+            names.append(entry["name"])
+    return names
+
+
+def merge_impacts(approximate, full):
+    """Replace the approximate impacts by the ones of full fits.
+
+    The POIs are taken from the full fits, whose initial fit is the same
+    for all parameters.
+    """
+    merged = dict(approximate)
+    fitted = dict((entry["name"], entry) for entry in full["params"])
+    merged["POIs"] = full["POIs"]
+    merged["params"] = [
+        fitted.get(entry["name"], entry) for entry in approximate["params"]
+    ]
+    return merged
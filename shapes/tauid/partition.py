@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Fill sets of disjoint categories as a single two-dimensional histogram.
+
+The pt categories of binning.yaml are disjoint ranges of pt_2 and the decay
+mode categories are disjoint values of decayMode_2. Histograms of the same
+process and variation which only differ in such a category cut are filled
+as one histogram of (category index x variable), from which the histograms
+of the single categories are sliced afterwards. Additional disjoint splits
+therefore only add a comparison per event and no filter or fill.
+
+Two category cuts are known to be disjoint if both are conjunctions of
+comparisons and the intervals they allow for one of the branches do not
+overlap. Categories with different binnings are filled with the union of
+their bin edges and rebinned afterwards.
+"""
+
+import numpy as np
+
+from .expression import Binary, Branch, Constant, Unary, compile_expression
+from .grid import rebin
+from .specs import HistogramSpec
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Names of the cuts defining the categories
+CATEGORY_CUTS = ("category", )
+
+# Separator of the names of the categories in the name of a partition
+PARTITION_SEPARATOR = "|"
+
+_MIRRORED = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "==": "=="}
+
+
+def _constant(node):
+    if isinstance(node, Constant):
+        return node.value
+    if isinstance(node, Unary) and node.operator in ("-", "+"):
+        value = _constant(node.operand)
+        if value is not None:
+            return -value if node.operator == "-" else value
+    return None
+
+
+def _conjunction(node):
+    if isinstance(node, Binary) and node.operator == "&&":
+        return _conjunction(node.left) + _conjunction(node.right)
+    return [node]
+
+
+def _comparison(node):
+    """(branch, operator, value) of a comparison of a branch with a number."""
+    if not isinstance(node, Binary) or node.operator not in _MIRRORED:
+        return None
+    if isinstance(node.left, Branch) and _constant(node.right) is not None:
+        return node.left.name, node.operator, _constant(node.right)
+    if isinstance(node.right, Branch) and _constant(node.left) is not None:
+        return node.right.name, _MIRRORED[node.operator], _constant(
+            node.left)
+    return None
+
+
+def intervals(cut):
+    """Intervals of the branches allowed by a cut.
+
+    Returns a dictionary of branch to (low, low closed, high, high closed)
+    for all branches compared with numbers in the top-level conjunction of
+    the cut. Other terms only restrict the selection further and are
+    ignored.
+    """
+    allowed = {}
+    for term in _conjunction(compile_expression(cut)._node):
+        comparison = _comparison(term)
+        if comparison is None:
+            continue
+        branch, operator, value = comparison
+        low, low_closed, high, high_closed = allowed.get(
+            branch, (-np.inf, False, np.inf, False))
+        closed = operator in (">=", "<=", "==")
+        if operator in (">", ">=", "==") and (value > low or
+                                              (value == low and not closed)):
+            low, low_closed = value, closed
+        if operator in ("<", "<=", "==") and (value < high or
+                                              (value == high and not closed)):
+            high, high_closed = value, closed
+        allowed[branch] = (low, low_closed, high, high_closed)
+    return allowed
+
+
+def _separated(first, second):
+    low, low_closed = first[0], first[1]
+    high, high_closed = second[2], second[3]
+    return high < low or (high == low and not (high_closed and low_closed))
+
+
+def disjoint(first, second):
+    """Whether no event can pass both cuts."""
+    first, second = intervals(first), intervals(second)
+    for branch in set(first) & set(second):
+        if _separated(first[branch], second[branch]) or _separated(
+                second[branch], first[branch]):
+            return True
+    return False
+
+
+def _category_cut(spec):
+    cuts = [cut for name, cut in spec.cuts if name in CATEGORY_CUTS]
+    return cuts[0] if len(cuts) == 1 else None
+
+
+def _partition_key(spec):
+    return (spec.input_key,
+            frozenset(cut for name, cut in spec.cuts
+                      if name not in CATEGORY_CUTS),
+            tuple(sorted(weight for _, weight in spec.weights)),
+            spec.expression)
+
+
+def find_partitions(specs):
+    """Sets of specs differing only in disjoint category cuts.
+
+    Returns a list of lists of indices, each with at least two specs. The
+    specs of every set are assigned greedily in their order.
+    """
+    candidates = {}
+    order = []
+    for index, spec in enumerate(specs):
+        if spec.is_count or spec.is_partition or _category_cut(
+                spec) is None:
+            continue
+        key = _partition_key(spec)
+        if key not in candidates:
+            candidates[key] = []
+            order.append(key)
+        candidates[key].append(index)
+
+    partitions = []
+    for key in order:
+        sets = []
+        for index in candidates[key]:
+            cut = _category_cut(specs[index])
+            for members in sets:
+                if all(
+                        disjoint(cut, _category_cut(specs[member]))
+                        for member in members):
+                    members.append(index)
+                    break
+            else:
+                sets.append([index])
+        partitions += [members for members in sets if len(members) > 1]
+    return partitions
+
+
+def partition_spec(specs):
+    """Spec filling the disjoint categories of the given specs at once."""
+    first = specs[0]
+    category_expression = "-1"
+    for index in reversed(range(len(specs))):
+        category_expression = "({}) ? {} : ({})".format(
+            _category_cut(specs[index]), index, category_expression)
+    edges = sorted(set(edge for spec in specs for edge in spec.edges))
+    return HistogramSpec(
+        name=PARTITION_SEPARATOR.join(spec.name for spec in specs),
+        files=first.files,
+        folder=first.folder,
+        friend_files=first.friend_files,
+        cuts=[(name, cut) for name, cut in first.cuts
+              if name not in CATEGORY_CUTS],
+        weights=first.weights,
+        expression=first.expression,
+        edges=edges,
+        category_expression=category_expression,
+        num_categories=len(specs))
+
+
+class PartitioningBackend(object):
+    """Backend filling disjoint categories as two-dimensional histograms."""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def run(self, specs):
+        partitions = find_partitions(specs)
+        partitioned = set(index for members in partitions
+                          for index in members)
+        plain = [
+            index for index in range(len(specs)) if index not in partitioned
+        ]
+        merged = [partition_spec([specs[index] for index in members])
+                  for members in partitions]
+        logger.info("Fill %d categories as %d two-dimensional histograms.",
+                    len(partitioned), len(merged))
+        filled = self._backend.run([specs[index]
+                                    for index in plain] + merged)
+
+        results = [None] * len(specs)
+        for index, result in zip(plain, filled):
+            results[index] = result
+        for members, spec, (sumw, sumw2) in zip(partitions, merged,
+                                                filled[len(plain):]):
+            for category, index in enumerate(members):
+                edges = specs[index].edges
+                results[index] = (rebin(sumw[category], spec.edges, edges),
+                                  rebin(sumw2[category], spec.edges, edges))
+        return results
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Dependency graph of the stages of the measurement.
+
+Every stage is a shell command with its input files, output files and the
+stages it depends on. The hash of a stage is computed from its command, the
+content of its input files and the hashes of its dependencies. It therefore
+changes whenever anything upstream of the stage changes, and it is known
+before any stage runs. A stage is skipped if it succeeded before with the
+same hash and its outputs still exist. All other stages start as soon as
+their dependencies are done, on a bounded pool of workers. Stages sharing a
+lock, e.g. because they write the same file to the working directory, never
+run at the same time.
+"""
+
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Stage(object):
+    def __init__(self,
+                 key,
+                 command,
+                 inputs=(),
+                 outputs=(),
+                 dependencies=(),
+                 locks=()):
+        """Stage running a shell command.
+
+        The key is a tuple like (step, era, working point, ...), inputs and
+        outputs are glob patterns of files or directories and the
+        dependencies are the keys of other stages.
+        """
+        self.key = tuple(str(part) for part in key)
+        self.command = command
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.dependencies = tuple(
+            tuple(str(part) for part in dependency)
+            for dependency in dependencies)
+        self.locks = frozenset(locks)
+
+    @property
+    def name(self):
+        return "/".join(self.key)
+
+    def missing_outputs(self):
+        return [pattern for pattern in self.outputs if not glob.glob(pattern)]
+
+    def __repr__(self):
+        return "Stage({})".format(self.name)
+
+
+def _files(pattern):
+    """Files matching the pattern, with directories expanded."""
+    files = []
+    for path in sorted(glob.glob(pattern)):
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                files += [os.path.join(root, name) for name in sorted(names)]
+        else:
+            files.append(path)
+    return files
+
+
+class Pipeline(object):
+    def __init__(self, stages, state_directory):
+        """Pipeline of the stages with its state in the given directory."""
+        self._stages = {}
+        for stage in stages:
+            if stage.key in self._stages:
+                logger.critical("Stage %s is defined twice.", stage.name)
+                raise Exception
+            self._stages[stage.key] = stage
+        for stage in stages:
+            for dependency in stage.dependencies:
+                if dependency not in self._stages:
+                    logger.critical("Stage %s depends on unknown stage %s.",
+                                    stage.name, "/".join(dependency))
+                    raise Exception
+        self._order = self._sort([stage.key for stage in stages])
+        self._state_path = os.path.join(state_directory, "state.json")
+        self._log_directory = os.path.join(state_directory, "logs")
+        if not os.path.exists(self._log_directory):
+            os.makedirs(self._log_directory)
+        self._state = {"stages": {}, "files": {}}
+        if os.path.exists(self._state_path):
+            with open(self._state_path) as state_file:
+                self._state = json.load(state_file)
+        self._lock = threading.Lock()
+
+    def _sort(self, keys):
+        """Keys in an order with every stage after its dependencies."""
+        order = []
+        visiting = set()
+        visited = set()
+
+        def visit(key):
+            if key in visited:
+                return
+            if key in visiting:
+                logger.critical("Stage %s depends on itself.", "/".join(key))
+                raise Exception
+            visiting.add(key)
+            for dependency in self._stages[key].dependencies:
+                visit(dependency)
+            visiting.remove(key)
+            visited.add(key)
+            order.append(key)
+
+        for key in keys:
+            visit(key)
+        return order
+
+    @property
+    def stages(self):
+        return [self._stages[key] for key in self._order]
+
+    def _file_digest(self, path):
+        """Hash of the file content, cached by size and modification time."""
+        status = os.stat(path)
+        cached = self._state["files"].get(path)
+        if cached is not None and cached[:2] == [status.st_size,
+                                                 status.st_mtime]:
+            return cached[2]
+        digest = hashlib.sha1()
+        with open(path, "rb") as input_file:
+            for block in iter(lambda: input_file.read(1 << 20), b""):
+                digest.update(block)
+        self._state["files"][path] = [
+            status.st_size, status.st_mtime,
+            digest.hexdigest()
+        ]
+        return digest.hexdigest()
+
+    def hashes(self):
+        """Hash of every stage by its key."""
+        hashes = {}
+        for key in self._order:
+            stage = self._stages[key]
+            inputs = []
+            for pattern in stage.inputs:
+                files = _files(pattern)
+                if not files:
+                    logger.warning("Input %s of stage %s does not exist.",
+                                   pattern, stage.name)
+                inputs += [(path, self._file_digest(path)) for path in files]
+            content = [
+                stage.command, inputs,
+                [hashes[dependency] for dependency in stage.dependencies],
+                self._state["stages"].get(stage.name, {}).get("salt", 0)
+            ]
+            hashes[key] = hashlib.sha1(
+                json.dumps(content).encode("utf-8")).hexdigest()
+        return hashes
+
+    def force(self, patterns):
+        """Rerun the stages with names matching any of the patterns.
+
+        The stages and everything depending on them get new hashes, which
+        are kept for the following runs.
+        """
+        for stage in self.stages:
+            if any(fnmatch.fnmatch(stage.name, pattern)
+                   for pattern in patterns):
+                entry = self._state["stages"].setdefault(stage.name, {})
+                entry["salt"] = entry.get("salt", 0) + 1
+                entry.pop("hash", None)
+                logger.info("Force stage %s to run.", stage.name)
+
+    def outdated(self, hashes):
+        """Keys of the stages which have to run."""
+        outdated = []
+        for key in self._order:
+            stage = self._stages[key]
+            recorded = self._state["stages"].get(stage.name, {}).get("hash")
+            if recorded != hashes[key] or stage.missing_outputs():
+                outdated.append(key)
+        return outdated
+
+    def _save(self):
+        temporary = self._state_path + ".unfinished"
+        with open(temporary, "w") as state_file:
+            json.dump(self._state, state_file, indent=1, sort_keys=True)
+        os.rename(temporary, self._state_path)
+
+    def _execute(self, stage):
+        try:
+            log_path = os.path.join(self._log_directory,
+                                    stage.name.replace("/", "_") + ".log")
+            start = time.time()
+            logger.info("Run stage %s, see %s.", stage.name, log_path)
+            with open(log_path, "w") as log_file:
+                code = subprocess.call(["bash", "-c", stage.command],
+                                       stdout=log_file,
+                                       stderr=subprocess.STDOUT)
+            if code == 0 and stage.missing_outputs():
+                logger.error("Stage %s did not write %s.", stage.name,
+                             ", ".join(stage.missing_outputs()))
+                code = 1
+            if code != 0:
+                logger.error("Stage %s failed, see %s.", stage.name,
+                             log_path)
+            else:
+                logger.info("Finished stage %s in %.0f s.", stage.name,
+                            time.time() - start)
+            return stage.key, code
+        except Exception as error:
+            logger.error("Stage %s failed: %s", stage.name, error)
+            return stage.key, 1
+
+    def run(self, num_workers=1, dry_run=False):
+        """Run all outdated stages with at most num_workers at once."""
+        if num_workers < 1:
+            logger.critical("Number of workers must be at least 1, got %d.",
+                            num_workers)
+            raise Exception
+        hashes = self.hashes()
+        outdated = self.outdated(hashes)
+        logger.info("%d of %d stages are outdated.", len(outdated),
+                    len(self._order))
+        if dry_run:
+            for key in outdated:
+                logger.info("    %s", "/".join(key))
+            return
+
+        done = set(self._order) - set(outdated)
+        pending = list(outdated)
+        running = set()
+        held = set()
+        failed = set()
+        condition = threading.Condition()
+
+        def finish(result):
+            key, code = result
+            stage = self._stages[key]
+            with condition:
+                running.discard(key)
+                held.difference_update(stage.locks)
+                if code == 0:
+                    done.add(key)
+                    with self._lock:
+                        entry = self._state["stages"].setdefault(
+                            stage.name, {})
+                        entry["hash"] = hashes[key]
+                        self._save()
+                else:
+                    failed.add(key)
+                condition.notify()
+
+        pool = ThreadPool(num_workers)
+        with condition:
+            while pending or running:
+                for key in list(pending):
+                    stage = self._stages[key]
+                    if any(dependency in failed
+                           for dependency in stage.dependencies):
+                        logger.error("Skip stage %s after a failed dependency.",
+                                     stage.name)
+                        pending.remove(key)
+                        failed.add(key)
+                        continue
+                    if len(running) >= num_workers or held & stage.locks:
+                        continue
+                    if all(dependency in done
+                           for dependency in stage.dependencies):
+                        pending.remove(key)
+                        running.add(key)
+                        held.update(stage.locks)
+                        pool.apply_async(
+                            self._execute, (stage, ), callback=finish)
+                if running:
+                    condition.wait(1.0)
+        pool.close()
+        pool.join()
+        if failed:
+            logger.critical("%d stages failed: %s", len(failed), ", ".join(
+                self._stages[key].name for key in self._order
+                if key in failed))
+            raise Exception
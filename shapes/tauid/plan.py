@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Production plan and cost estimate without reading any events.
+
+The plan lists the number of histograms and event loops of a production and
+the number of events to be read, taken from the tree headers of the input
+files. With the profile of a previous production, see tauid.profile, the
+wall time of every event loop is predicted from its number of events and
+filled objects, and the wall time of the production from the order in which
+the scheduler runs the event loops on the pool of processes.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .partition import find_partitions
+from .scheduler import count_events
+from .specs import group_by_input
+from .streaming import estimate_memory
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def loop_model(profile_path):
+    """Seconds per event and per event and object of previous event loops.
+
+    Returns None if there is no usable profile.
+    """
+    if profile_path is None or not os.path.exists(profile_path):
+        return None
+    with open(profile_path) as profile_file:
+        loops = json.load(profile_file)["event_loops"]
+    loops = [loop for loop in loops if loop.get("events_read")]
+    if not loops:
+        return None
+    features = np.array([[
+        loop["events_read"], loop["events_read"] * len(loop["objects"])
+    ] for loop in loops], dtype=np.float64)
+    walls = np.array([loop["wall"] for loop in loops])
+    coefficients = np.linalg.lstsq(features, walls, rcond=None)[0]
+    peak_rss = max(loop["worker_peak_rss"] for loop in loops)
+    return np.maximum(coefficients, 0.0), peak_rss
+
+
+def makespan(durations, num_workers):
+    """Wall time of running the jobs largest first on the workers."""
+    loads = [0.0] * max(1, num_workers)
+    for duration in sorted(durations, reverse=True):
+        loads[loads.index(min(loads))] += duration
+    return max(loads)
+
+
+def log_plan(graph, num_processes=1, num_threads=1, profile_path=None):
+    specs = graph.specs
+    groups = group_by_input(specs)
+    partitions = find_partitions(specs)
+    events = [count_events(key[0], key[1]) for key, _ in groups]
+    logger.info("Plan: %d systematics with %d root objects.",
+                len(graph.systematics), graph.num_root_objects)
+    logger.info("Plan: %d unique histograms and counts, %d of them in %d "
+                "partitions of disjoint categories.", len(specs),
+                sum(len(members) for members in partitions), len(partitions))
+    logger.info("Plan: %d event loops over %d files reading %d events.",
+                len(groups),
+                len(set(path for key, _ in groups for path in key[1])),
+                sum(events))
+    memory = max(
+        sum(estimate_memory(specs[index], num_threads) for index in indices)
+        for _, indices in groups) if groups else 0
+    logger.info("Plan: the largest event loop books about %.2f GB.",
+                memory / 1e9)
+
+    model = loop_model(profile_path)
+    if model is None:
+        logger.info("Plan: no profile of a previous production to predict "
+                    "the wall time, run with --profile first.")
+        return
+    (per_event, per_object), peak_rss = model
+    durations = [
+        num_events * (per_event + per_object * len(indices))
+        for num_events, (_, indices) in zip(events, groups)
+    ]
+    logger.info("Plan: predicted %.1f h of event loops, %.1f h wall time "
+                "on %d processes.", sum(durations) / 3600.0,
+                makespan(durations, num_processes) / 3600.0, num_processes)
+    logger.info("Plan: peak memory of %.2f GB per process in the profile.",
+                peak_rss / 1e9)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Profile of the event loops and the systematics of a production.
+
+Every event loop records its wall and CPU time, the events read, the bytes
+read from disk, the memory high-water mark of its worker process so far and
+the selected events in the range of every filled object, per category for
+partitions. As an event loop fills the inputs of many systematics,
+its wall time, CPU time and bytes read are shared equally among the objects
+it fills, and the share of every object among the systematics using it.
+The events read by a systematic are the events of all event loops filling
+its inputs. The objects are identified by the names of their specs, which
+the estimation graph keeps unique also across working points.
+"""
+
+import json
+import time
+
+from .partition import PARTITION_SEPARATOR
+
+import logging
+logger = logging.getLogger(__name__)
+
+_active = None
+
+
+def start():
+    """Start recording the jobs of the scheduler into a new profile."""
+    global _active
+    _active = Profile()
+    return _active
+
+
+def active():
+    """Profile currently recording or None."""
+    return _active
+
+
+def _variation(systematic):
+    variation = getattr(systematic, "variation", None)
+    return getattr(variation, "name", "Nominal")
+
+
+class Profile(object):
+    def __init__(self):
+        self._jobs = []
+        self._start = time.time()
+
+    def record_job(self, task, cost, statistics):
+        """Record the statistics of a job filling a task (input_key, specs)."""
+        (tree_path, files, _), specs = task
+        job = dict(statistics)
+        job.update({
+            "tree": tree_path,
+            "num_files": len(files),
+            "estimated_events": cost,
+            "objects": [spec.name for spec in specs],
+        })
+        self._jobs.append(job)
+
+    def _shares(self):
+        """Statistics of every filled object by the name of the object."""
+        shares = {}
+        for job in self._jobs:
+            selected = job.get("events_selected") or [None] * len(
+                job["objects"])
+            fraction = 1.0 / max(1, len(job["objects"]))
+            for name, entries in zip(job["objects"], selected):
+                members = name.split(PARTITION_SEPARATOR)
+                if not isinstance(entries, list):
+                    entries = [entries] * len(members)
+                for member, member_entries in zip(members, entries):
+                    share = shares.setdefault(member, {
+                        "wall": 0.0,
+                        "cpu": 0.0,
+                        "bytes_read": 0.0,
+                        "events_read": 0,
+                        "events_selected": 0,
+                        "worker_peak_rss": 0.0,
+                    })
+                    for key in ("wall", "cpu", "bytes_read"):
+                        share[key] += job[key] * fraction / len(members)
+                    share["events_read"] += job.get("events_read", 0)
+                    if member_entries is not None:
+                        share["events_selected"] += member_entries
+                    share["worker_peak_rss"] = max(share["worker_peak_rss"],
+                                                   job["worker_peak_rss"])
+        return shares
+
+    def systematics(self, graph):
+        """Statistics attributed to every systematic of the graph."""
+        shares = self._shares()
+        entries = []
+        for index, systematic in enumerate(graph.systematics):
+            entry = {
+                "name": systematic.name,
+                "process": systematic.process.name,
+                "variation": _variation(systematic),
+                "wall": 0.0,
+                "cpu": 0.0,
+                "bytes_read": 0.0,
+                "events_read": 0,
+                "events_selected": 0,
+                "worker_peak_rss": 0.0,
+            }
+            for node in graph.nodes(index):
+                share = shares.get(graph.specs[node].name)
+                if share is None:
+                    continue
+                fraction = 1.0 / len(graph.consumers(node))
+                for key in ("wall", "cpu", "bytes_read"):
+                    entry[key] += share[key] * fraction
+                entry["events_read"] += share["events_read"]
+                entry["events_selected"] += share["events_selected"]
+                entry["worker_peak_rss"] = max(entry["worker_peak_rss"],
+                                               share["worker_peak_rss"])
+            entries.append(entry)
+        return entries
+
+    def write(self, path, graph, top=10):
+        """Write the profile to a JSON file and log the slowest parts."""
+        systematics = self.systematics(graph)
+        with open(path, "w") as profile_file:
+            json.dump({
+                "wall": time.time() - self._start,
+                "event_loops": self._jobs,
+                "systematics": systematics
+            }, profile_file, indent=2)
+        logger.info("Wrote profile to %s.", path)
+        for key in ("process", "variation"):
+            totals = {}
+            for entry in systematics:
+                totals[entry[key]] = totals.get(entry[key],
+                                                0.0) + entry["wall"]
+            slowest = sorted(totals.items(), key=lambda item: -item[1])[:top]
+            logger.info("Slowest %d of %d by %s:", len(slowest), len(totals),
+                        key)
+            for name, wall in slowest:
+                logger.info("    %-40s %10.1f s", name, wall)
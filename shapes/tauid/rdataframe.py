@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""Lazy RDataFrame backend.
+
+All histograms filled from the same tree are booked as lazy actions on one
+computation graph, so every input sample is read in a single event loop
+instead of once per (category, process, variation). The selections are
+chained as a tree of filters, see shared_cut_order, so the channel and
+process cuts are evaluated once per event for all categories.
+"""
+
+import ROOT
+from array import array
+
+from . import profile
+from .roothist import from_th1, from_th2
+from .scheduler import count_events, report, schedule
+from .specs import group_by_input, shared_cut_order
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RDataFrameGraph(object):
+    """Computation graph of all histograms booked on one input tree."""
+
+    def __init__(self, tree_path, files, friend_files):
+        self._chain = ROOT.TChain(tree_path)
+        for path in files:
+            self._chain.Add(path)
+        # Keep the friend chains alive as long as the main chain
+        self._friends = []
+        for friend in friend_files:
+            friend_chain = ROOT.TChain(tree_path)
+            for path in friend:
+                friend_chain.Add(path)
+            self._chain.AddFriend(friend_chain)
+            self._friends.append(friend_chain)
+        self._dataframe = ROOT.RDataFrame(self._chain)
+        self._columns = {}
+        self._nodes = {}
+        self._specs = []
+        self._results = []
+        self._entries = []
+
+    def define(self, expression):
+        """Define a double-valued column computing the expression.
+
+        All columns have to be defined before the first filter is booked so
+        that they are visible from every node of the graph.
+        """
+        if expression not in self._columns:
+            name = "tauid_column_{}".format(len(self._columns))
+            self._dataframe = self._dataframe.Define(
+                name, "static_cast<double>({})".format(expression))
+            self._columns[expression] = name
+        return self._columns[expression]
+
+    def node(self, cuts):
+        """Filter node applying the given ordered tuple of cuts.
+
+        Nodes are cached by their prefix of cuts, so specs sharing the
+        leading cuts share the corresponding filters.
+        """
+        if not cuts:
+            return self._dataframe
+        if cuts not in self._nodes:
+            self._nodes[cuts] = self.node(cuts[:-1]).Filter(cuts[-1])
+        return self._nodes[cuts]
+
+    def define_weight(self, weights):
+        """Define the product of the weight factors.
+
+        Every factor is its own column, which RDataFrame evaluates at most
+        once per event. Weight variations like ReplaceWeight therefore only
+        add the evaluation of their new factor to the event loop of the
+        nominal shape.
+        """
+        factors = [self.define(weight) for _, weight in weights]
+        return self.define("*".join(factors) if factors else "1")
+
+    def book(self, specs, count_entries=False):
+        """Book the histograms and counts of the specs as lazy actions.
+
+        With count_entries, the events in the range of every histogram, per
+        category for partitions, are counted by an unweighted histogram in
+        the same event loop, see entries.
+        """
+        weights = []
+        for spec in specs:
+            weights.append(self.define_weight(spec.weights))
+            if spec.is_count:
+                self.define("{0}*{0}".format(weights[-1]))
+            else:
+                self.define(spec.expression)
+            if spec.is_partition:
+                self.define(spec.category_expression)
+        for spec, cuts, weight in zip(specs, shared_cut_order(specs),
+                                      weights):
+            if spec.is_count:
+                squared = self._columns["{0}*{0}".format(weight)]
+                result = (self.node(cuts).Sum(weight),
+                          self.node(cuts).Sum(squared))
+            elif spec.is_partition:
+                model = ROOT.RDF.TH2DModel(spec.name, spec.name,
+                                           len(spec.edges) - 1,
+                                           array("d", spec.edges),
+                                           spec.num_categories, 0.0,
+                                           float(spec.num_categories))
+                result = self.node(cuts).Histo2D(
+                    model, self._columns[spec.expression],
+                    self._columns[spec.category_expression], weight)
+            else:
+                model = ROOT.RDF.TH1DModel(spec.name, spec.name,
+                                           len(spec.edges) - 1,
+                                           array("d", spec.edges))
+                result = self.node(cuts).Histo1D(
+                    model, self._columns[spec.expression], weight)
+            self._specs.append(spec)
+            self._results.append(result)
+            self._entries.append(
+                self._book_entries(spec, cuts) if count_entries else None)
+        return self._results
+
+    def _book_entries(self, spec, cuts):
+        if spec.is_count:
+            return None
+        name = "{}_entries".format(spec.name)
+        low, high = float(spec.edges[0]), float(spec.edges[-1])
+        if spec.is_partition:
+            model = ROOT.RDF.TH2DModel(name, name, 1, low, high,
+                                       spec.num_categories, 0.0,
+                                       float(spec.num_categories))
+            return self.node(cuts).Histo2D(
+                model, self._columns[spec.expression],
+                self._columns[spec.category_expression])
+        model = ROOT.RDF.TH1DModel(name, name, 1, low, high)
+        return self.node(cuts).Histo1D(model, self._columns[spec.expression])
+
+    def entries(self):
+        """Counted events of every spec, None if they are not counted."""
+        entries = []
+        for spec, counted in zip(self._specs, self._entries):
+            if counted is None:
+                entries.append(None)
+            elif spec.is_partition:
+                histogram = counted.GetValue()
+                entries.append([
+                    int(histogram.GetBinContent(1, category + 1))
+                    for category in range(spec.num_categories)
+                ])
+            else:
+                entries.append(int(counted.GetValue().GetBinContent(1)))
+        return entries
+
+    def run(self):
+        """Trigger the single event loop of this graph."""
+        if self._results:
+            first = self._results[0]
+            if isinstance(first, tuple):
+                first = first[0]
+            first.GetValue()
+
+    @property
+    def num_filters(self):
+        return len(self._nodes)
+
+    @property
+    def num_events(self):
+        return self._chain.GetEntries()
+
+
+def enable_threads(num_threads):
+    """Run the event loops of this process with the given threads."""
+    if num_threads > 1 and not ROOT.IsImplicitMTEnabled():
+        ROOT.EnableImplicitMT(num_threads)
+
+
+def process_group(task):
+    """Run the event loop of one input tree and fill all its specs."""
+    (tree_path, files, friend_files), specs = task
+    graph = RDataFrameGraph(tree_path, files, friend_files)
+    booked = graph.book(specs, count_entries=profile.active() is not None)
+    logger.debug("Fan out %d objects from %d filter nodes.", len(specs),
+                 graph.num_filters)
+    graph.run()
+    results = []
+    for spec, result in zip(specs, booked):
+        if spec.is_count:
+            results.append((float(result[0].GetValue()),
+                            float(result[1].GetValue())))
+        else:
+            histogram = result.GetValue()
+            if spec.is_partition:
+                results.append(from_th2(histogram))
+            else:
+                results.append(from_th1(histogram))
+    report("events_read", int(graph.num_events))
+    report("events_selected", graph.entries())
+    return results
+
+
+class RDataFrameBackend(object):
+    """Fill all specs with one RDataFrame event loop per input tree.
+
+    With several processes, the event loops of different input trees run
+    in parallel, the largest trees first. Every process runs its event loop
+    with the given number of threads.
+    """
+
+    def __init__(self, num_threads=1, num_processes=1):
+        self._num_threads = num_threads
+        self._num_processes = num_processes
+
+    def run(self, specs):
+        """Fill the specs and return the results in the same order.
+
+        Every result is a tuple of sumw and sumw2, which are arrays
+        including under- and overflow for histograms and floats for counts.
+        """
+        groups = group_by_input(specs)
+        tasks = [(key, [specs[index] for index in indices])
+                 for key, indices in groups]
+        logger.info("Run %d event loops with %d processes and %d threads.",
+                    len(tasks), self._num_processes, self._num_threads)
+        costs = [count_events(key[0], key[1]) for key, _ in tasks]
+        # The threads are started in the worker processes, as a process
+        # with a running thread pool must not be forked.
+        group_results = schedule(
+            process_group,
+            tasks,
+            costs,
+            self._num_processes,
+            initializer=enable_threads,
+            initargs=(self._num_threads, ))
+
+        results = [None] * len(specs)
+        for (_, indices), filled in zip(groups, group_results):
+            for index, result in zip(indices, filled):
+                results[index] = result
+        return results
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Conversion between NumPy arrays and ROOT histograms."""
+
+import ROOT
+from array import array
+from math import sqrt
+
+import numpy as np
+
+
+def to_th1(name, edges, sumw, sumw2):
+    """Detached TH1D from bin contents and squared errors.
+
+    sumw and sumw2 include the underflow and overflow bins.
+    """
+    histogram = ROOT.TH1D(name, name, len(edges) - 1, array("d", edges))
+    histogram.SetDirectory(0)
+    histogram.Sumw2()
+    for i in range(len(edges) + 1):
+        histogram.SetBinContent(i, float(sumw[i]))
+        histogram.SetBinError(i, sqrt(float(sumw2[i])))
+    return histogram
+
+
+def from_th1(histogram):
+    """Bin contents and squared errors of a TH1 including under- and overflow."""
+    num_bins = histogram.GetNbinsX() + 2
+    sumw = np.array([histogram.GetBinContent(i) for i in range(num_bins)])
+    sumw2 = np.array([histogram.GetBinError(i)**2 for i in range(num_bins)])
+    return sumw, sumw2
+
+
+def from_th2(histogram):
+    """Rows of bin contents and squared errors along x for every y bin.
+
+    Under- and overflow are included along x, not along y.
+    """
+    num_bins = histogram.GetNbinsX() + 2
+    rows = range(1, histogram.GetNbinsY() + 1)
+    sumw = np.array([[histogram.GetBinContent(i, j) for i in range(num_bins)]
+                     for j in rows])
+    sumw2 = np.array([[histogram.GetBinError(i, j)**2
+                       for i in range(num_bins)] for j in rows])
+    return sumw, sumw2
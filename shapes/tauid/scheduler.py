@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Cost-aware scheduling of the event loops on a pool of processes.
+
+Every input tree is one job, whose cost is estimated by its number of
+events. The jobs are started from the largest to the smallest one (longest
+processing time first), so the large DY and embedding samples do not end up
+in the tail of the production while all other workers are idle. The jobs
+run in separate processes, which are not serialised by the GIL. With an
+active checkpoint, jobs whose objects are all recorded are skipped and
+every finished job is recorded as soon as it returns, see
+tauid.checkpoint.
+"""
+
+import multiprocessing
+import os
+import resource
+import time
+
+from . import checkpoint, profile
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def count_events(tree_path, files):
+    """Number of events of the tree in the files.
+
+    Files which can not be opened are estimated by their size in bytes, so
+    that they are still ordered sensibly.
+    """
+    import ROOT
+    num_events = 0
+    for path in files:
+        input_file = ROOT.TFile.Open(path)
+        tree = input_file.Get(tree_path) if input_file else None
+        if tree:
+            num_events += tree.GetEntries()
+        elif os.path.exists(path):
+            num_events += os.path.getsize(path)
+        if input_file:
+            input_file.Close()
+    return num_events
+
+
+# Statistics reported by the running job, see report
+_statistics = {}
+
+
+def report(name, value):
+    """Report a statistic of the running job, e.g. the selected events."""
+    _statistics[name] = value
+
+
+def _usage():
+    """CPU time, bytes read and memory high-water mark of this process."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    read_bytes = 0
+    if os.path.exists("/proc/self/io"):
+        with open("/proc/self/io") as io:
+            for line in io:
+                if line.startswith("read_bytes:"):
+                    read_bytes = int(line.split()[1])
+    return usage.ru_utime + usage.ru_stime, read_bytes, usage.ru_maxrss
+
+
+def _timed(arguments):
+    function, position, task = arguments
+    _statistics.clear()
+    cpu, read_bytes, _ = _usage()
+    start = time.time()
+    result = function(task)
+    statistics = dict(_statistics)
+    statistics["wall"] = time.time() - start
+    end_cpu, end_read_bytes, peak_rss = _usage()
+    statistics["cpu"] = end_cpu - cpu
+    statistics["bytes_read"] = end_read_bytes - read_bytes
+    # ru_maxrss is the high-water mark of the worker over all its jobs so
+    # far, not of this job alone. It is given in kB on Linux.
+    statistics["worker_peak_rss"] = peak_rss * 1e3
+    return position, result, statistics
+
+
+def schedule(function,
+             tasks,
+             costs,
+             num_workers=1,
+             initializer=None,
+             initargs=()):
+    """Apply the function to all tasks, largest cost first.
+
+    The tasks are tuples of (input_key, specs). Returns the results in the
+    order of the tasks. With an active profile, the statistics of every job
+    are recorded in it. The initializer is called with initargs in every
+    worker process, or in this process if there is only one worker. With
+    several workers, this process never runs a job itself, so state set up
+    by the initializer, like the thread pool of ROOT, is never forked.
+    """
+    results = [None] * len(tasks)
+    recorded = checkpoint.active()
+    if recorded is not None:
+        for position, (_, specs) in enumerate(tasks):
+            filled = [recorded.get(spec) for spec in specs]
+            if all(result is not None for result in filled):
+                results[position] = filled
+        num_recorded = sum(result is not None for result in results)
+        if num_recorded > 0:
+            logger.info("Take %d of %d event loops from the checkpoint.",
+                        num_recorded, len(tasks))
+    order = sorted(
+        [position for position in range(len(tasks))
+         if results[position] is None],
+        key=lambda i: costs[i],
+        reverse=True)
+    jobs = [(function, position, tasks[position]) for position in order]
+    start = time.time()
+    done = []
+    if num_workers > 1 and jobs:
+        pool = multiprocessing.Pool(
+            min(num_workers, len(jobs)), initializer, initargs)
+        finished = pool.imap_unordered(_timed, jobs, chunksize=1)
+    else:
+        pool = None
+        if initializer is not None and jobs:
+            initializer(*initargs)
+        finished = (_timed(job) for job in jobs)
+    for position, result, statistics in finished:
+        if recorded is not None:
+            recorded.record(tasks[position][1], result)
+        done.append((position, result, statistics))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    busy = 0.0
+    for position, result, statistics in done:
+        results[position] = result
+        busy += statistics["wall"]
+        if profile.active() is not None:
+            profile.active().record_job(tasks[position], costs[position],
+                                        statistics)
+    if elapsed > 0 and jobs:
+        logger.info(
+            "Ran %d jobs in %.1f s on %d workers with a parallel efficiency of %.0f%%.",
+            len(jobs), elapsed, num_workers,
+            100.0 * busy / (elapsed * max(1, min(num_workers, len(jobs)))))
+    return results
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Sharded production with a deterministic merge.
+
+The work of a production is split into units of one input tree, i.e. one
+process in one pipeline or variation, and a chunk of its files. A shard
+fills the units assigned to it and writes the filled arrays of all its
+specs to a shard file. The merge sums the chunks of every spec over all
+shard files, checking that every chunk of every spec is present exactly
+once, and hands the sums to the estimations, which write the final shapes.
+
+The assignment of the units to the shards only depends on the specs and
+the chunk size, so all shards and the merge agree on it without
+communication.
+"""
+
+import glob
+import os
+
+import numpy as np
+
+from .specs import HistogramSpec, group_by_input
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(value):
+    """Tuple of (index, number of shards) from a string k/N with 0 <= k < N."""
+    index, num_shards = [int(part) for part in value.split("/")]
+    if not 0 <= index < num_shards:
+        raise ValueError("Shard {} is not in 0..{}.".format(
+            index, num_shards - 1))
+    return index, num_shards
+
+
+def shard_units(specs, chunk_size):
+    """Units of work as list of (indices of the specs, first, last file)."""
+    units = []
+    for (_, files, _), indices in group_by_input(specs):
+        for first in range(0, max(len(files), 1), chunk_size):
+            units.append((indices, first, min(first + chunk_size,
+                                              len(files))))
+    return units
+
+
+def assign_units(units, num_shards):
+    """Shard of every unit, balancing the number of files per shard.
+
+    Units are assigned from the largest to the smallest one to the shard
+    with the least files so far. Ties are broken by the order of the units,
+    which makes the assignment deterministic.
+    """
+    loads = [0] * num_shards
+    shards = [None] * len(units)
+    order = sorted(
+        range(len(units)),
+        key=lambda i: (units[i][1] - units[i][2], i))
+    for i in order:
+        shard = loads.index(min(loads))
+        shards[i] = shard
+        loads[shard] += max(units[i][2] - units[i][1], 1)
+    return shards
+
+
+def chunk_spec(spec, first, last):
+    """Spec reading only the files first to last of the spec."""
+    return HistogramSpec(
+        name=spec.name,
+        files=spec.files[first:last],
+        folder=spec.folder,
+        friend_files=[friend[first:last] for friend in spec.friend_files],
+        cuts=spec.cuts,
+        weights=spec.weights,
+        expression=spec.expression,
+        edges=spec.edges,
+        category_expression=spec.category_expression,
+        num_categories=spec.num_categories)
+
+
+def _entry(spec, first):
+    return "{}_{}".format(spec.digest, first)
+
+
+def shard_path(directory, index, num_shards):
+    return os.path.join(directory, "shard_{}_of_{}.npz".format(
+        index, num_shards))
+
+
+def produce_shard(specs, fill, shard, directory, chunk_size):
+    """Fill the units of one shard and write them to the shard directory.
+
+    fill is a function filling a list of specs, e.g. the run method of a
+    backend.
+    """
+    index, num_shards = shard
+    units = shard_units(specs, chunk_size)
+    mine = [
+        unit for unit, owner in zip(units, assign_units(units, num_shards))
+        if owner == index
+    ]
+    chunks = []
+    entries = []
+    for indices, first, last in mine:
+        for i in indices:
+            chunks.append(chunk_spec(specs[i], first, last))
+            entries.append(_entry(specs[i], first))
+    logger.info("Shard %d/%d fills %d of %d units with %d objects.", index,
+                num_shards, len(mine), len(units), len(chunks))
+    results = fill(chunks)
+
+    arrays = {}
+    for i, (sumw, sumw2) in enumerate(results):
+        arrays["sumw_{}".format(i)] = np.asarray(sumw)
+        arrays["sumw2_{}".format(i)] = np.asarray(sumw2)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = shard_path(directory, index, num_shards)
+    temporary = "{}.{}.tmp.npz".format(path[:-4], os.getpid())
+    np.savez_compressed(
+        temporary,
+        entries=np.array(entries),
+        chunk_size=chunk_size,
+        num_shards=num_shards,
+        **arrays)
+    os.rename(temporary, path)
+    logger.info("Wrote shard %s.", path)
+
+
+class ShardMerger(object):
+    """Backend taking the filled specs from the shard files."""
+
+    def __init__(self, specs, directory):
+        paths = sorted(glob.glob(os.path.join(directory, "shard_*_of_*.npz")))
+        if not paths:
+            logger.critical("No shard files found in %s.", directory)
+            raise Exception
+        self._chunks = {}
+        occurrences = {}
+        chunk_sizes = set()
+        for path in paths:
+            with np.load(path) as shard:
+                chunk_sizes.add(int(shard["chunk_size"]))
+                for i, entry in enumerate(shard["entries"]):
+                    entry = str(entry)
+                    occurrences[entry] = occurrences.get(entry, 0) + 1
+                    self._chunks[entry] = (shard["sumw_{}".format(i)],
+                                           shard["sumw2_{}".format(i)])
+        if len(chunk_sizes) != 1:
+            logger.critical("Shards in %s use different chunk sizes %s.",
+                            directory, sorted(chunk_sizes))
+            raise Exception
+
+        self._firsts = {}
+        expected = set()
+        for indices, first, _ in shard_units(specs, chunk_sizes.pop()):
+            for i in indices:
+                self._firsts.setdefault(specs[i].digest, []).append(first)
+                expected.add(_entry(specs[i], first))
+        missing = expected - set(occurrences)
+        duplicate = [e for e, count in occurrences.items() if count > 1]
+        unexpected = set(occurrences) - expected
+        if missing or duplicate or unexpected:
+            logger.critical(
+                "Shards in %s do not match the production: %d chunks missing, %d duplicate and %d unexpected.",
+                directory, len(missing), len(duplicate), len(unexpected))
+            raise Exception
+        logger.info("Merge %d chunks from %d shards.", len(expected),
+                    len(paths))
+
+    def run(self, specs):
+        results = []
+        for spec in specs:
+            chunks = [
+                self._chunks[_entry(spec, first)]
+                for first in self._firsts[spec.digest]
+            ]
+            sumw = np.sum([chunk[0] for chunk in chunks], axis=0)
+            sumw2 = np.sum([chunk[1] for chunk in chunks], axis=0)
+            if spec.is_count:
+                results.append((float(sumw), float(sumw2)))
+            else:
+                results.append((sumw, sumw2))
+        return results
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Pre-skimmed compact ntuples.
+
+The Artus outputs carry hundreds of branches, of which the measurement only
+reads a few dozen, and most events fail the channel selection. A skim holds
+the events of one input tree (one sample in one pipeline) passing the cuts
+shared by all histograms filled from it, except for the working point
+dependent ones, with only the branches read by these histograms. Skims are
+created on first use and reused by all later productions whose selection is
+tighter and whose branches are contained in the skim, e.g. for other working
+points or binnings.
+
+The numpy backend reads exactly the branches its expression parser finds.
+The tdf backend passes the expressions to ROOT, which understands more than
+this parser, so its skims keep all branches of the trees named in the
+expressions. An input whose branches can not be determined is not skimmed.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from .columnar import referenced_branches
+from .expression import ExpressionError
+from .specs import HistogramSpec, group_by_input
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Names of cuts never applied in the skims, so that one skim serves all
+# working points.
+WORKING_POINT_CUTS = ("tau_iso", )
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def common_cuts(specs):
+    """Cut expressions applied by all specs, without working point cuts."""
+    common = None
+    for spec in specs:
+        cuts = set(cut for name, cut in spec.cuts
+                   if name not in WORKING_POINT_CUTS)
+        common = cuts if common is None else common & cuts
+    return common or set()
+
+
+def _expressions(specs):
+    expressions = []
+    for spec in specs:
+        expressions += [cut for _, cut in spec.cuts]
+        expressions += [weight for _, weight in spec.weights]
+        if not spec.is_count:
+            expressions.append(spec.expression)
+        if spec.is_partition:
+            expressions.append(spec.category_expression)
+    return expressions
+
+
+def _chain(input_key):
+    """TChain of the input tree and the friend chains it references."""
+    import ROOT
+    tree_path, files, friend_files = input_key
+    chain = ROOT.TChain(tree_path)
+    for input_file in files:
+        chain.Add(input_file)
+    friends = []
+    for friend in friend_files:
+        friend_chain = ROOT.TChain(tree_path)
+        for input_file in friend:
+            friend_chain.Add(input_file)
+        chain.AddFriend(friend_chain)
+        friends.append(friend_chain)
+    return chain, friends
+
+
+def root_branches(input_key, specs):
+    """Branches of the input tree named in the expressions of the specs."""
+    chain, friends = _chain(input_key)
+    names = set()
+    for tree in [chain] + friends:
+        if tree.LoadTree(0) < 0:
+            continue
+        names |= set(branch.GetName() for branch in tree.GetListOfBranches())
+    identifiers = set()
+    for expression in _expressions(specs):
+        identifiers |= set(_IDENTIFIER.findall(expression))
+    return names & identifiers
+
+
+def _file_stamps(files):
+    stamps = []
+    for path in files:
+        if os.path.exists(path):
+            status = os.stat(path)
+            stamps.append([path, status.st_mtime, status.st_size])
+        else:
+            stamps.append([path])
+    return stamps
+
+
+class SkimStore(object):
+    """Directory of skims, one ROOT file and manifest per input tree."""
+
+    def __init__(self, directory, backend="numpy"):
+        self._directory = directory
+        self._backend = backend
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _path(self, input_key):
+        name = hashlib.sha1(
+            json.dumps(list(input_key)).encode("utf-8")).hexdigest()
+        return os.path.join(self._directory, name + ".root")
+
+    def _manifest(self, path):
+        manifest_path = path[:-len(".root")] + ".json"
+        if not os.path.exists(path) or not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as manifest_file:
+            return json.load(manifest_file)
+
+    def branches(self, input_key, specs):
+        """Branches read by the backend or None if they are not known."""
+        if self._backend != "numpy":
+            branches = root_branches(input_key, specs)
+            return branches or None
+        try:
+            return referenced_branches(specs)
+        except ExpressionError as error:
+            logger.warning("Branches of %s are not known: %s", input_key[0],
+                           error)
+            return None
+
+    def skim(self, input_key, specs):
+        """Path to a skim usable for the specs, created if necessary.
+
+        Returns None if the input can not be skimmed.
+        """
+        tree_path, files, friend_files = input_key
+        path = self._path(input_key)
+        cuts = common_cuts(specs)
+        branches = self.branches(input_key, specs)
+        if branches is None:
+            logger.warning("Read %s of %d files without skim.", tree_path,
+                           len(files))
+            return None
+        sources = _file_stamps(files) + [
+            stamp for friend in friend_files
+            for stamp in _file_stamps(friend)
+        ]
+        manifest = self._manifest(path)
+        if manifest is not None and manifest["sources"] == sources:
+            if set(manifest["cuts"]) <= cuts and branches <= set(
+                    manifest["branches"]):
+                return path
+            # Widen the existing skim instead of alternating between two
+            # incompatible ones.
+            cuts &= set(manifest["cuts"])
+            branches |= set(manifest["branches"])
+        self._write(path, input_key, sorted(cuts), sorted(branches))
+        with open(path[:-len(".root")] + ".json", "w") as manifest_file:
+            json.dump({
+                "tree": tree_path,
+                "sources": sources,
+                "cuts": sorted(cuts),
+                "branches": sorted(branches)
+            }, manifest_file, indent=2)
+        return path
+
+    def _write(self, path, input_key, cuts, branches):
+        import ROOT
+        tree_path, files, friend_files = input_key
+        logger.info("Skim %s of %d files with %d cuts and %d branches.",
+                    tree_path, len(files), len(cuts), len(branches))
+        chain, friends = _chain(input_key)
+        dataframe = ROOT.RDataFrame(chain)
+        if cuts:
+            dataframe = dataframe.Filter(" && ".join(
+                "({})".format(cut) for cut in cuts))
+        columns = ROOT.std.vector("string")()
+        for branch in branches:
+            columns.push_back(branch)
+        temporary = "{}.{}.tmp.root".format(path[:-len(".root")], os.getpid())
+        dataframe.Snapshot(tree_path, temporary, columns)
+        os.rename(temporary, path)
+
+
+class SkimmingBackend(object):
+    """Backend reading all input trees from their skims.
+
+    name is the name of the wrapped backend, which decides how the
+    branches of the skims are found.
+    """
+
+    def __init__(self, backend, directory, name="numpy"):
+        self._backend = backend
+        self._store = SkimStore(directory, name)
+
+    def run(self, specs):
+        skimmed = list(specs)
+        for input_key, indices in group_by_input(specs):
+            path = self._store.skim(input_key,
+                                    [specs[index] for index in indices])
+            if path is None:
+                continue
+            for index in indices:
+                spec = specs[index]
+                skimmed[index] = HistogramSpec(
+                    name=spec.name,
+                    files=[path],
+                    folder=spec.folder,
+                    friend_files=[],
+                    cuts=spec.cuts,
+                    weights=spec.weights,
+                    expression=spec.expression,
+                    edges=spec.edges,
+                    category_expression=spec.category_expression,
+                    num_categories=spec.num_categories)
+        return self._backend.run(skimmed)
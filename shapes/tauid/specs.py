@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Plain description of the histograms requested by shape_producer.
+
+The root objects created by the estimation methods of shape_producer carry
+their inputs, selection, weights and variable. The backends of this package
+do not work on these objects directly but on a HistogramSpec extracted from
+them, which only holds strings and numbers and is therefore cheap to group,
+compare and send to other processes.
+"""
+
+import hashlib
+import json
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class HistogramSpec(object):
+    """Content of a single histogram (or count) to be filled from a tree.
+
+    Cuts and weights are kept as tuples of (name, expression) pairs. For
+    counts the expression and the edges are None. A spec with a category
+    expression fills several disjoint categories at once: the expression
+    gives the index of the category of an event, or -1 for events in none
+    of them, and the result holds one histogram per category.
+    """
+
+    def __init__(self,
+                 name,
+                 files,
+                 folder,
+                 friend_files,
+                 cuts,
+                 weights,
+                 expression,
+                 edges,
+                 category_expression=None,
+                 num_categories=None):
+        self.name = name
+        self.files = tuple(files)
+        self.folder = folder
+        self.friend_files = tuple(tuple(friend) for friend in friend_files)
+        self.cuts = tuple(cuts)
+        self.weights = tuple(weights)
+        self.expression = expression
+        self.edges = tuple(edges) if edges is not None else None
+        self.category_expression = category_expression
+        self.num_categories = num_categories
+
+    @property
+    def is_count(self):
+        return self.expression is None
+
+    @property
+    def is_partition(self):
+        return self.category_expression is not None
+
+    @property
+    def tree_path(self):
+        return "{}/ntuple".format(self.folder)
+
+    @property
+    def input_key(self):
+        """Key of the tree this histogram is filled from.
+
+        All histograms with the same key can be filled in a single event
+        loop.
+        """
+        return (self.tree_path, self.files, self.friend_files)
+
+    @property
+    def cut_expression(self):
+        if not self.cuts:
+            return "1"
+        return " && ".join("({})".format(cut) for _, cut in self.cuts)
+
+    @property
+    def weight_expression(self):
+        if not self.weights:
+            return "1"
+        return "*".join("({})".format(weight) for _, weight in self.weights)
+
+    @property
+    def fingerprint(self):
+        """Identity of the content, independent of names and ordering.
+
+        Two specs with the same fingerprint read the same tree with the
+        same selection, weights and binning and result in the same
+        histogram, even if they belong to differently named systematics.
+        """
+        return (self.input_key, frozenset(cut for _, cut in self.cuts),
+                tuple(sorted(weight for _, weight in self.weights)),
+                self.expression, self.edges, self.category_expression)
+
+    @property
+    def digest(self):
+        """Stable hash of the fingerprint to identify the spec in files."""
+        (input_key, cuts, weights, expression, edges,
+         category) = self.fingerprint
+        content = [
+            input_key,
+            sorted(cuts),
+            list(weights), expression,
+            list(edges) if edges is not None else None, category
+        ]
+        return hashlib.sha1(
+            json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def __repr__(self):
+        return "HistogramSpec({})".format(self.name)
+
+
+def bin_edges(binning):
+    """Bin edges of a shape_producer binning object."""
+    if hasattr(binning, "_bin_edges"):
+        return [float(edge) for edge in binning._bin_edges]
+    width = (binning._xhigh - binning._xlow) / float(binning._nbinsx)
+    return [binning._xlow + i * width for i in range(binning._nbinsx)] + [
+        float(binning._xhigh)
+    ]
+
+
+def spec_from_root_object(root_object):
+    """Extract the HistogramSpec of a shape_producer Histogram or Count."""
+    variable = getattr(root_object, "_variable", None)
+    if variable is None:
+        expression, edges = None, None
+    else:
+        expression, edges = variable.expression, bin_edges(variable.binning)
+    return HistogramSpec(
+        name=root_object.name,
+        files=root_object._inputs,
+        folder=root_object._folder,
+        friend_files=getattr(root_object, "_friend_inputs", None) or [],
+        cuts=[(cut.name, cut.expand()) for cut in root_object._cuts],
+        weights=[(weight.name, weight.extract())
+                 for weight in root_object._weights],
+        expression=expression,
+        edges=edges)
+
+
+def group_by_input(specs):
+    """Group the indices of the specs by the tree they are filled from.
+
+    Returns a list of (input_key, [indices]) in order of first appearance.
+    """
+    groups = {}
+    order = []
+    for index, spec in enumerate(specs):
+        key = spec.input_key
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(index)
+    return [(key, groups[key]) for key in order]
+
+
+def shared_cut_order(specs):
+    """Order the cuts of every spec by how many specs share them.
+
+    Cuts shared by many specs, like the channel selection, come first and
+    cuts only used by few specs, like the category cuts, come last. Chaining
+    the cuts in this order turns the selections of all specs into a tree in
+    which every common prefix is evaluated only once per event, so all
+    categories of a process fan out from one shared selection.
+
+    Returns a list with the tuple of ordered cut expressions of each spec.
+    """
+    usage = {}
+    first_seen = {}
+    for spec in specs:
+        for _, cut in spec.cuts:
+            first_seen.setdefault(cut, len(first_seen))
+        for cut in set(cut for _, cut in spec.cuts):
+            usage[cut] = usage.get(cut, 0) + 1
+    return [
+        tuple(
+            sorted(
+                set(cut for _, cut in spec.cuts),
+                key=lambda cut: (-usage[cut], first_seen[cut])))
+        for spec in specs
+    ]
+
+
+def selection_key(spec):
+    """Everything that defines a histogram except for its weights."""
+    return (spec.input_key, frozenset(cut for _, cut in spec.cuts),
+            spec.expression, spec.edges)
+
+
+def log_workload(specs):
+    """Log how many event loops and selections the specs need."""
+    selections = {}
+    for spec in specs:
+        key = selection_key(spec)
+        selections[key] = selections.get(key, 0) + 1
+    weight_only = sum(count - 1 for count in selections.values())
+    logger.info(
+        "%d root objects need %d event loops and %d distinct selections. "
+        "%d of them are weight variations filled alongside the histogram "
+        "with the same selection.", len(specs), len(group_by_input(specs)),
+        len(selections), weight_only)
+
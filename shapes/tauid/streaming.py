@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Bounded memory production.
+
+Every booked histogram exists once per thread until its event loop is
+finished, and with several processes every process holds the histograms of
+its own event loop and its own copy of Python and ROOT. With a maximum
+memory, the input trees are filled in batches whose estimated memory fits
+into the limit. The filled inputs are kept as compact arrays, and every
+systematic is estimated, written and released as soon as all of its inputs
+are filled.
+
+The estimate is a lower bound: the branch arrays read by the numpy backend
+and the caches of ROOT are not included. The measured peak memory per
+process is written by --profile, see tauid.profile, and logged by --plan.
+"""
+
+import resource
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Approximate size of a booked histogram apart from its bins in bytes
+HISTOGRAM_OVERHEAD = 2048
+
+# Approximate memory of a process with Python, ROOT and the backends loaded
+# before any histogram is booked in bytes
+PROCESS_BASELINE = 500e6
+
+
+def estimate_memory(spec, num_threads=1):
+    """Approximate memory in bytes needed to fill the spec."""
+    if spec.is_count:
+        return HISTOGRAM_OVERHEAD
+    num_bins = (len(spec.edges) + 1) * (spec.num_categories or 1)
+    # sumw and sumw2 in double precision for every thread
+    return num_threads * (HISTOGRAM_OVERHEAD + 16 * num_bins)
+
+
+def batch_memory(fills, results, num_processes=1):
+    """Approximate memory in bytes of filling a batch of input trees.
+
+    fills are the memories of the event loops of the batch and results the
+    memories of their filled objects, which are kept in this process. With
+    several processes, the largest event loops may run at the same time,
+    each in a worker process of its own.
+    """
+    workers = num_processes if num_processes > 1 else 0
+    running = sorted(fills, reverse=True)[:max(1, num_processes)]
+    return PROCESS_BASELINE * (1 + workers) + sum(running) + sum(results)
+
+
+def memory_batches(specs,
+                   groups,
+                   max_memory=None,
+                   num_threads=1,
+                   num_processes=1):
+    """Split the input groups into batches fitting into the memory limit.
+
+    groups is the list of (input_key, [indices]) of group_by_input. Returns
+    a list of lists of spec indices. An input tree is never split, since
+    every batch reading the tree costs another event loop.
+    """
+    everything = [[index for _, indices in groups for index in indices]]
+    if max_memory is None:
+        return everything
+    baseline = batch_memory([], [], num_processes)
+    if baseline > max_memory:
+        # Smaller batches do not help, they only leave processes idle
+        logger.warning(
+            "%d processes need about %.2f GB without any histogram, more than the maximum memory.",
+            max(1, num_processes), baseline / 1e9)
+        return everything
+    batches = []
+    batch, fills, results = [], [], []
+    for input_key, indices in groups:
+        fill = sum(
+            estimate_memory(specs[index], num_threads) for index in indices)
+        result = sum(estimate_memory(specs[index]) for index in indices)
+        memory = batch_memory([fill], [result], num_processes)
+        if memory > max_memory:
+            logger.warning(
+                "Filling %d objects from %s needs about %.2f GB, more than the maximum memory.",
+                len(indices), input_key[0], memory / 1e9)
+        if batch and batch_memory(fills + [fill], results + [result],
+                                  num_processes) > max_memory:
+            batches.append(batch)
+            batch, fills, results = [], [], []
+        batch += indices
+        fills.append(fill)
+        results.append(result)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def peak_memory():
+    """Peak resident memory of this process and its children in GB."""
+    # ru_maxrss is given in kB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / 1e6, children / 1e6
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""Synthetic Artus-like ntuples and the production configuration on them.
+
+The ntuples carry the branches, folders and pipelines read by the era
+scripts: one file per sample holds the trees mt_<pipeline>/ntuple and
+mm_nominal/ntuple. All pipelines of a sample are generated from the same
+random numbers per event, so a shifted pipeline holds the same events as
+the nominal one with the tau energy scale or the jet energy scale varied.
+
+The configuration builds the specs of the 2017 era script, i.e. the
+processes, categories of binning.yaml, the same sign region of the QCD
+estimation and the weight and pipeline variations, directly as
+HistogramSpecs. It does not need the Kappa database or shape_producer, so
+the backends can be benchmarked offline. The categories are taken from the
+binning configuration, the processes, working points and variations are
+checked against the era script by tests/test_synthetic.py.
+"""
+
+import os
+
+from .specs import HistogramSpec
+
+import logging
+logger = logging.getLogger(__name__)
+
+SAMPLES = ("data", "DY", "EMB", "TT", "VV", "W")
+
+WORKING_POINTS = ("VVVLoose", "VVLoose", "VLoose", "Loose", "Medium",
+                  "Tight", "VTight", "VVTight")
+
+TAU_ES_SHIFTS = ("tauEsOneProng", "tauEsOneProngOnePiZero",
+                 "tauEsThreeProng")
+JET_ES_SHIFTS = ("jecUncEta0to3", "jecUncEta0to5", "jecUncEta3to5",
+                 "jecUncRelativeBal", "jecUncRelativeSample")
+
+# Decay mode of the tau shifted by every tau energy scale pipeline
+_TAU_ES_DECAY_MODES = {
+    "tauEsOneProng": 0,
+    "tauEsOneProngOnePiZero": 1,
+    "tauEsThreeProng": 10,
+}
+
+_RANDOM = """
+namespace tauid_synthetic {
+double uniform(unsigned long long entry, int stream, int seed) {
+    unsigned long long x = entry * 0x9E3779B97F4A7C15ULL
+        + static_cast<unsigned long long>(stream) * 0xBF58476D1CE4E5B9ULL
+        + static_cast<unsigned long long>(seed);
+    x ^= x >> 30;
+    x *= 0xBF58476D1CE4E5B9ULL;
+    x ^= x >> 27;
+    x *= 0x94D049BB133111EBULL;
+    x ^= x >> 31;
+    return ((x >> 11) + 0.5) / 9007199254740992.0;
+}
+double exponential(unsigned long long entry, int stream, int seed,
+                   double mean) {
+    return -mean * std::log(uniform(entry, stream, seed));
+}
+double gauss(unsigned long long entry, int stream, int seed, double mean,
+             double sigma) {
+    return mean + sigma * std::sqrt(-2.0 * std::log(uniform(
+        entry, stream, seed))) * std::cos(2.0 * M_PI * uniform(
+        entry, stream + 1000, seed));
+}
+}
+"""
+
+# Fractions of genuine taus (gen_match_2 == 5), muons faking taus
+# (gen_match_2 == 2) and jets faking taus (gen_match_2 == 6) per sample
+_GEN_MATCH = {
+    "data": (0.5, 0.1),
+    "DY": (0.6, 0.2),
+    "EMB": (1.0, 0.0),
+    "TT": (0.3, 0.1),
+    "VV": (0.4, 0.2),
+    "W": (0.0, 0.1),
+}
+
+
+def pipelines(channel, sample, shifts=True):
+    """Pipelines of the channel written for the sample."""
+    if channel != "mt" or not shifts or sample == "data":
+        return ("nominal", )
+    names = TAU_ES_SHIFTS
+    if sample != "EMB":
+        names = names + JET_ES_SHIFTS
+    return ("nominal", ) + tuple(
+        name + direction for name in names for direction in ("Up", "Down"))
+
+
+def input_files(directory, sample):
+    """Files of a sample in the directory of the synthetic ntuples."""
+    sample_directory = os.path.join(directory, sample)
+    if not os.path.exists(sample_directory):
+        return []
+    return sorted(
+        os.path.join(sample_directory, name)
+        for name in os.listdir(sample_directory) if name.endswith(".root"))
+
+
+def _columns(channel, sample, pipeline, seed):
+    """Ordered (name, type, expression) of all branches of a tree."""
+
+    def uniform(stream):
+        return "tauid_synthetic::uniform(event, {}, {})".format(stream, seed)
+
+    def exponential(stream, mean):
+        return "tauid_synthetic::exponential(event, {}, {}, {})".format(
+            stream, seed, mean)
+
+    def gauss(stream, mean, sigma):
+        return "tauid_synthetic::gauss(event, {}, {}, {}, {})".format(
+            stream, seed, mean, sigma)
+
+    genuine, muons = _GEN_MATCH[sample]
+    if channel == "mm":
+        genuine, muons = 0.0, 1.0 if sample in ("DY", "EMB") else 0.3
+    tau_es = 0.0
+    jet_es = 0.0
+    for name in TAU_ES_SHIFTS:
+        if pipeline.startswith(name) and pipeline[len(name):] in ("Up",
+                                                                  "Down"):
+            tau_es = 0.01 if pipeline.endswith("Up") else -0.01
+            decay_mode = _TAU_ES_DECAY_MODES[name]
+    for name in JET_ES_SHIFTS:
+        if pipeline.startswith(name):
+            jet_es = 0.03 if pipeline.endswith("Up") else -0.03
+    scale = "1.0"
+    if tau_es != 0.0:
+        scale = "(decayMode_2 == {} && gen_match_2 == 5 ? {} : 1.0)".format(
+            decay_mode, 1.0 + tau_es)
+
+    columns = [
+        ("gen_match_2", "int",
+         "{u} < {g} ? 5 : ({u} < {m} ? 2 : 6)".format(
+             u=uniform(0), g=genuine, m=genuine + muons)),
+        ("decayMode_2", "int",
+         "{u} < 0.3 ? 0 : ({u} < 0.8 ? 1 : ({u} < 0.9 ? 10 : 11))".format(
+             u=uniform(1))),
+        ("pt_1", "float", "25.0 + " + exponential(2, 15.0)),
+        ("pt_2", "float", "({} * (20.0 + (gen_match_2 == 6 ? {} : {})))".format(
+            scale, exponential(3, 25.0), exponential(3, 15.0))),
+        ("eta_1", "float", gauss(4, 0.0, 1.0)),
+        ("eta_2", "float", gauss(5, 0.0, 1.0)),
+        ("phi_1", "float", "M_PI * (2.0 * {} - 1.0)".format(uniform(6))),
+        ("phi_2", "float", "M_PI * (2.0 * {} - 1.0)".format(uniform(7))),
+        ("m_vis", "float", "std::sqrt({}) * (gen_match_2 == 5 ? {} : "
+         "(gen_match_2 == 2 ? {} : 40.0 + {}))".format(
+             scale, gauss(8, 65.0, 12.0), gauss(8, 91.0, 3.0),
+             exponential(8, 40.0))),
+        ("m_fastmtt", "float", "1.4 * m_vis + " + gauss(9, 0.0, 10.0)),
+        ("pt_fastmtt", "float", "pt_1 + pt_2 + " + gauss(10, 0.0, 5.0)),
+        ("pZetaMissVis", "float", gauss(11, -20.0, 30.0)),
+        ("mt_1", "float", "{} * {}".format(
+            1.0 + jet_es / 3.0,
+            exponential(12, 45.0 if sample in ("W", "TT") else 20.0))),
+        ("njets", "int", " + ".join(
+            "({} * {} > 30.0)".format(1.0 + jet_es, exponential(13 + i, 20.0))
+            for i in range(4))),
+        ("iso_1", "float", exponential(17, 0.05)),
+        ("iso_2", "float", exponential(18, 0.05)),
+        ("q_1", "int", "{} < 0.5 ? -1 : 1".format(uniform(19))),
+        ("q_2", "int", "{} < {} ? -q_1 : q_1".format(
+            uniform(20), 0.7 if sample in ("data", "W") else 0.95)),
+        ("byTightDeepTau2017v2p1VSmu_2", "float",
+         "(gen_match_2 != 2 || {} < 0.1) ? 1.0 : 0.0".format(uniform(21))),
+        ("byVVLooseDeepTau2017v2p1VSe_2", "float",
+         "{} < 0.98 ? 1.0 : 0.0".format(uniform(22))),
+        ("deepTau_score_2", "float", "gen_match_2 == 5 ? std::pow({u}, 0.125) "
+         ": {u}".format(u=uniform(23))),
+    ]
+    for i, working_point in enumerate(WORKING_POINTS):
+        columns.append(("by{}DeepTau2017v2p1VSjet_2".format(working_point),
+                        "float", "deepTau_score_2 > {:.1f} ? 1.0 : 0.0".format(
+                            0.2 + 0.1 * i)))
+    for i, name in enumerate([
+            "puweight", "idWeight_1", "isoWeight_1", "trackWeight_1",
+            "idWeight_2", "isoWeight_2", "trackWeight_2", "triggerWeight_1",
+            "zPtReweightWeight", "topPtReweightWeight",
+            "embeddedDecayModeWeight"
+    ]):
+        columns.append((name, "float", gauss(30 + i, 1.0, 0.05)))
+    columns += [
+        ("generatorWeight", "float",
+         "{} < 0.02 ? -1.0 : 1.0".format(uniform(50))),
+        ("numberGeneratedEventsWeight", "float", "1e-6"),
+        ("crossSectionPerEventWeight", "float", "1.0"),
+        ("eleTauFakeRateWeight", "float", "1.0"),
+        ("muTauFakeRateWeight", "float", "1.0"),
+        ("prefiringweight", "float", "0.98"),
+        ("prefiringweightup", "float", "0.99"),
+        ("prefiringweightdown", "float", "0.97"),
+    ]
+    return columns
+
+
+def generate(directory,
+             num_events,
+             num_files=1,
+             channels=("mt", "mm"),
+             shifts=True,
+             seed=1):
+    """Write the synthetic ntuples of all samples to the directory.
+
+    Every file holds num_events events in every tree. The ntuples are
+    reproducible for the same seed.
+    """
+    import ROOT
+    ROOT.gInterpreter.Declare(_RANDOM)
+    options = ROOT.ROOT.RDF.RSnapshotOptions()
+    options.fMode = "UPDATE"
+    for sample_index, sample in enumerate(SAMPLES):
+        sample_directory = os.path.join(directory, sample)
+        if not os.path.exists(sample_directory):
+            os.makedirs(sample_directory)
+        for file_index in range(num_files):
+            path = os.path.join(sample_directory,
+                                "{}_{}.root".format(sample, file_index))
+            if os.path.exists(path):
+                os.remove(path)
+            for channel in channels:
+                for pipeline in pipelines(channel, sample, shifts):
+                    dataframe = ROOT.RDataFrame(num_events).Define(
+                        "event", "static_cast<unsigned long long>(rdfentry_"
+                        " + {})".format(file_index * num_events))
+                    columns = _columns(channel, sample, pipeline,
+                                       seed * 100 + sample_index)
+                    for name, column_type, expression in columns:
+                        dataframe = dataframe.Define(
+                            name, "static_cast<{}>({})".format(
+                                column_type, expression))
+                    branches = ROOT.std.vector("string")()
+                    for name, _, _ in columns:
+                        branches.push_back(name)
+                    dataframe.Snapshot("{}_{}/ntuple".format(
+                        channel, pipeline), path, branches, options)
+            logger.info("Wrote %d events per tree to %s.", num_events, path)
+
+
+# Processes of the era scripts as the sample and the cuts on the tau
+_PROCESSES = {
+    "mt": [
+        ("data_obs", "data", []),
+        ("ZTT", "DY", [("ztt_cut", "gen_match_2==5")]),
+        ("ZL", "DY", [("zl_cut", "gen_match_2<5")]),
+        ("ZJ", "DY", [("zj_cut", "gen_match_2==6")]),
+        ("EMB", "EMB", []),
+        ("TTT", "TT", [("ttt_cut", "gen_match_2==5")]),
+        ("TTL", "TT", [("ttl_cut", "gen_match_2<5")]),
+        ("TTJ", "TT", [("ttj_cut", "gen_match_2==6")]),
+        ("VVT", "VV", [("vvt_cut", "gen_match_2==5")]),
+        ("VVL", "VV", [("vvl_cut", "gen_match_2<5")]),
+        ("VVJ", "VV", [("vvj_cut", "gen_match_2==6")]),
+        ("W", "W", []),
+    ],
+    "mm": [
+        ("data_obs", "data", []),
+        ("ZLL", "DY", []),
+        ("MMEMB", "EMB", []),
+        ("TT", "TT", []),
+        ("VV", "VV", []),
+        ("W", "W", []),
+    ],
+}
+
+_CHANNEL_CUTS = {
+    "mt": [
+        ("pt_1", "pt_1>25"),
+        ("pt_2", "pt_2>20"),
+        ("eta_2", "abs(eta_2)<2.3"),
+        ("muon_iso", "iso_1<0.15"),
+        ("againstMuonDiscriminator", "byTightDeepTau2017v2p1VSmu_2>0.5"),
+        ("againstElectronDiscriminator", "byVVLooseDeepTau2017v2p1VSe_2>0.5"),
+        ("m_t", "mt_1<60"),
+        ("dZeta", "pZetaMissVis>-25"),
+    ],
+    "mm": [
+        ("pt_1", "pt_1>25"),
+        ("pt_2", "pt_2>15"),
+        ("muon_iso", "iso_1<0.15 && iso_2<0.15"),
+        ("m_vis", "m_vis>50 && m_vis<150"),
+    ],
+}
+
+_OPPOSITE_SIGN = ("os", "q_1*q_2<0")
+_SAME_SIGN = ("os", "q_1*q_2>0")
+
+
+def _sample_weights(sample):
+    if sample == "data":
+        return []
+    weights = [("generatorWeight", "generatorWeight"),
+               ("idWeight", "idWeight_1*isoWeight_1*trackWeight_1"),
+               ("triggerweight", "triggerWeight_1")]
+    if sample == "EMB":
+        return weights + [("decayMode_SF", "embeddedDecayModeWeight")]
+    weights += [("puweight", "puweight"),
+                ("numberGeneratedEventsWeight", "numberGeneratedEventsWeight"),
+                ("crossSectionPerEventWeight", "crossSectionPerEventWeight"),
+                ("prefireWeight", "prefiringweight")]
+    if sample == "DY":
+        weights.append(("zPtReweightWeight", "zPtReweightWeight"))
+    if sample == "TT":
+        weights.append(("topPtReweightWeight", "topPtReweightWeight"))
+    return weights
+
+
+def _replace(name, expression):
+    def reweight(weights):
+        return [(weight_name, expression if weight_name == name else weight)
+                for weight_name, weight in weights]
+
+    return reweight
+
+
+def _add(name, expression):
+    def reweight(weights):
+        return weights + [(name, expression)]
+
+    return reweight
+
+
+def _square(name):
+    def reweight(weights):
+        return [(weight_name, "({0})*({0})".format(weight)
+                 if weight_name == name else weight)
+                for weight_name, weight in weights]
+
+    return reweight
+
+
+def _remove(name):
+    def reweight(weights):
+        return [(weight_name, weight) for weight_name, weight in weights
+                if weight_name != name]
+
+    return reweight
+
+
+def _variations():
+    """Variations of the mt channel as (name, processes, pipeline, reweight).
+
+    The variations follow the 2017 era script.
+    """
+    mc = ["ZTT", "ZL", "ZJ", "W", "TTT", "TTL", "TTJ", "VVT", "VVJ", "VVL"]
+    variations = []
+    for direction in ("Up", "Down"):
+        variations.append(
+            ("CMS_prefiring_Run2017" + direction, mc, "nominal",
+             _replace("prefireWeight",
+                      "prefiringweight" + direction.lower())))
+        for shift in TAU_ES_SHIFTS:
+            variations.append(("CMS_scale_t_{}_Run2017{}".format(
+                shift, direction), ["ZTT", "TTT", "TTL", "VVT", "VVL", "EMB"],
+                               shift + direction, None))
+        for shift in JET_ES_SHIFTS:
+            variations.append(("CMS_scale_j_{}_Run2017{}".format(
+                shift, direction), mc, shift + direction, None))
+        variations.append(
+            ("CMS_htt_dyShape_Run2017" + direction, ["ZTT", "ZL", "ZJ"],
+             "nominal", _square("zPtReweightWeight")
+             if direction == "Up" else _remove("zPtReweightWeight")))
+        variations.append(
+            ("CMS_htt_ttbarShape" + direction, ["TTT", "TTL", "TTJ"],
+             "nominal", _square("topPtReweightWeight")
+             if direction == "Up" else _remove("topPtReweightWeight")))
+    variations.append(
+        ("CMS_htt_jetToTauFake_Run2017Up", ["ZJ", "TTJ", "W", "VVJ"],
+         "nominal", _add("jetToTauFake_weight", "max(1.0-pt_2*0.002, 0.6)")))
+    variations.append(
+        ("CMS_htt_jetToTauFake_Run2017Down", ["ZJ", "TTJ", "W", "VVJ"],
+         "nominal", _add("jetToTauFake_weight", "min(1.0+pt_2*0.002, 1.4)")))
+    return variations
+
+
+def _categories(channel, binning):
+    """Categories of the channel as (name, cuts, expression, edges)."""
+    if channel == "mm":
+        return [("control", [], "m_vis", [50.0, 150.0])]
+    return [(name, [("category", category["cut"])], category["expression"],
+             [float(edge) for edge in category["bins"]])
+            for name, category in sorted(binning["categories"]["mt"].items())]
+
+
+def benchmark_specs(directory,
+                    binning,
+                    working_points=("Tight", ),
+                    channels=("mt", "mm"),
+                    shifts=True):
+    """Specs of the production of the era script on the synthetic ntuples.
+
+    Specs with the same content are only requested once, as in the
+    estimation graph.
+    """
+    specs = []
+    seen = set()
+
+    def add(name, sample, folder, cuts, weights, expression, edges):
+        spec = HistogramSpec(
+            name=name,
+            files=input_files(directory, sample),
+            folder=folder,
+            friend_files=[],
+            cuts=cuts,
+            weights=weights,
+            expression=expression,
+            edges=edges)
+        if spec.fingerprint not in seen:
+            seen.add(spec.fingerprint)
+            specs.append(spec)
+
+    for channel in channels:
+        points = working_points if channel == "mt" else ("mm", )
+        for working_point in points:
+            base = list(_CHANNEL_CUTS[channel])
+            if channel == "mt":
+                base.append(("tau_iso",
+                             "by{}DeepTau2017v2p1VSjet_2>0.5".format(
+                                 working_point)))
+            for category, category_cuts, expression, edges in _categories(
+                    channel, binning):
+                for process, sample, process_cuts in _PROCESSES[channel]:
+                    cuts = base + process_cuts + category_cuts
+                    weights = _sample_weights(sample)
+                    prefix = "{}#{}_{}_{}".format(process, channel,
+                                                  working_point, category)
+                    add(prefix + "#Nominal", sample,
+                        "{}_nominal".format(channel),
+                        cuts + [_OPPOSITE_SIGN], weights, expression, edges)
+                    # Same sign region of the QCD estimation
+                    add(prefix + "#SameSign", sample,
+                        "{}_nominal".format(channel), cuts + [_SAME_SIGN],
+                        weights, expression, edges)
+                    if channel != "mt" or not shifts:
+                        continue
+                    for name, processes, pipeline, reweight in _variations():
+                        if process not in processes:
+                            continue
+                        add("{}#{}".format(prefix, name), sample,
+                            "{}_{}".format(channel, pipeline),
+                            cuts + [_OPPOSITE_SIGN],
+                            reweight(weights) if reweight else weights,
+                            expression, edges)
+    logger.info("Benchmark configuration with %d histograms.", len(specs))
+    return specs
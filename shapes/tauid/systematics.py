@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+import ROOT
+
+from shape_producer.systematics import Systematics as ClassicSystematics
+
+from . import checkpoint, profile
+from .cache import ShapeCache, fill_with_cache
+from .checkpoint import Checkpoint, configuration_hash
+from .estimation_graph import EstimationGraph
+from .partition import PartitioningBackend
+from .plan import log_plan
+from .shards import ShardMerger, produce_shard
+from .skim import SkimmingBackend
+from .specs import group_by_input, log_workload
+from .streaming import memory_batches, peak_memory
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def create_backend(name, num_threads, num_processes=1):
+    if name == "tdf":
+        from .rdataframe import RDataFrameBackend
+        return RDataFrameBackend(
+            num_threads=num_threads, num_processes=num_processes)
+    if name == "numpy":
+        from .columnar import ColumnarBackend
+        return ColumnarBackend(num_workers=max(num_threads, num_processes))
+    logger.critical("Backend {} is not implemented.".format(name))
+    raise Exception
+
+
+class Systematics(ClassicSystematics):
+    """Container of all systematics with a selectable production backend.
+
+    The classic backend is the per-histogram production of shape_producer.
+    All other backends fill the root objects of all systematics together and
+    run the estimation methods on the filled objects afterwards.
+    """
+
+    def __init__(self,
+                 output_file,
+                 num_threads=1,
+                 backend="classic",
+                 skip_systematic_variations=False):
+        super(Systematics, self).__init__(
+            output_file,
+            num_threads=num_threads,
+            skip_systematic_variations=skip_systematic_variations)
+        self._output_file = output_file
+        self._num_threads = num_threads
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend
+
+    @property
+    def num_threads(self):
+        return self._num_threads
+
+    @property
+    def output_file(self):
+        return self._output_file
+
+    def produce(self):
+        produce([self])
+
+    def _produce_classic(self):
+        super(Systematics, self).produce()
+
+    @property
+    def systematics(self):
+        return self._systematics
+
+    def _open_output(self):
+        logger.info("Write shapes to %s.", self._output_file)
+        self._shape_file = ROOT.TFile(self._output_file, "RECREATE")
+
+    def _write_shape(self, systematic):
+        systematic.do_estimation()
+        self._shape_file.WriteTObject(systematic.shape.result,
+                                      systematic.name)
+
+    def _write_histogram(self, name, histogram):
+        self._shape_file.WriteTObject(histogram.to_th1(name), name)
+
+    def _close_output(self):
+        self._shape_file.Close()
+        self._shape_file = None
+
+
+def produce(containers,
+            cache_directory=None,
+            cache_size=None,
+            skim_directory=None,
+            grids=None,
+            max_memory=None,
+            num_processes=1,
+            shard=None,
+            merge_shards=False,
+            shard_directory=None,
+            shard_chunk_size=10,
+            checkpoint_directory=None,
+            resume=False,
+            profile_file=None,
+            plan=False):
+    """Produce the shapes of several containers of systematics together.
+
+    With all backends except the classic one, the root objects of all
+    containers are filled in the same event loops. This is used to produce
+    the shapes of several working points, which only differ in the tau ID
+    cut, while reading the ntuples only once. With a cache directory, only
+    the root objects missing in the shape cache are filled. The cache size
+    is given in GB. Histograms of variables with a fine grid are cached as
+    master histograms on the grid, see tauid.grid. With a skim directory,
+    the backend reads the skims of the ntuples instead of the ntuples.
+
+    Every shape is written as soon as all its inputs are filled and released
+    afterwards. The shapes of plain, QCD and AddHistogram estimations are
+    formed from compact array histograms, see tauid.histogram, and only
+    converted to TH1 for writing. With a maximum memory in GB, the input
+    trees are filled in batches fitting into it, see tauid.streaming. The
+    event loops run on a pool of num_processes processes, see
+    tauid.scheduler.
+
+    With a shard (index, number of shards), only the chunks of the inputs
+    assigned to this shard are filled and written to the shard directory.
+    With merge_shards, the inputs are taken from the shard files instead of
+    being filled, see tauid.shards.
+
+    Otherwise, with a checkpoint directory, the filled inputs of every
+    finished event loop are recorded in it while the production runs. With
+    resume, the recorded inputs are taken from the checkpoint of an
+    interrupted production with the same configuration, see
+    tauid.checkpoint.
+
+    With a profile file, the resources used by every event loop and their
+    share of every systematic are written to it, see tauid.profile. With
+    plan, only the production plan and its cost estimate from the profile
+    file of a previous production are logged without reading any events,
+    see tauid.plan. The plan does not depend on the backend, with the
+    classic backend it shows the production with the other backends.
+    """
+    backend = containers[0].backend
+    if backend == "classic" and not plan:
+        unsupported = [
+            option for option, given in [
+                ("--profile", profile_file is not None),
+                ("--cache-directory", cache_directory is not None),
+                ("--skim-directory", skim_directory is not None),
+                ("--max-memory", max_memory is not None),
+                ("--num-processes", num_processes > 1),
+                ("--resume or --checkpoint-directory",
+                 checkpoint_directory is not None),
+                ("--shard", shard is not None),
+                ("--merge-shards", merge_shards),
+            ] if given
+        ]
+        if unsupported:
+            logger.critical(
+                "The classic backend does not support %s. Use --backend tdf or numpy.",
+                ", ".join(unsupported))
+            raise Exception
+        if len(containers) > 1:
+            logger.warning(
+                "The classic backend produces the %d outputs one after the other.",
+                len(containers))
+        for container in containers:
+            container._produce_classic()
+        return
+
+    if profile_file is not None and not plan:
+        production_profile = profile.start()
+    graph = EstimationGraph(
+        [s for container in containers for s in container.systematics])
+    graph.log_summary()
+    log_workload(graph.specs)
+    if plan:
+        if backend == "classic":
+            logger.info(
+                "The plan is the one of the tdf and numpy backends, the classic backend fills every root object in its own event loop."
+            )
+        log_plan(graph, num_processes, containers[0].num_threads,
+                 profile_file)
+        return
+    owners = [
+        container for container in containers for _ in container.systematics
+    ]
+
+    logger.info("Fill %d root objects with the %s backend.",
+                len(graph.specs), backend)
+    filler = PartitioningBackend(
+        create_backend(backend, containers[0].num_threads, num_processes))
+    if skim_directory is not None:
+        filler = SkimmingBackend(filler, skim_directory, backend)
+    if merge_shards:
+        filler = ShardMerger(graph.specs, shard_directory)
+        cache_directory = None
+    if cache_directory is not None:
+        cache = ShapeCache(
+            cache_directory,
+            max_size=cache_size * 1e9 if cache_size is not None else None)
+
+    def fill(specs):
+        if cache_directory is not None:
+            return fill_with_cache(specs, filler, cache, grids)
+        return filler.run(specs)
+
+    if shard is not None:
+        produce_shard(graph.specs, fill, shard, shard_directory,
+                      shard_chunk_size)
+        return
+
+    batches = memory_batches(
+        graph.specs, group_by_input(graph.specs),
+        max_memory * 1e9 if max_memory is not None else None,
+        containers[0].num_threads, num_processes)
+    if len(batches) > 1:
+        logger.info("Fill the inputs in %d batches to stay below %.1f GB.",
+                    len(batches), max_memory)
+
+    recorded = None
+    if checkpoint_directory is not None and not merge_shards:
+        recorded = Checkpoint(
+            checkpoint_directory,
+            configuration_hash(graph.specs, [
+                container.output_file for container in containers
+            ]),
+            resume=resume)
+        checkpoint.start(recorded)
+
+    for container in containers:
+        container._open_output()
+    missing = [len(graph.nodes(index)) for index in range(len(owners))]
+    pending = [len(graph.consumers(node)) for node in range(len(graph.specs))]
+    filled = {}
+    for nodes in batches:
+        specs = [graph.specs[node] for node in nodes]
+        results = fill(specs)
+        filled.update(zip(nodes, results))
+        for node in nodes:
+            for index in graph.consumers(node):
+                missing[index] -= 1
+                if missing[index] > 0:
+                    continue
+                systematic = graph.systematics[index]
+                histogram = graph.estimate(index, filled)
+                if histogram is not None:
+                    owners[index]._write_histogram(systematic.name, histogram)
+                else:
+                    graph.assign(index, filled)
+                    owners[index]._write_shape(systematic)
+                    graph.release(index)
+                for input_node in graph.nodes(index):
+                    pending[input_node] -= 1
+                    if pending[input_node] == 0:
+                        del filled[input_node]
+    for container in containers:
+        container._close_output()
+    if recorded is not None:
+        checkpoint.stop()
+        recorded.remove()
+
+    own, children = peak_memory()
+    logger.info("Peak memory: %.2f GB, %.2f GB in worker processes.", own,
+                children)
+    if profile_file is not None:
+        production_profile.write(profile_file, graph)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Tests of the expression parser and the fills of the columnar backend."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tauid import scheduler
+from tauid.columnar import (count_entries, fill_group, fill_histogram,
+                            referenced_branches)
+from tauid.expression import ExpressionError, compile_expression
+from tauid.specs import HistogramSpec
+
+NUM_EVENTS = 1000
+
+
+def columns(seed=1):
+    random = np.random.RandomState(seed)
+    return {
+        "pt_1": random.uniform(20.0, 60.0, NUM_EVENTS),
+        "pt_2": random.uniform(15.0, 100.0, NUM_EVENTS),
+        "eta_1": random.uniform(-2.5, 2.5, NUM_EVENTS),
+        "m_vis": random.uniform(-10.0, 220.0, NUM_EVENTS),
+        "q_1": random.choice([-1.0, 1.0], NUM_EVENTS),
+        "q_2": random.choice([-1.0, 1.0], NUM_EVENTS),
+        "decayMode_2": random.choice([0.0, 1.0, 10.0], NUM_EVENTS),
+        "flagMETFilter": random.choice([0.0, 1.0], NUM_EVENTS),
+        "puweight": random.uniform(0.5, 1.5, NUM_EVENTS),
+    }
+
+
+# Expressions of the era scripts, binning.yaml and shape_producer channels
+# with the same computation per event in Python.
+EXPRESSIONS = [
+    ("(pt_2 >= 20) && (pt_2 < 25)", lambda e: e["pt_2"] >= 20 and e["pt_2"] < 25),
+    ("pt_2 >= 70", lambda e: e["pt_2"] >= 70),
+    ("abs(eta_1)<2.1", lambda e: abs(e["eta_1"]) < 2.1),
+    ("TMath::Abs(eta_1) > 1.0 || pt_1 > 50",
+     lambda e: abs(e["eta_1"]) > 1.0 or e["pt_1"] > 50),
+    ("!(flagMETFilter == 1)", lambda e: not e["flagMETFilter"] == 1),
+    ("q_1*q_2<0 && !(decayMode_2 == 10) || pt_2 > 90",
+     lambda e: (e["q_1"] * e["q_2"] < 0 and not e["decayMode_2"] == 10) or
+     e["pt_2"] > 90),
+    ("decayMode_2 != 1 && pt_1 >= 25 && pt_1 <= 40",
+     lambda e: e["decayMode_2"] != 1 and 25 <= e["pt_1"] <= 40),
+    ("(1.0*(pt_1<=25)+0.98*(pt_1>25))",
+     lambda e: 1.0 * (e["pt_1"] <= 25) + 0.98 * (e["pt_1"] > 25)),
+    ("max(1.0-pt_2*0.002, 0.6)", lambda e: max(1.0 - e["pt_2"] * 0.002, 0.6)),
+    ("min(1.0+pt_2*0.002, 1.4)", lambda e: min(1.0 + e["pt_2"] * 0.002, 1.4)),
+    ("pt_2 > 50 ? 1.1 : -puweight", lambda e: 1.1 if e["pt_2"] > 50 else
+     -e["puweight"]),
+    ("2*-pt_1/4+1.5e1", lambda e: 2 * -e["pt_1"] / 4 + 15.0),
+]
+
+
+@pytest.mark.parametrize("expression, function", EXPRESSIONS)
+def test_expressions(expression, function):
+    data = columns()
+    compiled = compile_expression(expression)
+    values = compiled.values(data, NUM_EVENTS)
+    events = [dict((name, data[name][i]) for name in data)
+              for i in range(NUM_EVENTS)]
+    assert np.allclose(values, [float(function(event)) for event in events])
+    assert compiled.branches <= set(data)
+
+
+def test_branches():
+    assert compile_expression(
+        "abs(eta_1) < 2.1 && TMath::Pi > pt_2").branches == set(
+            ["eta_1", "pt_2"])
+
+
+@pytest.mark.parametrize("expression",
+                         ["pt_2 >", "(pt_2 > 20", "foo(pt_2)", "max(pt_2)",
+                          "pt_2 $ 3"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ExpressionError):
+        compile_expression(expression)
+
+
+def test_fill_histogram():
+    edges = np.array([0.0, 1.0, 2.0, 4.0])
+    values = np.array([-1.0, 0.0, 0.5, 1.0, 3.9, 4.0, 7.0])
+    weights = np.array([1.0, 2.0, 3.0, 0.5, -1.0, 2.0, 1.5])
+    sumw, sumw2 = fill_histogram(values, weights, edges)
+    # The upper edge of every bin is exclusive, as for TH1
+    assert np.allclose(sumw, [1.0, 5.0, 0.5, -1.0, 3.5])
+    assert np.allclose(sumw2, [1.0, 13.0, 0.25, 1.0, 6.25])
+
+
+def test_count_entries():
+    edges = np.array([0.0, 1.0, 2.0, 4.0])
+    values = np.array([-1.0, 0.0, 0.5, 1.0, 3.9, 4.0, 7.0, 2.5])
+    categories = np.array([0.0, 1.0, 1.0, -1.0, 0.0, 0.0, 1.0, 2.0])
+    # Under- and overflow events and events outside of the categories are
+    # not counted
+    assert count_entries(values, edges) == 5
+    assert count_entries(values, edges, categories, 2) == [1, 2]
+
+
+def spec(name, cuts, weights, expression="m_vis",
+         edges=(0.0, 50.0, 100.0, 200.0)):
+    return HistogramSpec(
+        name=name,
+        files=["ntuple.root"],
+        folder="mt_nominal",
+        friend_files=[],
+        cuts=cuts,
+        weights=weights,
+        expression=expression,
+        edges=edges)
+
+
+def test_fill_group():
+    data = columns()
+    channel = ("channel", "q_1*q_2<0 && flagMETFilter == 1")
+    specs = [
+        spec("Pt20to25", [channel, ("category", "(pt_2 >= 20) && (pt_2 < 25)")],
+             [("pu", "puweight")]),
+        spec("Pt20to25_up", [channel, ("category",
+                                       "(pt_2 >= 20) && (pt_2 < 25)")],
+             [("pu", "puweight"), ("tau", "min(1.0+pt_2*0.002, 1.4)")]),
+        spec("PtGt70", [channel, ("category", "pt_2 >= 70")],
+             [("pu", "puweight")]),
+        spec("count", [channel], [("pu", "puweight")], None, None),
+    ]
+    results = fill_group(specs, data, NUM_EVENTS)
+    assert referenced_branches(specs) == set(
+        ["q_1", "q_2", "flagMETFilter", "pt_2", "puweight", "m_vis"])
+
+    selected = (data["q_1"] * data["q_2"] < 0) & (data["flagMETFilter"] == 1)
+    events_selected = scheduler._statistics["events_selected"]
+    for s, (sumw, sumw2), entries in zip(specs, results, events_selected):
+        mask = selected.copy()
+        if s.name.startswith("Pt20to25"):
+            mask &= (data["pt_2"] >= 20) & (data["pt_2"] < 25)
+        elif s.name == "PtGt70":
+            mask &= data["pt_2"] >= 70
+        weights = data["puweight"][mask]
+        if s.name == "Pt20to25_up":
+            weights = weights * np.minimum(1.0 + data["pt_2"][mask] * 0.002,
+                                           1.4)
+        if s.is_count:
+            assert entries == np.count_nonzero(mask)
+            assert sumw == pytest.approx(np.sum(weights))
+            assert sumw2 == pytest.approx(np.sum(weights**2))
+            continue
+        indices = np.searchsorted(s.edges, data["m_vis"][mask], side="right")
+        assert entries == np.count_nonzero(
+            (indices > 0) & (indices < len(s.edges)))
+        expected = np.array(
+            [np.sum(weights[indices == i]) for i in range(len(s.edges) + 1)])
+        expected2 = np.array([
+            np.sum(weights[indices == i]**2) for i in range(len(s.edges) + 1)
+        ])
+        assert np.allclose(sumw, expected)
+        assert np.allclose(sumw2, expected2)
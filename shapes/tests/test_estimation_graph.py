@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""Tests of the composite estimations formed by the estimation graph.
+
+The estimation methods are stubs which, like the ones of shape_producer,
+keep the systematics of their inputs as attributes of the method shared by
+all categories and variations of a process.
+"""
+
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+pytest.importorskip("ROOT")
+estimation_methods = pytest.importorskip("shape_producer.estimation_methods")
+
+from tauid.estimation_graph import EstimationGraph
+from tauid.roothist import from_th1
+from tauid.specs import spec_from_root_object
+
+EDGES = [0.0, 1.0, 2.0, 3.0, 4.0]
+CATEGORIES = [("Pt20to30", "pt_2>=20&&pt_2<30"), ("Pt30toInf", "pt_2>=30")]
+VARIATIONS = [("Nominal", "1.0"), ("CMS_scale_Up", "scaleUp")]
+OPPOSITE_SIGN = "q_1*q_2<0"
+SAME_SIGN = "q_1*q_2>0"
+EXTRAPOLATION_FACTOR = 1.17
+
+
+class Cut(object):
+    def __init__(self, name, expression):
+        self.name = name
+        self._expression = expression
+
+    def expand(self):
+        return self._expression
+
+
+class Weight(object):
+    def __init__(self, name, expression):
+        self.name = name
+        self._expression = expression
+
+    def extract(self):
+        return self._expression
+
+
+class Binning(object):
+    _bin_edges = EDGES
+
+
+class Variable(object):
+    expression = "m_vis"
+    binning = Binning()
+
+
+class RootObject(object):
+    def __init__(self, name, cuts, weight):
+        self.name = name
+        self._inputs = ["ntuple.root"]
+        self._folder = "mt_nominal"
+        self._cuts = [Cut(name, cut) for name, cut in cuts]
+        self._weights = [Weight("variation", weight)]
+        self._variable = Variable()
+        self._result = None
+
+
+class Shape(object):
+    def __init__(self, result):
+        self.result = result
+
+
+class Systematic(object):
+    def __init__(self, category, process, variation, sign=OPPOSITE_SIGN):
+        self.category = category
+        self.process = process
+        self.variation = variation
+        self.sign = sign
+        self.root_objects = []
+        self.shape = None
+        self._shape = None
+
+    @property
+    def name(self):
+        return "#".join(
+            [self.category[0], self.process.name, self.variation[0],
+             self.sign])
+
+    def create_root_objects(self):
+        self.root_objects = self.process.estimation_method.create_root_objects(
+            self)
+
+    def do_estimation(self):
+        method = self.process.estimation_method
+        if isinstance(method, PlainEstimation):
+            result = self.root_objects[0]._result
+        else:
+            result = method.do_estimation(self)
+        self.shape = Shape(result)
+        self._shape = self.shape
+
+
+class Process(object):
+    def __init__(self, name, estimation_method):
+        self.name = name
+        self.estimation_method = estimation_method
+
+
+class PlainEstimation(estimation_methods.EstimationMethod):
+    def __init__(self, cut):
+        self._cut = cut
+
+    def create_root_objects(self, systematic):
+        return [
+            RootObject(systematic.name, [("channel", systematic.sign),
+                                         ("category", systematic.category[1]),
+                                         ("process", self._cut)],
+                       systematic.variation[1])
+        ]
+
+
+class QCDEstimation(estimation_methods.EstimationMethod):
+    def __init__(self, data_process, bg_processes):
+        self._data_process = data_process
+        self._bg_processes = bg_processes
+        self._extrapolation_factor = EXTRAPOLATION_FACTOR
+
+    def create_root_objects(self, systematic):
+        self._qcd_systematics = []
+        root_objects = []
+        for process in [self._data_process] + self._bg_processes:
+            input_systematic = Systematic(systematic.category, process,
+                                          systematic.variation, SAME_SIGN)
+            input_systematic.create_root_objects()
+            self._qcd_systematics.append(input_systematic)
+            root_objects += input_systematic.root_objects
+        return root_objects
+
+    def do_estimation(self, systematic):
+        shapes = []
+        for input_systematic in self._qcd_systematics:
+            input_systematic.do_estimation()
+            shapes.append(input_systematic.shape)
+        result = shapes[0].result
+        for shape in shapes[1:]:
+            result.Add(shape.result, -1.0)
+        for i in range(1, result.GetNbinsX() + 1):
+            if result.GetBinContent(i) < 0.0:
+                result.SetBinContent(i, 0.0)
+        result.Scale(self._extrapolation_factor)
+        return result
+
+
+class AddHistogramEstimation(
+        estimation_methods.AddHistogramEstimationMethod):
+    def __init__(self, add_processes, add_weights):
+        self._add_processes = add_processes
+        self._add_weights = add_weights
+
+    def create_root_objects(self, systematic):
+        self._add_systematics = []
+        root_objects = []
+        for process in self._add_processes:
+            input_systematic = Systematic(systematic.category, process,
+                                          systematic.variation)
+            input_systematic.create_root_objects()
+            self._add_systematics.append(input_systematic)
+            root_objects += input_systematic.root_objects
+        return root_objects
+
+    def do_estimation(self, systematic):
+        result = None
+        for input_systematic, weight in zip(self._add_systematics,
+                                            self._add_weights):
+            input_systematic.do_estimation()
+            if result is None:
+                result = input_systematic.shape.result
+                result.Scale(weight)
+            else:
+                result.Add(input_systematic.shape.result, weight)
+        return result
+
+
+def content(spec):
+    """Filled sumw and sumw2 depending only on the selection and weights."""
+    key = repr((sorted(cut for _, cut in spec.cuts),
+                sorted(weight for _, weight in spec.weights)))
+    random = np.random.RandomState(
+        int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16))
+    sumw = random.uniform(-2.0, 20.0, len(EDGES) + 1)
+    return sumw, 0.1 * np.abs(sumw)
+
+
+def expected(process, category, variation, sign):
+    """sumw of a plain estimation computed directly from its selection."""
+    spec = RootObject(None, [("channel", sign), ("category", category[1]),
+                             ("process", process)], variation[1])
+    return content(spec_from_root_object(spec))[0]
+
+
+def test_composites_of_all_categories_and_variations():
+    data = Process("data_obs", PlainEstimation("is_data"))
+    emb = Process("EMB", PlainEstimation("is_emb"))
+    ttt = Process("TTT", PlainEstimation("is_ttt"))
+    zl = Process("ZL", PlainEstimation("is_zl"))
+    qcd = Process("QCD", QCDEstimation(data, [ttt, zl]))
+    added = Process("ZTTpTTTauTauUp", AddHistogramEstimation([emb, ttt],
+                                                             [1.0, 0.1]))
+    systematics = [
+        Systematic(category, process, variation)
+        for category in CATEGORIES for variation in VARIATIONS
+        for process in [qcd, added]
+    ]
+    graph = EstimationGraph(systematics)
+    results = dict((node, content(spec))
+                   for node, spec in enumerate(graph.specs))
+
+    for index, systematic in enumerate(systematics):
+        category, variation = systematic.category, systematic.variation
+        if systematic.process is qcd:
+            sumw = expected("is_data", category, variation, SAME_SIGN)
+            for cut in ("is_ttt", "is_zl"):
+                sumw = sumw - expected(cut, category, variation, SAME_SIGN)
+            sumw[1:-1] = np.maximum(sumw[1:-1], 0.0)
+            sumw = sumw * EXTRAPOLATION_FACTOR
+        else:
+            sumw = expected("is_emb", category, variation, OPPOSITE_SIGN) + \
+                0.1 * expected("is_ttt", category, variation, OPPOSITE_SIGN)
+
+        shape = graph.estimate(index, results)
+        assert shape is not None
+        assert np.allclose(shape.sumw, sumw)
+
+        graph.assign(index, results)
+        systematic.do_estimation()
+        classic_sumw, classic_sumw2 = from_th1(systematic.shape.result)
+        graph.release(index)
+        assert np.allclose(classic_sumw, sumw)
+        assert np.allclose(shape.sumw2, classic_sumw2)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Tests of the binned likelihood fit on small synthetic shapes."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tauid.fit import (CONTROL_CATEGORY, PROCESSES, SIGNAL, BatchedModel,
+                       Model, fit, fit_batch)
+
+CATEGORIES = ["Pt20to25", "Pt25to30", "Pt30to35"]
+
+
+def synthetic_shapes(embedding, scale_factors, asimov=False, seed=1):
+    """Shapes dict with the injected SF on the signal of every category.
+
+    The last category has more bins than the others, so the batched fit
+    has to pad the categories.
+    """
+    random = np.random.RandomState(seed)
+    regions = [("mt", category, 8 + 2 * (i == len(CATEGORIES) - 1))
+               for i, category in enumerate(CATEGORIES)]
+    if not embedding:
+        regions.append(("mm", CONTROL_CATEGORY, 1))
+    shapes = {}
+    for channel, category, num_bins in regions:
+        total = np.zeros(num_bins)
+        for process in PROCESSES[(channel, embedding)]:
+            sumw = random.uniform(5.0, 50.0, num_bins)
+            if process in ("ZTT", "EMB", "ZLL"):
+                sumw *= 5.0
+            if channel == "mm":
+                sumw *= 100.0
+            shapes[(channel, category, process)] = (sumw, 0.05 * sumw)
+            if channel == "mt" and process == SIGNAL[embedding]:
+                sumw = sumw * scale_factors[category]
+            total += sumw
+        data = total if asimov else random.poisson(total).astype(float)
+        shapes[(channel, category, "data_obs")] = (data, total)
+    return shapes
+
+
+def injected(offset=0.0):
+    return dict((category, 0.9 + 0.1 * i + offset)
+                for i, category in enumerate(CATEGORIES))
+
+
+def numerical_gradient(function, x, epsilon=1e-6):
+    return np.array([(function(x + epsilon * unit) -
+                      function(x - epsilon * unit)) / (2.0 * epsilon)
+                     for unit in np.eye(len(x))]).T
+
+
+@pytest.mark.parametrize("embedding", [False, True])
+def test_derivatives(embedding):
+    shapes = synthetic_shapes(embedding, injected())
+    model = Model(shapes, "2017", CATEGORIES[:2], embedding)
+    x = model.initial + np.random.RandomState(2).normal(
+        0.0, 0.05, len(model.initial))
+    assert np.allclose(
+        model.gradient(x), numerical_gradient(model.nll, x), atol=1e-4)
+    assert np.allclose(
+        model.hessian(x), numerical_gradient(model.gradient, x), atol=1e-4)
+
+
+@pytest.mark.parametrize("embedding", [False, True])
+def test_batched_derivatives(embedding):
+    shapes = synthetic_shapes(embedding, injected())
+    model = BatchedModel(shapes, "2017", CATEGORIES, embedding)
+    x = model.initial + np.random.RandomState(3).normal(
+        0.0, 0.05, model.initial.shape)
+    flat = x.reshape(-1)
+
+    def nll(y):
+        return model.nll(y.reshape(x.shape)).sum()
+
+    def gradient(y):
+        return model.gradient(y.reshape(x.shape)).reshape(-1)
+
+    assert np.allclose(
+        model.gradient(x).reshape(-1),
+        numerical_gradient(nll, flat),
+        atol=1e-4)
+    numerical = numerical_gradient(gradient, flat)
+    for n in range(len(x)):
+        block = slice(n * x.shape[1], (n + 1) * x.shape[1])
+        assert np.allclose(
+            model.hessian(x)[n], numerical[block, block], atol=1e-4)
+
+
+@pytest.mark.parametrize("embedding", [False, True])
+def test_injected_scale_factors(embedding):
+    scale_factors = injected()
+    shapes = synthetic_shapes(embedding, scale_factors, asimov=True)
+    for category in CATEGORIES:
+        result = fit(Model(shapes, "2017", [category], embedding))
+        assert result.converged
+        name = "r_" + category
+        assert result.value(name) == pytest.approx(
+            scale_factors[category], abs=1e-5)
+        assert 0.0 < result.error(name) < 0.5
+
+
+@pytest.mark.parametrize("embedding", [False, True])
+def test_batched_fit_matches_sequential_fits(embedding):
+    shapes = synthetic_shapes(embedding, injected(offset=0.05))
+    batched = fit_batch(BatchedModel(shapes, "2017", CATEGORIES, embedding))
+    for category, result in zip(CATEGORIES, batched):
+        sequential = fit(Model(shapes, "2017", [category], embedding))
+        name = "r_" + category
+        assert result.converged
+        assert result.nll == pytest.approx(sequential.nll, abs=1e-6)
+        assert result.value(name) == pytest.approx(
+            sequential.value(name), abs=1e-5)
+        assert result.error(name) == pytest.approx(
+            sequential.error(name), rel=1e-4)
+        assert result.error(name) > 0.0
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests of the fine master grids and the rebinning to binning.yaml."""
+
+import os
+import sys
+
+import numpy as np
+import yaml
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tauid.columnar import fill_histogram
+from tauid.grid import align, grid_edges, rebin
+
+BINNING = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "binning.yaml")
+
+
+def binning():
+    with open(BINNING) as binning_file:
+        return yaml.safe_load(binning_file)
+
+
+def test_rebin_to_category_binnings():
+    configuration = binning()
+    random = np.random.RandomState(1)
+    values = random.uniform(-20.0, 320.0, 10000)
+    weights = random.uniform(-0.5, 2.0, 10000)
+    for category in configuration["categories"]["mt"].values():
+        grid = grid_edges(configuration["fine_binning"][category["expression"]])
+        edges = align([float(edge) for edge in category["bins"]], grid)
+        assert edges is not None
+        fine = fill_histogram(values, weights, np.asarray(grid))
+        coarse = fill_histogram(values, weights, np.asarray(edges))
+        for fine_sums, coarse_sums in zip(fine, coarse):
+            assert np.allclose(rebin(fine_sums, grid, edges), coarse_sums)
+
+
+def test_rebin_rows():
+    grid = [0.0, 1.0, 2.0, 3.0, 4.0]
+    sumw = np.arange(12.0).reshape(2, 6)
+    assert np.allclose(
+        rebin(sumw, grid, [1.0, 3.0]),
+        [[0.0 + 1.0, 2.0 + 3.0, 4.0 + 5.0], [6.0 + 7.0, 8.0 + 9.0,
+                                             10.0 + 11.0]])
+
+
+def test_align():
+    grid = grid_edges({"nbins": 300, "low": 0, "high": 300})
+    assert align([0, 5.0, 160], grid) == [0.0, 5.0, 160.0]
+    assert align([0, 7.5, 15], grid) is None
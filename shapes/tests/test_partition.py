@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Tests of disjoint categories filled as two-dimensional histograms."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+import yaml
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tauid import scheduler
+from tauid.columnar import fill_group
+from tauid.partition import (PartitioningBackend, disjoint, find_partitions,
+                             partition_spec)
+from tauid.specs import HistogramSpec
+
+from test_columnar import NUM_EVENTS, columns
+
+BINNING = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "binning.yaml")
+
+
+@pytest.mark.parametrize("first, second, expected", [
+    ("(pt_2 >= 20) && (pt_2 < 25)", "(pt_2 >= 25) && (pt_2 < 30)", True),
+    ("(pt_2 >= 20) && (pt_2 <= 25)", "(pt_2 >= 25) && (pt_2 < 30)", False),
+    ("(pt_2 >= 20) && (pt_2 < 30)", "(pt_2 >= 25) && (pt_2 < 35)", False),
+    ("(pt_2 >= 70)", "(pt_2 >= 50) && (pt_2 < 70)", True),
+    ("(pt_2 >= 70)", "(pt_2 >= 40)", False),
+    ("(pt_2 >= 20) && (pt_2 < 25) && (decayMode_2 == 0)",
+     "(pt_2 >= 20) && (pt_2 < 25) && (decayMode_2 == 1)", True),
+    ("(pt_2 >= 20) && (pt_2 < 25) && (decayMode_2 == 0)",
+     "(pt_2 >= 25) && (pt_2 < 30) && (decayMode_2 == 0)", True),
+    ("(decayMode_2 == 0) || (decayMode_2 == 1)", "decayMode_2 == 10", False),
+    ("20 <= pt_2 && 25 > pt_2", "pt_2 >= 25", True),
+    # Only comparisons of plain branches are understood, anything else is
+    # conservatively taken as overlapping
+    ("-pt_2 > -25", "pt_2 >= 25", False),
+    ("pt_1 > 25", "pt_2 < 25", False),
+])
+def test_disjoint(first, second, expected):
+    assert disjoint(first, second) == expected
+    assert disjoint(second, first) == expected
+
+
+def category_specs():
+    """Specs of the mt categories of binning.yaml."""
+    with open(BINNING) as binning_file:
+        binning = yaml.safe_load(binning_file)
+    specs = []
+    for name, category in sorted(binning["categories"]["mt"].items()):
+        specs.append(
+            HistogramSpec(
+                name=name,
+                files=["ntuple.root"],
+                folder="mt_nominal",
+                friend_files=[],
+                cuts=[("channel", "q_1*q_2<0"), ("category", category["cut"])],
+                weights=[("pu", "puweight")],
+                expression=category["expression"],
+                edges=category["bins"]))
+    return specs
+
+
+class ColumnarFiller(object):
+    def __init__(self, data):
+        self._data = data
+
+    def run(self, specs):
+        return fill_group(specs, self._data, NUM_EVENTS)
+
+
+def test_categories_of_binning():
+    specs = category_specs()
+    partitions = find_partitions(specs)
+    partitioned = [index for members in partitions for index in members]
+    assert len(partitioned) == len(set(partitioned))
+    # The inclusive category overlaps all others, all others are disjoint
+    # from some other category.
+    assert sorted(specs[index].name for index in set(
+        range(len(specs))) - set(partitioned)) == ["Inclusive"]
+    for members in partitions:
+        for i, first in enumerate(members):
+            for second in members[:i]:
+                assert disjoint(specs[first].cuts[-1][1],
+                                specs[second].cuts[-1][1])
+
+    data = columns()
+    partitioned = PartitioningBackend(ColumnarFiller(data)).run(specs)
+    for spec, (sumw, sumw2) in zip(specs, partitioned):
+        expected_sumw, expected_sumw2 = fill_group([spec], data,
+                                                   NUM_EVENTS)[0]
+        assert np.allclose(sumw, expected_sumw)
+        assert np.allclose(sumw2, expected_sumw2)
+
+
+def test_entries_of_partition():
+    specs = category_specs()
+    members = [specs[index] for index in find_partitions(specs)[0]]
+    data = columns()
+    fill_group([partition_spec(members)], data, NUM_EVENTS)
+    entries = scheduler._statistics["events_selected"][0]
+    fill_group(members, data, NUM_EVENTS)
+    assert entries == scheduler._statistics["events_selected"]
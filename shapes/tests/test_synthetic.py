@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Tests of the synthetic configuration against the 2017 era script.
+
+The era script needs shape_producer and can not be imported, so its
+processes, working points, categories and variations are read from its
+syntax tree. The categories of the mt channel are read from binning.yaml by
+both. A change of the era script which is not followed by tauid.synthetic
+fails these tests.
+"""
+
+import ast
+import os
+import sys
+
+import numpy as np
+import yaml
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tauid import synthetic
+
+DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ERA_SCRIPT = os.path.join(DIRECTORY, "produce_shapes_2017.py")
+BINNING = os.path.join(DIRECTORY, "binning.yaml")
+
+# Weights changed by the variations of the synthetic configuration
+PROBE = [(name, name) for name in ("prefireWeight", "zPtReweightWeight",
+                                   "topPtReweightWeight", "decayMode_SF")]
+
+
+def _effect(kind, name, expression, direction):
+    """Pipeline and weights of a variation applied to the probe weights."""
+    if kind == "DifferentPipeline":
+        return name + direction, tuple(PROBE)
+    if kind == "SquareAndRemoveWeight":
+        reweight = synthetic._square(
+            name) if direction == "Up" else synthetic._remove(name)
+    elif kind == "ReplaceWeight":
+        reweight = synthetic._replace(name, expression)
+    elif kind == "AddWeight":
+        reweight = synthetic._add(name, expression)
+    else:
+        return None
+    return "nominal", tuple(reweight(PROBE))
+
+
+class EraScript(ast.NodeVisitor):
+    """Definitions of the era script in the order of the script."""
+
+    def __init__(self, path):
+        self.dicts = {}
+        self.categories = {}
+        self.variations = []
+        self._lists = {}
+        with open(path) as script:
+            self.visit(ast.parse(script.read()))
+
+    def visit_Assign(self, node):
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                if isinstance(node.value, ast.Dict):
+                    self.dicts[target.id] = node.value
+                self._lists[target.id] = self._variations(node.value)
+        self.generic_visit(node)
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):
+            self._lists[node.target.id] = self._lists.get(
+                node.target.id, []) + self._variations(node.value)
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        function = node.func
+        if isinstance(function, ast.Attribute) and function.attr == "append" \
+                and isinstance(function.value, ast.Name) \
+                and function.value.id in self._lists:
+            self._lists[function.value.id] += self._variations(node.args[0])
+        if isinstance(function, ast.Name) and function.id == "Category":
+            try:
+                self.categories[ast.literal_eval(node.args[0])] = node
+            except ValueError:
+                # Categories of the goodness of fit variables
+                pass
+        self.generic_visit(node)
+
+    def visit_For(self, node):
+        if isinstance(node.target, ast.Name) and node.target.id == "variation":
+            variations = self._variations(node.iter)
+            for inner in ast.walk(node):
+                if isinstance(inner, ast.For) and isinstance(
+                        inner.iter, ast.List) and getattr(
+                            inner.target, "id", None) == "process_nick":
+                    processes = set(ast.literal_eval(inner.iter))
+                    self.variations += [(effect, processes)
+                                        for effect in variations]
+        self.generic_visit(node)
+
+    def _variations(self, node):
+        """Effects of the variations of an expression of the script."""
+        if isinstance(node, ast.Name):
+            return list(self._lists.get(node.id, []))
+        if isinstance(node, ast.BinOp):
+            return self._variations(node.left) + self._variations(node.right)
+        if isinstance(node, ast.List):
+            return [
+                effect for element in node.elts
+                for effect in self._variations(element)
+            ]
+        if not isinstance(node, ast.Call) or not isinstance(
+                node.func, ast.Name):
+            return []
+        try:
+            if node.func.id == "create_systematic_variations":
+                effects = [
+                    _effect(node.args[2].id, ast.literal_eval(node.args[1]),
+                            None, direction) for direction in ("Up", "Down")
+                ]
+            elif node.func.id in ("ReplaceWeight", "AddWeight"):
+                effects = [
+                    _effect(node.func.id, ast.literal_eval(node.args[1]),
+                            ast.literal_eval(node.args[2].args[0]),
+                            ast.literal_eval(node.args[3]))
+                ]
+            else:
+                return []
+        except ValueError:
+            # Names formed at runtime, e.g. of the fake factor variations
+            return []
+        return [effect for effect in effects if effect is not None]
+
+
+def era_script():
+    return EraScript(ERA_SCRIPT)
+
+
+def process_names(node):
+    return set(
+        ast.literal_eval(value.args[0]) for value in node.values
+        if isinstance(value, ast.Call) and value.func.id == "Process")
+
+
+def test_processes():
+    script = era_script()
+    for channel in ("mt", "mm"):
+        assert process_names(script.dicts[channel + "_processes"]) == set(
+            name for name, _, _ in synthetic._PROCESSES[channel])
+
+
+def test_working_points():
+    script = era_script()
+    branches = set(
+        ast.literal_eval(value)
+        for value in script.dicts["wp_dict_deeptau"].values) - set(["0<1"])
+    with open(BINNING) as binning_file:
+        binning = yaml.safe_load(binning_file)
+    specs = synthetic.benchmark_specs(
+        os.path.join(DIRECTORY, "missing"),
+        binning,
+        working_points=synthetic.WORKING_POINTS,
+        channels=("mt", ),
+        shifts=False)
+    assert set(cut for spec in specs for name, cut in spec.cuts
+               if name == "tau_iso") == set(branch + ">0.5"
+                                            for branch in branches)
+
+
+def test_categories():
+    script = era_script()
+    variable = dict((keyword.arg, keyword.value)
+                    for keyword in script.categories["control"].keywords)
+    variable = variable["variable"]
+    binning = variable.args[1]
+    assert binning.func.id == "ConstantBinning"
+    num_bins, low, high = [ast.literal_eval(arg) for arg in binning.args]
+    [(name, cuts, expression, edges)] = synthetic._categories("mm", None)
+    assert name == "control"
+    assert cuts == []
+    assert expression == ast.literal_eval(variable.args[2])
+    assert np.allclose(edges, np.linspace(low, high, num_bins + 1))
+
+    with open(BINNING) as binning_file:
+        binning = yaml.safe_load(binning_file)
+    categories = synthetic._categories("mt", binning)
+    assert sorted(name for name, _, _, _ in categories) == sorted(
+        binning["categories"]["mt"])
+
+
+def test_variations():
+    script = era_script()
+    for name, processes, pipeline, reweight in synthetic._variations():
+        effect = (pipeline, tuple(reweight(PROBE) if reweight else PROBE))
+        assert set(processes) in [
+            era_processes for era_effect, era_processes in script.variations
+            if era_effect == effect
+        ], name
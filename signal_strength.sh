@@ -4,6 +4,8 @@ ERA=$1
 CATEGORIES=$2
 FITKIND=$3
 EMBEDDING=$4
+# Optional: only the datacards of the working point given by $WORKING_POINT
+WORKING_POINT=${WORKING_POINT:-*}
 
 source utils/setup_cmssw.sh
 
@@ -13,7 +15,11 @@ then
     SUFFIX="EMB"
 fi
 
-INPUT=${PWD}/output/${ERA}_tauid_*${CATEGORIES}_${SUFFIX}
+INPUT=${PWD}/output/${ERA}_tauid_${WORKING_POINT}_${CATEGORIES}_${SUFFIX}
+
+# Fits of unchanged workspaces with unchanged options are restored from the
+# fit cache, see cached_fit.py
+CACHED_FIT="python $(dirname $(readlink -f $0))/cached_fit.py --cache-directory ${FIT_CACHE_DIRECTORY:-${PWD}/fit_cache}"
 
 # Set stack size to unlimited, otherwise the T2W tool throws a segfault if
 # combining all eras
@@ -57,7 +63,8 @@ if [ "$EMBEDDING" == 1 ]
 then
     if [ "$FITKIND" == "robustHesse" ]
     then
-        combineTool.py -M FitDiagnostics -m 125 -d ${INPUT}/htt_mt*/combined.txt.cmb.root \
+        $CACHED_FIT --outputs "fitDiagnostics${ERA}.root" "higgsCombine${ERA}.FitDiagnostics.mH125.root" -- \
+            combineTool.py -M FitDiagnostics -m 125 -d ${INPUT}/htt_mt*/combined.txt.cmb.root \
             --robustFit 1 -n $ERA -v1 \
             --robustHesse 1 \
             --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
@@ -73,7 +80,8 @@ then
 
     if [ "$FITKIND" == "inclusive" ] || [ "$FITKIND" == "pt_binned" ] || [ "$FITKIND" == "ptdm_binned" ] || [ "$FITKIND" == "dm_binned" ]
     then
-        combineTool.py -M MultiDimFit -m 125 -d ${INPUT}/htt_mt*/combined.txt.cmb.root \
+        $CACHED_FIT --outputs "higgsCombine${ERA}.MultiDimFit.mH125.root" -- \
+            combineTool.py -M MultiDimFit -m 125 -d ${INPUT}/htt_mt*/combined.txt.cmb.root \
             --algo singles --robustFit 1 \
             --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
             --setParameterRanges CMS_htt_doublemutrg_Run${ERA}=$RANGE \
@@ -89,7 +97,8 @@ then
 else
     if [ "$FITKIND" == "robustHesse" ]
     then
-        combineTool.py -M FitDiagnostics -m 125 -d ${INPUT}/htt_mt*/combined.txt.cmb.root \
+        $CACHED_FIT --outputs "fitDiagnostics${ERA}.root" "higgsCombine${ERA}.FitDiagnostics.mH125.root" -- \
+            combineTool.py -M FitDiagnostics -m 125 -d ${INPUT}/htt_mt*/combined.txt.cmb.root \
             --robustFit 1 -n $ERA -v1 \
             --robustHesse 1 \
             --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
@@ -105,7 +114,8 @@ else
 
     if [ "$FITKIND" == "inclusive" ] || [ "$FITKIND" == "pt_binned" ] || [ "$FITKIND" == "ptdm_binned" ] || [ "$FITKIND" == "dm_binned" ]
     then
-        combineTool.py -M MultiDimFit -m 125 -d ${INPUT}/htt_mt*/combined.txt.cmb.root \
+        $CACHED_FIT --outputs "higgsCombine${ERA}.MultiDimFit.mH125.root" -- \
+            combineTool.py -M MultiDimFit -m 125 -d ${INPUT}/htt_mt*/combined.txt.cmb.root \
             --algo singles --robustFit 1 \
             --X-rtd MINIMIZER_analytic --cminDefaultMinimizerStrategy 0 \
             --floatOtherPOIs 1 \